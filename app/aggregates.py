@@ -0,0 +1,99 @@
+"""
+Mergeable message aggregates for WhatsApp Chat Analysis
+
+Word and emoji counters for 'Overall' and every user, built in one pass over
+the chat. Counters can be updated with new messages (add) and have messages
+taken back out (subtract), so an export that only grew since the last
+analysis never recounts its old messages (see app/incremental.py).
+
+Counters keep first-appearance order for ties, which is the order
+pd.Series.value_counts() uses, so the results match most_common_words() and
+emoji_analysis() exactly.
+"""
+
+from collections import Counter
+import emoji
+import numpy as np
+import pandas as pd
+from wordcloud import STOPWORDS
+
+MEDIA_MESSAGE = '<Media omitted>'
+
+
+class MessageAggregates:
+
+    def __init__(self):
+        self.words = {'Overall': Counter()}
+        self.emojis = {'Overall': Counter()}
+
+    @classmethod
+    def from_frame(cls, df):
+        aggregates = cls()
+        aggregates.add(df)
+        return aggregates
+
+    def add(self, df):
+        """Counts the messages of df (appended after those already counted)."""
+        for user, words in self._word_lists(df):
+            self._counter(self.words, user).update(words)
+            self.words['Overall'].update(words)
+        for user, emojis in self._emoji_lists(df):
+            self._counter(self.emojis, user).update(emojis)
+            self.emojis['Overall'].update(emojis)
+
+    def subtract(self, df):
+        """Removes previously counted messages."""
+        for counters, items in ((self.words, self._word_lists(df)), (self.emojis, self._emoji_lists(df))):
+            changed = {'Overall'}
+            for user, values in items:
+                self._counter(counters, user).subtract(values)
+                counters['Overall'].subtract(values)
+                changed.add(user)
+            for user in changed:
+                # Unary plus drops zero counts and keeps the order of the rest
+                counters[user] = +counters[user]
+
+    def most_common_words(self, selected_user='Overall', top_n=20):
+        """Same result as analytics.most_common_words on the user's frame."""
+        return self._top(self.words, selected_user, top_n)
+
+    def emoji_analysis(self, selected_user='Overall', top_n=10):
+        """Same result as analytics.emoji_analysis on the user's frame."""
+        return self._top(self.emojis, selected_user, top_n)
+
+    @staticmethod
+    def _top(counters, user, top_n):
+        counter = counters.get(user)
+        if not counter:
+            return pd.Series([], dtype=int)
+        return pd.Series(dict(counter.most_common(top_n)))
+
+    @staticmethod
+    def _counter(counters, user):
+        if user not in counters:
+            counters[user] = Counter()
+        return counters[user]
+
+    @staticmethod
+    def _word_lists(df):
+        # Same filtering and tokenization as most_common_words
+        rows = df[(df['user'] != 'group_notification') & (df['message'] != MEDIA_MESSAGE)]
+        for user, msg in zip(rows['user'], rows['message']):
+            yield user, [word for word in msg.lower().split() if word not in STOPWORDS]
+
+    @staticmethod
+    def _emoji_lists(df):
+        # One emoji scan over the joined text (as emoji_analysis does); each
+        # match belongs to the message it starts in
+        rows = df[df['message'].notna()]
+        if rows.empty:
+            return
+        messages = rows['message'].tolist()
+        ends = np.cumsum([len(msg) for msg in messages])
+        matches = emoji.emoji_list("".join(messages))
+        if not matches:
+            return
+        owners = np.searchsorted(ends, [match['match_start'] for match in matches], side='right')
+        users = rows['user'].to_numpy()
+        for owner, match in zip(owners, matches):
+            yield users[owner], [match['emoji']]
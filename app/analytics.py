@@ -50,7 +50,11 @@ def most_active_users(df, top_n=10):
     df = df[df['user'] != 'group_notification']
     return df['user'].value_counts().head(top_n)
 
-def count_links(df, selected_user='Overall'):
+def count_links(df, selected_user='Overall', features=None):
+    # A DailyFeatureStore already ran the URL regex over the whole chat
+    if features is not None:
+        return int(features.for_user(selected_user)['link_count'].sum())
+
     if selected_user != 'Overall' and not (df['user'] == selected_user).all():
         df = df[df['user'] == selected_user]
 
@@ -60,14 +64,15 @@ def count_links(df, selected_user='Overall'):
 
     return int(link_count)
 
-def daily_timeline(df, selected_user="Overall"):
+def daily_timeline(df, selected_user="Overall", features=None):
+    if features is not None:
+        return features.timeline(selected_user)
+
     if selected_user != 'Overall' and not (df['user'] == selected_user).all():
         df = df[df['user'] == selected_user]
 
-    df = df.copy()
-    df['only_date'] = df['date'].dt.date
-
-    timeline = df.groupby('only_date').size().reset_index(name='message_count')
+    # Grouping by a derived Series leaves the caller's frame uncopied and unchanged
+    timeline = df.groupby(df['date'].dt.date.rename('only_date')).size().reset_index(name='message_count')
 
     return timeline
 
@@ -112,11 +117,10 @@ def quarterly_activity(df, selected_user="Overall"):
     if selected_user != "Overall" and not (df['user'] == selected_user).all():
         df = df[df['user'] == selected_user]
 
-    df = df.copy()
-    df['quarter'] = df['date'].dt.to_period('Q').astype(str)
+    quarter = df['date'].dt.to_period('Q').astype(str).rename('quarter')
 
     quarterly = (
-        df.groupby('quarter')
+        df.groupby(quarter)
           .size()
           .reset_index(name='message_count')
           .sort_values('quarter')
@@ -264,19 +268,18 @@ def response_time_analysis(df, selected_user='Overall'):
 
     return avg_times
 
-def conversation_initiator(df, selected_user='Overall'):
-    # Expects FULL dataframe for correct context
-    df_clean = df[df['user'] != 'group_notification']
-    
-    # Assuming df is sorted
-    df_clean = df_clean.copy()
-    df_clean['only_date'] = df_clean['date'].dt.date
-
-    # First message of each day
-    first_messages = df_clean.groupby('only_date').first()
+def conversation_initiator(df, selected_user='Overall', features=None):
+    # Expects FULL dataframe (or its DailyFeatureStore) for correct context
+    if features is not None:
+        initiator_counts = features.initiators()
+    else:
+        df_clean = df[df['user'] != 'group_notification']
+        
+        # First message of each day (assuming df is sorted)
+        first_messages = df_clean.groupby(df_clean['date'].dt.date).first()
 
-    # Count initiators
-    initiator_counts = first_messages['user'].value_counts()
+        # Count initiators
+        initiator_counts = first_messages['user'].value_counts()
     
     if selected_user != 'Overall':
         if selected_user in initiator_counts:
@@ -0,0 +1,170 @@
+"""
+Chat exports uploaded as zips.
+
+WhatsApp's "export with media" zips the chat text (_chat.txt, or "WhatsApp
+Chat with <name>.txt") together with every photo, video and voice note the
+chat refers to. Only the chat entries are decompressed, a chunk at a time
+from the upload's spooled file; media members are never read. They are
+only counted by type from the zip directory, which fills in what the
+'<Media omitted>' lines of a text-only export leave out.
+"""
+
+import io
+import os
+import zipfile
+import zlib
+from functools import partial
+
+# Largest chat (uncompressed) read from a zip; the zip directory can under-report it
+MAX_CHAT_BYTES = int(os.environ.get('CHATLYTICS_MAX_CHAT_MB', 200)) * 1024 * 1024
+CHUNK_BYTES = 1024 * 1024
+
+# Media types by WhatsApp file name: Android (IMG-20230101-WA0001.jpg,
+# PTT-...opus) and iOS (00000012-PHOTO-2023-01-01-10-00-00.jpg) markers first,
+# then the extension
+MEDIA_MARKERS = (
+    ("sticker", ("STK-", "-STICKER-")),
+    ("audio", ("AUD-", "PTT-", "-AUDIO-")),
+    ("video", ("VID-", "-VIDEO-", "-GIF-")),
+    ("image", ("IMG-", "-PHOTO-")),
+    ("contact", ("-CONTACT-",)),
+    ("document", ("DOC-",)),
+)
+MEDIA_EXTENSIONS = {
+    "image": ('.jpg', '.jpeg', '.png', '.heic', '.gif'),
+    "sticker": ('.webp',),
+    "video": ('.mp4', '.mov', '.3gp', '.mkv', '.webm', '.avi'),
+    "audio": ('.opus', '.m4a', '.mp3', '.aac', '.ogg', '.amr', '.wav'),
+    "contact": ('.vcf',),
+    "document": ('.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.csv', '.txt', '.zip'),
+}
+
+
+class ChatArchiveError(ValueError):
+    """The zip is corrupt, or holds no chat export, or several when one was expected."""
+
+
+class ChatTooLargeError(ValueError):
+    """A chat in a zip is larger than MAX_CHAT_BYTES uncompressed."""
+
+
+def is_zip(upload):
+    """Whether upload (bytes or a seekable binary file) is a zip; a file is rewound."""
+    if isinstance(upload, bytes):
+        return zipfile.is_zipfile(io.BytesIO(upload))
+    try:
+        return zipfile.is_zipfile(upload)
+    finally:
+        upload.seek(0)
+
+def read_chat(filename, upload):
+    """
+    (chat bytes, media type counts) of a single-chat upload: the file itself
+    with None for the counts, or the chat entry of a zip with the counts of
+    every other member, e.g. {"image": 120, "audio": 14}. Raises
+    ChatArchiveError when the zip has no chat, or several and none named as
+    a WhatsApp export.
+    """
+    if not is_zip(upload):
+        return (upload if isinstance(upload, bytes) else upload.read()), None
+    with _open(filename, upload) as archive:
+        chats, others = _members(archive)
+        chat = _chat_entry(filename, chats)
+        others.extend(entry for entry in chats if entry is not chat)
+        return _read_entry(archive, chat, filename), media_types(others)
+
+def chat_sources(filename, upload):
+    """
+    [(name, size, read)] of the chats in one batch upload, listed from the
+    zip directory without decompressing anything: the file itself, or each
+    .txt member of a zip, named filename/member (media is skipped). size is
+    the uncompressed size the directory claims; read() returns the chat
+    bytes, so the upload must stay open until every chat was read. Raises
+    ChatTooLargeError for a member claiming more than MAX_CHAT_BYTES.
+    """
+    if not is_zip(upload):
+        if isinstance(upload, bytes):
+            return [(filename, len(upload), lambda: upload)]
+        size = upload.seek(0, os.SEEK_END)
+        upload.seek(0)
+        return [(filename, size, partial(_read_file, upload))]
+    # Left open for the readers (closing it would not close the upload anyway);
+    # ZipFile serializes their reads of the shared file
+    archive = _open(filename, upload)
+    chats, _ = _members(archive)
+    for entry in chats:
+        if entry.file_size > MAX_CHAT_BYTES:
+            raise ChatTooLargeError(f"{filename}/{entry.filename} is larger than {MAX_CHAT_BYTES // 2**20} MB")
+    return [(f"{filename}/{entry.filename}", entry.file_size, partial(_read_entry, archive, entry, filename)) for entry in chats]
+
+def media_types(entries):
+    """Counts of zip members by media type (sticker, audio, video, image, contact, document, other)."""
+    counts = {}
+    for entry in entries:
+        kind = _media_type(entry.filename)
+        counts[kind] = counts.get(kind, 0) + 1
+    return dict(sorted(counts.items()))
+
+def _media_type(path):
+    name = os.path.basename(path).upper()
+    for kind, markers in MEDIA_MARKERS:
+        if any(marker in name for marker in markers):
+            return kind
+    extension = os.path.splitext(name)[1].lower()
+    for kind, extensions in MEDIA_EXTENSIONS.items():
+        if extension in extensions:
+            return kind
+    return "other"
+
+def _read_file(upload):
+    upload.seek(0)
+    return upload.read()
+
+def _open(filename, upload):
+    try:
+        return zipfile.ZipFile(io.BytesIO(upload) if isinstance(upload, bytes) else upload)
+    except zipfile.BadZipFile as e:
+        raise ChatArchiveError(f"{filename} is not a readable zip: {e}")
+
+def _members(archive):
+    """(.txt members, other files) of the archive, without directories and macOS metadata."""
+    chats, others = [], []
+    for entry in archive.infolist():
+        if entry.is_dir() or entry.filename.startswith('__MACOSX/'):
+            continue
+        (chats if entry.filename.lower().endswith('.txt') else others).append(entry)
+    return chats, others
+
+def _chat_entry(filename, chats):
+    if len(chats) == 1:
+        return chats[0]
+    named = [entry for entry in chats if _is_export_name(entry.filename)]
+    if len(named) == 1:
+        return named[0]
+    if not chats:
+        raise ChatArchiveError(f"{filename} has no chat export (.txt) in it.")
+    raise ChatArchiveError(f"{filename} has {len(chats)} chat exports in it; upload it to /analyze/batch to analyze each one.")
+
+def _is_export_name(path):
+    name = os.path.basename(path)
+    return name == '_chat.txt' or name.startswith('WhatsApp Chat')
+
+def _read_entry(archive, entry, filename):
+    # Decompresses in chunks and stops at the limit whatever size the directory claims
+    if entry.file_size > MAX_CHAT_BYTES:
+        raise ChatTooLargeError(f"{filename}/{entry.filename} is larger than {MAX_CHAT_BYTES // 2**20} MB")
+    chunks, size = [], 0
+    try:
+        with archive.open(entry) as member:
+            while True:
+                chunk = member.read(CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_CHAT_BYTES:
+                    raise ChatTooLargeError(f"{filename}/{entry.filename} is larger than {MAX_CHAT_BYTES // 2**20} MB")
+                chunks.append(chunk)
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, RuntimeError) as e:
+        # Bad CRC, truncated or undecodable data, an unsupported compression method or encryption
+        raise ChatArchiveError(f"{filename}/{entry.filename} could not be read from the zip: {e}")
+    return b"".join(chunks)
@@ -0,0 +1,113 @@
+"""
+Batch analysis of many chat exports in one request (POST /analyze/batch).
+
+Every uploaded file, and every .txt export inside an uploaded zip, is one
+chat. Chats go to the analysis worker pool, whose workers already loaded
+the sentiment lexicon and keep their topic and incremental-parse state
+between chats. They take the same analysis slots as /analyze calls (see
+app.main.run_analysis), and a batch queues at most one chat per worker at
+a time, so /analyze calls are not stuck behind the whole batch and the
+rest of the batch can still be cancelled. Results are streamed back as
+newline-delimited JSON in the order chats finish. Each line is one chat:
+
+    {"index":0,"filename":"a.txt","status":"done","cached":false,"seconds":2.1,"result":{...}}
+    {"index":1,"filename":"b.txt","status":"failed","error":"No messages found..."}
+
+The last line is a summary: {"summary":{"chats":2,"done":1,"failed":1,"cached":0,"seconds":2.3}}.
+"result" is the same body /analyze returns, and shares its cache entries.
+"""
+
+import asyncio
+import json
+import os
+import time
+import traceback
+from functools import partial
+from fastapi import HTTPException
+from app.archive import ChatArchiveError, ChatTooLargeError
+from app.cache import get_cache, content_key
+from app.metrics import StageTimer, record
+from app.pipeline import analyze_chat_bytes, ANALYSIS_WORKERS, EmptyChatError, InvalidOptionError
+
+# Chats accepted in one batch, and their total size (uncompressed, as the zip directories claim)
+BATCH_MAX_CHATS = int(os.environ.get('CHATLYTICS_BATCH_MAX_CHATS', 500))
+BATCH_MAX_BYTES = int(os.environ.get('CHATLYTICS_BATCH_MAX_MB', 1024)) * 1024 * 1024
+
+
+def render(body):
+    """The exact bytes JSONResponse sends for body, so batch and /analyze share cache entries."""
+    return json.dumps(body, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+def analyze_chat_rendered(raw_data, sections=None, users=None):
+    """Worker entry point for one batch chat: the rendered response body and its StageTimer."""
+    timer = StageTimer()
+    body = analyze_chat_bytes(raw_data, timer=timer, sections=sections, users=users)
+    with timer.stage("serialize"):
+        return render(body), timer
+
+async def stream_batch(chats, run, task=analyze_chat_rendered, variant='', in_flight=None):
+    """
+    Analyzes (name, read) chats (app.archive.chat_sources) by task, with at
+    most in_flight (default: one per worker) read into memory and waiting for
+    or holding an analysis slot, and yields one NDJSON line per chat as it
+    finishes, then the summary line. run(raw_data, task) is the coroutine
+    that admits and runs one analysis (app.main.run_analysis). Cancelling the
+    iteration (the client went away) cancels the chats not yet started.
+    """
+    loop = asyncio.get_running_loop()
+    cache = get_cache()
+    slots = asyncio.Semaphore(in_flight or max(1, ANALYSIS_WORKERS))
+    started = time.perf_counter()
+    counts = {"done": 0, "failed": 0, "cached": 0}
+
+    async def analyze(index, filename, read):
+        meta = {"index": index, "filename": filename}
+        async with slots:
+            chat_started = time.perf_counter()
+            error = None
+            try:
+                raw_data = await loop.run_in_executor(None, read)
+            except (ChatArchiveError, ChatTooLargeError) as e:
+                error = str(e)
+            if error is None and cache is not None:
+                key = await loop.run_in_executor(None, partial(content_key, raw_data, variant=variant))
+                body = await loop.run_in_executor(None, cache.get, key)
+                if body is not None:
+                    counts["done"] += 1
+                    counts["cached"] += 1
+                    return _done_line(meta, body, True, time.perf_counter() - chat_started)
+            if error is None:
+                try:
+                    body, timer = await run(raw_data, task)
+                except HTTPException as e:
+                    # The worker pool died mid-analysis (run already replaced it)
+                    error = e.detail
+                except (EmptyChatError, InvalidOptionError) as e:
+                    error = str(e)
+                except Exception as e:
+                    print(f"Error analyzing batch chat {filename}:")
+                    traceback.print_exc()
+                    error = str(e)
+        if error is not None:
+            counts["failed"] += 1
+            return render({**meta, "status": "failed", "error": error}) + b"\n"
+        record(timer)
+        if cache is not None:
+            await loop.run_in_executor(None, cache.put, key, body)
+        counts["done"] += 1
+        return _done_line(meta, body, False, time.perf_counter() - chat_started)
+
+    tasks = [asyncio.ensure_future(analyze(index, filename, read)) for index, (filename, read) in enumerate(chats)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+        summary = dict(chats=len(chats), **counts, seconds=round(time.perf_counter() - started, 3))
+        yield render({"summary": summary}) + b"\n"
+    finally:
+        for pending in tasks:
+            pending.cancel()
+
+def _done_line(meta, body, cached, seconds):
+    # The rendered body is spliced in as is instead of being parsed and re-encoded
+    head = render({**meta, "status": "done", "cached": cached, "seconds": round(seconds, 3)})
+    return head[:-1] + b',"result":' + body + b"}\n"
@@ -0,0 +1,262 @@
+"""
+Content-addressed caches keyed by the SHA-256 of the raw upload.
+
+ResultCache keeps /analyze responses as the exact JSON bytes that were sent,
+in a small in-memory LRU in front of a size-bounded directory of gzip files.
+Responses restricted with sections=/users= are keyed by those options too.
+Bumping ANALYTICS_VERSION whenever analytics output changes invalidates
+every cached response.
+
+FrameCache keeps the parsed, sentiment-scored message frame as an Arrow IPC
+file, so a chat analyzed again (with other options, or after an analytics
+change) skips parsing, date conversion and VADER. Its files are checked
+against FRAME_VERSION.
+"""
+
+import gzip
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Bump on any change to the /analyze output
+ANALYTICS_VERSION = "2"
+# Bump on any change to the columns or dtypes of the parsed frame
+FRAME_VERSION = "1"
+
+CACHE_ENABLED = os.environ.get('CHATLYTICS_CACHE', '1') != '0'
+CACHE_DIR = os.environ.get('CHATLYTICS_CACHE_DIR', os.path.join('.cache', 'results'))
+# Responses kept in memory, and total size of the compressed responses on disk
+CACHE_MEMORY_ITEMS = int(os.environ.get('CHATLYTICS_CACHE_MEMORY_ITEMS', 32))
+CACHE_DISK_BYTES = int(os.environ.get('CHATLYTICS_CACHE_DISK_MB', 512)) * 1024 * 1024
+
+FRAME_CACHE_ENABLED = os.environ.get('CHATLYTICS_FRAME_CACHE', '1') != '0'
+FRAME_CACHE_DIR = os.environ.get('CHATLYTICS_FRAME_CACHE_DIR', os.path.join('.cache', 'frames'))
+FRAME_CACHE_BYTES = int(os.environ.get('CHATLYTICS_FRAME_CACHE_MB', 1024)) * 1024 * 1024
+
+_FRAME_VERSION_KEY = b'chatlytics_frame_version'
+
+
+def content_key(raw_data, version=ANALYTICS_VERSION, variant=''):
+    # variant (e.g. app.pipeline.options_variant) separates differently computed results of one upload
+    prefix = version.encode() + b"\0" + (variant.encode('utf-8') + b"\0" if variant else b"")
+    return hashlib.sha256(prefix + raw_data).hexdigest()
+
+
+class _DiskLRU:
+    """
+    Directory of cache files whose modification time records their last use,
+    trimmed to disk_bytes oldest-first. Each version gets its own
+    subdirectory; those of other versions are deleted on startup.
+    """
+
+    SUFFIX = ''
+
+    def __init__(self, directory, version, disk_bytes):
+        self.disk_bytes = disk_bytes
+        self.directory = os.path.join(directory, f"v{version}")
+        self._lock = threading.Lock()
+        self._drop_other_versions(directory)
+        os.makedirs(self.directory, exist_ok=True)
+        # Bytes on disk as of the last write or eviction pass, so metrics never list the directory
+        self._disk_used = sum(size for _, size, _ in self._disk_entries())
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+        self._disk_used = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def _write(self, key, write):
+        """Calls write(file) on a temp file, then renames it into place so readers never see a partial file."""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        self._evict_disk()
+        return True
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        return entries
+
+    def _evict_disk(self):
+        entries = sorted(self._disk_entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in entries:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            total -= size
+            with self._lock:
+                self.stats["evictions"] += 1
+        self._disk_used = total
+
+    def _drop_other_versions(self, directory):
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if name.startswith('v') and path != self.directory and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+class ResultCache(_DiskLRU):
+    """
+    Two-tier LRU of serialized responses: memory first, then gzip files.
+    """
+
+    SUFFIX = '.json.gz'
+
+    def __init__(self, directory=CACHE_DIR, memory_items=CACHE_MEMORY_ITEMS, disk_bytes=CACHE_DISK_BYTES):
+        super().__init__(directory, ANALYTICS_VERSION, disk_bytes)
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        """Stored response bytes for key, or None."""
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return body
+
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path)
+        except (OSError, EOFError):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self.stats["disk_hits"] += 1
+            self._remember(key, body)
+        return body
+
+    def put(self, key, body):
+        with self._lock:
+            self.stats["stores"] += 1
+            self._remember(key, body)
+
+        def write(raw):
+            with gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=6) as f:
+                f.write(body)
+        self._write(key, write)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        super().clear()
+
+    def metrics(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["memory_items"] = len(self._memory)
+        stats["disk_bytes"] = self._disk_used
+        return stats
+
+    def _remember(self, key, body):
+        self._memory[key] = body
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+
+class FrameCache(_DiskLRU):
+    """
+    Parsed chats (preprocess_whatsapp_text + attach_sentiment_to_df) as
+    uncompressed Arrow IPC files, memory-mapped back in on a hit.
+    """
+
+    SUFFIX = '.arrow'
+
+    def __init__(self, directory=FRAME_CACHE_DIR, disk_bytes=FRAME_CACHE_BYTES):
+        super().__init__(directory, FRAME_VERSION, disk_bytes)
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    def get(self, key):
+        """Cached frame for key, or None."""
+        path = self._path(key)
+        try:
+            with pa.memory_map(path) as source:
+                table = pa.ipc.open_file(source).read_all()
+                # Files written for another frame layout are misses
+                if (table.schema.metadata or {}).get(_FRAME_VERSION_KEY) != FRAME_VERSION.encode():
+                    raise pa.ArrowInvalid("frame version mismatch")
+                df = table.to_pandas()
+            os.utime(path)
+        except (OSError, pa.ArrowInvalid):
+            with self._lock:
+                self.stats["misses"] += 1
+            return None
+
+        with self._lock:
+            self.stats["hits"] += 1
+        return df
+
+    def put(self, key, df):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[_FRAME_VERSION_KEY] = FRAME_VERSION.encode()
+        table = table.replace_schema_metadata(metadata)
+
+        def write(f):
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        if self._write(key, write):
+            with self._lock:
+                self.stats["stores"] += 1
+
+
+_cache = None
+
+def get_cache():
+    """Process-wide ResultCache, or None when CHATLYTICS_CACHE=0."""
+    global _cache
+    if not CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
+
+
+_frame_cache = None
+
+def get_frame_cache():
+    """Process-wide FrameCache, or None when CHATLYTICS_FRAME_CACHE=0 or pyarrow is missing."""
+    global _frame_cache
+    if not FRAME_CACHE_ENABLED or pa is None:
+        return None
+    if _frame_cache is None:
+        _frame_cache = FrameCache()
+    return _frame_cache
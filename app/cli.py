@@ -0,0 +1,263 @@
+"""
+Offline analysis of many chat exports, without the HTTP layer.
+
+    python -m app.cli analyze exports/*.txt --jobs 16 --out results/
+    python -m app.cli analyze exports/ --tables timelines,sentiment --out results/
+
+Each input is an export, a zip of exports (every .txt entry is a chat) or a
+directory holding them. Chats are analyzed in parallel by --jobs worker
+processes running the same pipeline as /analyze (preprocess_whatsapp_text,
+attach_sentiment_to_df and the analytics functions), but only the sections
+the requested tables need are computed and nothing is encoded as JSON. Written
+to --out:
+
+    timelines.parquet  chat, user, granularity (daily ... yearly), period, message_count
+    users.parquet      chat, user, message, word, media and link counts, reply time,
+                       conversations started, busiest hour, health score and rating
+    sentiment.parquet  chat, user, message count, positive/neutral/negative %, average compound
+    summary.json       run totals and one entry per chat (messages, seconds or error)
+
+Each table has one row set per chat and user view, "Overall" included. The
+exit status is 1 when any chat failed; the other chats are still written.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from app.archive import chat_sources, ChatArchiveError, ChatTooLargeError
+from app.metrics import StageTimer
+from app.pipeline import analyze_chat_bytes, warm_up, worker_context, EmptyChatError, InvalidOptionError
+
+# Timeline sections: granularity name and the column holding the period
+TIMELINES = {
+    "daily_timeline": ("daily", "only_date"),
+    "hourly_activity": ("hourly", "hour"),
+    "weekly_activity": ("weekly", "day"),
+    "monthly_activity": ("monthly", "month"),
+    "quarterly_activity": ("quarterly", "quarter"),
+    "yearly_activity": ("yearly", "year"),
+}
+# Output tables and the analytics sections each is built from
+TABLES = {
+    "timelines": tuple(TIMELINES),
+    "users": ("basic_stats", "links_shared", "response_time_analysis", "conversation_initiator",
+              "most_busy_hour", "chat_health"),
+    "sentiment": ("sentiment_analysis",),
+}
+# Column order of each table (also used when a table has no rows)
+COLUMNS = {
+    "timelines": ["chat", "user", "granularity", "period", "message_count"],
+    "users": ["chat", "user", "messages", "words", "media", "links", "avg_response_minutes",
+              "conversations_started", "busiest_hour", "health_score", "health_rating"],
+    "sentiment": ["chat", "user", "messages", "positive_percentage", "neutral_percentage",
+                  "negative_percentage", "average_compound"],
+}
+EXPORT_SUFFIXES = ('.txt', '.zip')
+
+
+def collect_inputs(paths):
+    """
+    Export files named by paths, in order: files as given, the .txt and .zip
+    files of directories (sorted), and glob patterns the shell left unexpanded.
+    Raises FileNotFoundError for a path that matches nothing.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if name.lower().endswith(EXPORT_SUFFIXES) and os.path.isfile(os.path.join(path, name))
+            ))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            matches = sorted(glob.glob(path))
+            if not matches:
+                raise FileNotFoundError(f"No such export: {path}")
+            files.extend(collect_inputs(matches))
+    # An export named twice (e.g. by a pattern and its directory) is analyzed once
+    return list(dict.fromkeys(files))
+
+def chat_tables(chat, body):
+    """Rows of each output table for one analyzed chat (an /analyze body)."""
+    rows = {name: [] for name in TABLES}
+    for user in body["users"]:
+        analytics = body["analytics"][user]
+        for section, (granularity, column) in TIMELINES.items():
+            for point in analytics.get(section, ()):
+                rows["timelines"].append({
+                    "chat": chat, "user": user, "granularity": granularity,
+                    "period": str(point[column]), "message_count": point["message_count"],
+                })
+        if "basic_stats" in analytics:
+            stats = analytics["basic_stats"]
+            health = analytics.get("chat_health", {})
+            rows["users"].append({
+                "chat": chat, "user": user,
+                "messages": stats.get("Total Number of Messages"),
+                "words": stats.get("Total Number of Words"),
+                "media": stats.get("Total Number of Media Messages"),
+                "links": analytics.get("links_shared"),
+                # Per-user dicts: Overall has no single reply time, and starts every conversation
+                "avg_response_minutes": analytics.get("response_time_analysis", {}).get(user),
+                "conversations_started": _conversations_started(analytics.get("conversation_initiator"), user),
+                "busiest_hour": analytics.get("most_busy_hour"),
+                "health_score": health.get("score"),
+                "health_rating": health.get("rating"),
+            })
+        if "sentiment_analysis" in analytics:
+            sentiment = analytics["sentiment_analysis"]
+            rows["sentiment"].append({
+                "chat": chat, "user": user,
+                "messages": sentiment.get("total_messages"),
+                "positive_percentage": sentiment.get("positive_percentage"),
+                "neutral_percentage": sentiment.get("neutral_percentage"),
+                "negative_percentage": sentiment.get("negative_percentage"),
+                "average_compound": sentiment.get("average_compound"),
+            })
+    return rows
+
+def _conversations_started(initiators, user):
+    if initiators is None:
+        return None
+    if user == "Overall":
+        return sum(initiators.values())
+    return initiators.get(user, 0)
+
+def analyze_export(path, sections, cached=True):
+    """
+    Worker entry point: analyzes every chat in one export file. Returns one
+    result per chat: {"chat", "status", ...} with the table rows when done,
+    or the error when the chat failed.
+    """
+    try:
+        f = open(path, 'rb')
+    except OSError as e:
+        return [{"chat": path, "status": "failed", "error": str(e)}]
+    with f:
+        try:
+            # Chats of a zip are read one at a time, and its media not at all
+            chats = chat_sources(path, f)
+        except Exception as e:
+            return [{"chat": path, "status": "failed", "error": str(e)}]
+        results = []
+        for chat, _, read in chats:
+            started = time.perf_counter()
+            timer = StageTimer()
+            try:
+                body = analyze_chat_bytes(read(), timer=timer, cached=cached, sections=sections)
+            except (EmptyChatError, InvalidOptionError, ChatArchiveError, ChatTooLargeError) as e:
+                results.append({"chat": chat, "status": "failed", "error": str(e)})
+                continue
+            except Exception as e:
+                print(f"Error analyzing {chat}:")
+                traceback.print_exc()
+                results.append({"chat": chat, "status": "failed", "error": str(e)})
+                continue
+            results.append({
+                "chat": chat, "status": "done", "messages": timer.messages, "users": timer.users,
+                "seconds": round(time.perf_counter() - started, 3), "rows": chat_tables(chat, body),
+            })
+    return results
+
+def run(files, tables=tuple(TABLES), jobs=1, cached=True, log=print):
+    """
+    Analyzes the export files on jobs worker processes (0 runs them in this
+    process) and returns the per-chat results in input order.
+    """
+    sections = sorted({section for table in tables for section in TABLES[table]})
+    by_file = {}
+    if jobs == 0:
+        for path in files:
+            by_file[path] = analyze_export(path, sections, cached)
+            _log_results(by_file[path], log)
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, min(jobs, len(files))), mp_context=worker_context(), initializer=warm_up) as pool:
+            futures = {pool.submit(analyze_export, path, sections, cached): path for path in files}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    by_file[path] = future.result()
+                except Exception as e:
+                    # The worker died (e.g. killed for memory); the pool cannot be reused
+                    by_file[path] = [{"chat": path, "status": "failed", "error": f"Analysis worker crashed: {e}"}]
+                _log_results(by_file[path], log)
+    return [result for path in files for result in by_file[path]]
+
+def _log_results(results, log):
+    for result in results:
+        if result["status"] == "done":
+            log(f"done    {result['chat']}: {result['messages']} messages in {result['seconds']:.1f}s")
+        else:
+            log(f"failed  {result['chat']}: {result['error']}")
+
+def write_outputs(results, out, tables=tuple(TABLES), fmt='parquet', extra=None):
+    """Writes one file per table and summary.json to out; returns the summary."""
+    os.makedirs(out, exist_ok=True)
+    written = {}
+    for table in tables:
+        rows = [row for result in results if result["status"] == "done" for row in result["rows"][table]]
+        path = os.path.join(out, f"{table}.{fmt}")
+        frame = pd.DataFrame(rows, columns=COLUMNS[table])
+        if fmt == 'parquet':
+            frame.to_parquet(path, index=False)
+        else:
+            frame.to_csv(path, index=False)
+        written[table] = os.path.basename(path)
+
+    done = [result for result in results if result["status"] == "done"]
+    summary = dict(extra or {})
+    summary.update({
+        "chats": len(results),
+        "done": len(done),
+        "failed": len(results) - len(done),
+        "messages": sum(result["messages"] for result in done),
+        "tables": written,
+        "results": [{key: value for key, value in result.items() if key != "rows"} for result in results],
+    })
+    with open(os.path.join(out, "summary.json"), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Offline Chatlytics analysis.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    analyze = commands.add_parser("analyze", help="analyze chat exports and write columnar tables")
+    analyze.add_argument('paths', nargs='+', help="exports (.txt), zips of exports, directories or glob patterns")
+    analyze.add_argument('--out', required=True, help="output directory")
+    analyze.add_argument('--jobs', type=int, default=None, help="worker processes (default: one per CPU; 0 runs in this process)")
+    analyze.add_argument('--tables', default=",".join(TABLES), help=f"comma-separated tables to write: {', '.join(TABLES)}")
+    analyze.add_argument('--format', choices=('parquet', 'csv'), default='parquet')
+    analyze.add_argument('--no-cache', action='store_true', help="skip the parsed-frame cache and incremental store")
+    args = parser.parse_args(argv)
+
+    tables = [name.strip() for name in args.tables.split(',') if name.strip()]
+    unknown = set(tables).difference(TABLES)
+    if unknown or not tables:
+        parser.error(f"unknown tables: {', '.join(sorted(unknown))} (available: {', '.join(TABLES)})")
+    jobs = (os.cpu_count() or 1) if args.jobs is None else args.jobs
+    try:
+        files = collect_inputs(args.paths)
+    except FileNotFoundError as e:
+        parser.error(str(e))
+    if not files:
+        parser.error("no exports found")
+
+    started = time.perf_counter()
+    results = run(files, tables, jobs=jobs, cached=not args.no_cache,
+                  log=lambda line: print(line, file=sys.stderr))
+    seconds = round(time.perf_counter() - started, 3)
+    summary = write_outputs(results, args.out, tables, args.format, extra={"seconds": seconds, "jobs": jobs})
+    print(f"{summary['done']}/{summary['chats']} chats, {summary['messages']} messages in {seconds:.1f}s -> {args.out}",
+          file=sys.stderr)
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
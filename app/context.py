@@ -0,0 +1,153 @@
+from app.analytics import response_time_analysis, conversation_initiator
+from app.aggregates import MessageAggregates
+from app.topics import chat_fingerprint
+from ml.topic_modeling import build_doc_term_matrix
+from ml.anomalies import get_anomalies, get_anomalies_batch, ANOMALY_BATCH
+from ml.features import DailyFeatureStore
+from ml.health import get_chat_health_batch, get_health_timeline
+from ml.roles import assign_participant_roles
+from app.metrics import StageTimer
+
+
+class ChatContext:
+    """
+    Per-chat analysis state shared by every user view of one /analyze request.
+
+    Anything that is expensive and depends only on the chat (or on one user's
+    slice of it) is computed on first use and memoized here, so the per-user
+    loop in main.py never fits the same model twice.
+    """
+
+    def __init__(self, df, aggregates=None, timer=None):
+        # Full, globally sorted chat with sentiment attached
+        self.df = df
+        # Word/emoji counters, when app.incremental already has them for this chat
+        self._aggregates = aggregates
+        # Shared chat-wide work is timed as its own stages, not in the section that first needs it
+        self.timer = timer if timer is not None else StageTimer()
+        self._frames = {}
+        self._daily_stats = {}
+        self._anomalies = {}
+        self._health = {}
+        self._health_timelines = {}
+        self._response_times = None
+        self._initiators = None
+        self._dtm = None
+        self._fingerprint = None
+        self._daily_features = None
+        self._roles = None
+
+    def user_frame(self, user):
+        if user == 'Overall':
+            return self.df
+        if user not in self._frames:
+            self._frames[user] = self.df[self.df['user'] == user]
+        return self._frames[user]
+
+    @property
+    def daily_features(self):
+        """(user, day) feature panel shared by anomalies, health, timelines and initiators."""
+        if self._daily_features is None:
+            with self.timer.stage("daily_features"):
+                self._daily_features = DailyFeatureStore(self.df)
+        return self._daily_features
+
+    @property
+    def aggregates(self):
+        """Word and emoji counts for every user, built in one pass over the chat."""
+        if self._aggregates is None:
+            with self.timer.stage("word_emoji_counts"):
+                self._aggregates = MessageAggregates.from_frame(self.df)
+        return self._aggregates
+
+    @property
+    def response_times(self):
+        if self._response_times is None:
+            with self.timer.stage("reply_stats"):
+                self._response_times = response_time_analysis(self.df, 'Overall')
+        return self._response_times
+
+    @property
+    def initiators(self):
+        if self._initiators is None:
+            with self.timer.stage("initiators"):
+                self._initiators = conversation_initiator(self.df, 'Overall', features=self.daily_features)
+        return self._initiators
+
+    @property
+    def dtm(self):
+        # Tokenize every message once; topic fits slice rows out of this matrix
+        if self._dtm is None:
+            with self.timer.stage("doc_term_matrix"):
+                self._dtm = build_doc_term_matrix(self.df)
+        return self._dtm
+
+    @property
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = chat_fingerprint(self.df)
+        return self._fingerprint
+
+    @property
+    def roles(self):
+        """Conversation roles rank the whole chat, so every user view shares one result."""
+        if self._roles is None:
+            with self.timer.stage("role_matrix"):
+                self._roles = assign_participant_roles(self.df, initiators=self.initiators)
+        return self._roles
+
+    def daily_stats(self, user='Overall'):
+        """Daily anomaly feature frame for the user's slice of the chat."""
+        if user not in self._daily_stats:
+            self._daily_stats[user] = self.daily_features.anomaly_features(user)
+        return self._daily_stats[user]
+
+    def anomalies(self, user='Overall'):
+        """
+        get_anomalies for the user's slice, with one IsolationForest fit per user,
+        or for all participants at once when CHATLYTICS_ANOMALY_BATCH is set.
+        """
+        if user != 'Overall' and ANOMALY_BATCH and not self._anomalies.keys() - {'Overall'}:
+            with self.timer.stage("anomaly_fits"):
+                self._anomalies.update(get_anomalies_batch(self.df, features=self.daily_features))
+        if user not in self._anomalies:
+            frame = self.user_frame(user)
+            daily_stats = self.daily_stats(user) if not frame.empty else None
+            with self.timer.stage("anomaly_fits"):
+                self._anomalies[user] = get_anomalies(frame, daily_stats=daily_stats)
+        return self._anomalies[user]
+
+    def health(self, user='Overall'):
+        """
+        get_chat_health for the user's slice; every user is scored in one batch
+        pass. No anomalies are fitted for it (see ml.health.anomaly_penalty).
+        """
+        if not self._health:
+            users = ['Overall'] + sorted(u for u in self.daily_features.users if u != 'group_notification')
+            with self.timer.stage("health_scores"):
+                self._health = get_chat_health_batch(
+                    self.df,
+                    users=users,
+                    features=self.daily_features,
+                    # Overall health uses the same notification-free reply stats as the global ones
+                    resp_times=self.response_times
+                )
+        if user not in self._health:
+            self._health[user] = {"score": 0, "rating": "N/A", "metrics": {}}
+        return self._health[user]
+
+    def health_leaderboard(self):
+        """Participants ranked by health score (highest first)."""
+        self.health()
+        ranked = sorted(
+            ((user, report) for user, report in self._health.items() if user != 'Overall' and report.get("metrics")),
+            key=lambda item: -item[1]["score"]
+        )
+        return [{"user": user, "score": report["score"], "rating": report["rating"]} for user, report in ranked]
+
+    def health_timeline(self, freq='M'):
+        """Chat health per week or month (no anomaly fit, as for health)."""
+        if freq not in self._health_timelines:
+            with self.timer.stage("health_timeline_scores"):
+                self._health_timelines[freq] = get_health_timeline(self.df, freq=freq)
+        return self._health_timelines[freq]
@@ -0,0 +1,200 @@
+"""
+Incremental parsing for growing chat exports.
+
+WhatsApp exports are cumulative: next week's file is this week's file plus new
+messages. ChatStore keeps recently parsed chats (sentiment attached, word
+and emoji counters built), up to a memory budget, together with a prefix hash at every block boundary
+of their text. When a new upload starts with the same text as a stored chat,
+only the tail after the last shared block is parsed and scored, and the
+counters are updated with the difference. An identical upload reuses the
+stored chat as it is.
+
+The store lives in each process, so behind the API an export only reuses
+an earlier parse that was made by the same analysis worker.
+
+Block boundaries are placed at message starts, about BLOCK_CHARS apart, so
+the same text always splits into the same blocks and the tail parses to the
+same rows it has in the full file.
+"""
+
+import copy
+import hashlib
+import os
+import re
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from app.preprocess import parse_whatsapp_text, MESSAGE_PATTERN
+from app.aggregates import MessageAggregates
+from app.metrics import StageTimer
+from ml.sentiment_inference import attach_sentiment_to_df
+
+BLOCK_CHARS = 256 * 1024
+# Memory held by parsed chats per process (each analysis worker has its own);
+# 0 disables incremental parsing
+INCREMENTAL_BYTES = int(os.environ.get('CHATLYTICS_INCREMENTAL_MB', 128)) * 1024 * 1024
+
+_MESSAGE_START = re.compile(r'(?m)^' + MESSAGE_PATTERN)
+
+
+def block_hashes(data, block_chars=BLOCK_CHARS):
+    """
+    [(end, hash)] for every block boundary in data. Each hash covers all of
+    data[:end] (a running SHA-256), so equal hashes mean equal prefixes. The
+    text after the last boundary is not a complete block and has no hash.
+    """
+    blocks = []
+    running = hashlib.sha256()
+    start = 0
+    while True:
+        boundary = _MESSAGE_START.search(data, start + block_chars)
+        if boundary is None:
+            return blocks
+        end = boundary.start()
+        running.update(data[start:end].encode('utf-8', 'surrogatepass'))
+        blocks.append((end, running.copy().hexdigest()))
+        start = end
+
+
+class _StoredChat:
+
+    def __init__(self, key, frame, positions, aggregates, blocks):
+        # SHA-256 of the whole text
+        self.key = key
+        # Date-sorted frame with sentiment, and each row's position in file order
+        self.frame = frame
+        self.positions = positions
+        self.aggregates = aggregates
+        # block hash -> (end offset, messages parsed before it)
+        self.blocks = blocks
+        # The frame dominates; the counters and hashes are left out
+        self.nbytes = int(frame.memory_usage(deep=True).sum()) + positions.nbytes
+
+
+class ChatStore:
+    """
+    LRU of recently parsed chats, looked up by the prefix hashes of a new
+    upload and capped at max_bytes of stored frames. Chats are keyed by the
+    hash of their whole text, so one is stored once however often it is
+    uploaded. A chat larger than the cap is parsed but not kept.
+    """
+
+    def __init__(self, max_bytes=INCREMENTAL_BYTES, block_chars=BLOCK_CHARS):
+        self.max_bytes = max_bytes
+        self.block_chars = block_chars
+        self._chats = OrderedDict()
+        self._bytes = 0
+        # prefix hash -> key (full-text hash) of a stored chat containing it
+        self._index = {}
+        self.stats = {"full": 0, "incremental": 0, "reused_messages": 0}
+
+    def parse(self, data, timer=None):
+        """
+        preprocess_whatsapp_text + attach_sentiment_to_df for data, plus its
+        MessageAggregates, reusing a stored chat that shares a prefix with it.
+        """
+        if timer is None:
+            timer = StageTimer()
+        with timer.stage("prefix_hashes"):
+            key = hashlib.sha256(data.encode('utf-8', 'surrogatepass')).hexdigest()
+            stored = self._chats.get(key)
+            if stored is not None:
+                self._chats.move_to_end(key)
+        if stored is not None:
+            self.stats["incremental"] += 1
+            self.stats["reused_messages"] += len(stored.frame)
+            return stored.frame, stored.aggregates
+
+        with timer.stage("prefix_hashes"):
+            blocks = block_hashes(data, self.block_chars)
+            shared = self._longest_shared_prefix(blocks)
+
+        if shared is None:
+            with timer.stage("preprocess"):
+                frame, positions = _sorted(parse_whatsapp_text(data))
+            with timer.stage("sentiment"):
+                frame = attach_sentiment_to_df(frame)
+            with timer.stage("word_emoji_counts"):
+                aggregates = MessageAggregates.from_frame(frame)
+            known, start, offset = {}, 0, 0
+            self.stats["full"] += 1
+        else:
+            chat, shared_hash = shared
+            offset, n_shared = chat.blocks[shared_hash]
+            frame, positions, aggregates = self._extend(chat, n_shared, data[offset:], timer)
+            known = {h: chat.blocks[h] for _, h in blocks if h in chat.blocks}
+            start = len(known)
+            self.stats["incremental"] += 1
+            self.stats["reused_messages"] += n_shared
+
+        # Message counts at the new boundaries, counted from the last known one
+        with timer.stage("prefix_hashes"):
+            count = known[blocks[start - 1][1]][1] if start else 0
+            for end, block_hash in blocks[start:]:
+                count += len(re.findall(MESSAGE_PATTERN, data[offset:end]))
+                known[block_hash] = (end, count)
+                offset = end
+
+        self._remember(_StoredChat(key, frame, positions, aggregates, known))
+        return frame, aggregates
+
+    def _longest_shared_prefix(self, blocks):
+        for _, block_hash in reversed(blocks):
+            key = self._index.get(block_hash)
+            if key is not None:
+                self._chats.move_to_end(key)
+                return self._chats[key], block_hash
+        return None
+
+    def _extend(self, chat, n_shared, tail_text, timer):
+        shared = chat.positions < n_shared
+        with timer.stage("preprocess"):
+            tail = parse_whatsapp_text(tail_text)
+        with timer.stage("sentiment"):
+            tail = attach_sentiment_to_df(tail)
+
+        with timer.stage("preprocess"):
+            # Stable sort after shared rows keeps ties in file order, exactly as a full parse
+            combined = pd.concat([chat.frame[shared], tail], ignore_index=True)
+            positions = np.concatenate([chat.positions[shared], n_shared + np.arange(len(tail))])
+            frame, order = _sorted(combined)
+            positions = positions[order]
+
+        with timer.stage("word_emoji_counts"):
+            aggregates = copy.deepcopy(chat.aggregates)
+            aggregates.subtract(chat.frame[~shared])
+            aggregates.add(frame[positions >= n_shared])
+        return frame, positions, aggregates
+
+    def _remember(self, chat):
+        if chat.nbytes > self.max_bytes:
+            return
+        key = chat.key
+        self._chats[key] = chat
+        self._bytes += chat.nbytes
+        for block_hash in chat.blocks:
+            self._index[block_hash] = key
+        while self._bytes > self.max_bytes:
+            old_key, old = self._chats.popitem(last=False)
+            self._bytes -= old.nbytes
+            for block_hash in old.blocks:
+                if self._index.get(block_hash) == old_key:
+                    del self._index[block_hash]
+
+
+def _sorted(df):
+    """Frame sorted by date as in preprocess_whatsapp_text, and the permutation used."""
+    order = np.argsort(df['date'].to_numpy(), kind='stable')
+    return df.iloc[order].reset_index(drop=True), order
+
+
+_store = None
+
+def get_chat_store():
+    """Process-wide ChatStore, or None when CHATLYTICS_INCREMENTAL_MB=0."""
+    global _store
+    if INCREMENTAL_BYTES <= 0:
+        return None
+    if _store is None:
+        _store = ChatStore()
+    return _store
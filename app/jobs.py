@@ -0,0 +1,164 @@
+"""
+Background analysis jobs for chats too large for a synchronous /analyze call.
+
+Jobs run on the analysis worker pool and record their status, per-stage
+progress and result in a small SQLite database, so a result outlives the
+request (and the client connection) that submitted it.
+"""
+
+import json
+import os
+import sqlite3
+import time
+import uuid
+from app.pipeline import analyze_chat_bytes
+from app.metrics import StageTimer
+
+JOB_DB_PATH = os.environ.get('CHATLYTICS_JOB_DB', 'jobs.db')
+# Finished jobs (and their results) are deleted this many seconds after they ended
+JOB_TTL = float(os.environ.get('CHATLYTICS_JOB_TTL_HOURS', 24)) * 3600
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = 'queued', 'running', 'done', 'failed', 'cancelled'
+FINISHED = (DONE, FAILED, CANCELLED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    status TEXT NOT NULL,
+    stage TEXT,
+    progress REAL NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    result TEXT,
+    error TEXT
+)
+"""
+
+
+class JobCancelled(Exception):
+    """Raised inside a worker when its job was cancelled mid-analysis."""
+
+
+def _connect():
+    conn = sqlite3.connect(JOB_DB_PATH, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def init_store():
+    """
+    Creates the jobs table. Jobs that were queued or running when the process
+    last stopped can never finish (their uploads were in memory), so they are
+    marked failed.
+    """
+    with _connect() as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        conn.execute(
+            "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status IN (?, ?)",
+            (FAILED, "Interrupted by a server restart", time.time(), QUEUED, RUNNING)
+        )
+    expire_jobs()
+
+def expire_jobs(ttl=None):
+    """Deletes jobs that finished more than ttl (default JOB_TTL) seconds ago; returns how many."""
+    ttl = JOB_TTL if ttl is None else ttl
+    with _connect() as conn:
+        cursor = conn.execute(
+            "DELETE FROM jobs WHERE status IN (?, ?, ?) AND updated_at < ?",
+            (*FINISHED, time.time() - ttl)
+        )
+    return cursor.rowcount
+
+def create_job(filename):
+    """Records a queued job and returns its id. Expired jobs are cleared out as new ones arrive."""
+    expire_jobs()
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _connect() as conn:
+        conn.execute(
+            "INSERT INTO jobs (id, filename, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (job_id, filename, QUEUED, now, now)
+        )
+    return job_id
+
+def get_job(job_id):
+    """Job status as a JSON-ready dict (with the result once done), or None."""
+    with _connect() as conn:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    if row is None:
+        return None
+    job = {
+        "id": row["id"],
+        "filename": row["filename"],
+        "status": row["status"],
+        "stage": row["stage"],
+        "progress": round(row["progress"], 3),
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+    }
+    if row["status"] == DONE:
+        job["result"] = json.loads(row["result"])
+    if row["error"]:
+        job["error"] = row["error"]
+    return job
+
+def cancel_job(job_id):
+    """
+    Cancels a queued or running job; a finished job is deleted instead.
+    Returns the job's new status, or None if it does not exist.
+    """
+    with _connect() as conn:
+        row = conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        if row["status"] in FINISHED:
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+            return "deleted"
+        conn.execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+            (CANCELLED, time.time(), job_id)
+        )
+    return CANCELLED
+
+def fail_job(job_id, error):
+    """Marks an unfinished job failed (e.g. its worker process died)."""
+    _finish(job_id, FAILED, error=error)
+
+def _update(job_id, **fields):
+    fields["updated_at"] = time.time()
+    columns = ", ".join(f"{name} = ?" for name in fields)
+    with _connect() as conn:
+        # Never overwrite a cancellation (or any other final state)
+        cursor = conn.execute(
+            f"UPDATE jobs SET {columns} WHERE id = ? AND status NOT IN (?, ?, ?)",
+            (*fields.values(), job_id, *FINISHED)
+        )
+    return cursor.rowcount > 0
+
+def _finish(job_id, status, result=None, error=None):
+    return _update(job_id, status=status, result=result, error=error)
+
+def run_job(job_id, raw_data):
+    """
+    Worker entry point: analyzes one upload, recording progress as it goes.
+    Each progress update doubles as the cancellation check. Returns the
+    StageTimer of a completed analysis, None otherwise.
+    """
+    def progress(stage, fraction):
+        if not _update(job_id, status=RUNNING, stage=stage, progress=fraction):
+            raise JobCancelled()
+
+    timer = StageTimer()
+    try:
+        result = analyze_chat_bytes(raw_data, progress=progress, timer=timer)
+    except JobCancelled:
+        return None
+    except Exception as e:
+        _finish(job_id, FAILED, error=str(e))
+        return None
+    _update(job_id, stage="done", progress=1.0)
+    with timer.stage("serialize"):
+        result = json.dumps(result, ensure_ascii=False)
+    _finish(job_id, DONE, result=result)
+    return timer
@@ -1,47 +1,59 @@
+from contextlib import asynccontextmanager
+from concurrent.futures.process import BrokenProcessPool
 from fastapi import FastAPI, UploadFile, File, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-import json
-from app.preprocess import preprocess_whatsapp_text
-from app.analytics import (
-    get_user_list,
-    fetch_basic_stats,
-    most_active_users,
-    count_links,
-    daily_timeline,
-    hourly_activity,
-    weekly_activity,
-    monthly_activity,
-    quarterly_activity,
-    yearly_activity,
-    most_busy_day,
-    most_busy_weekday,
-    most_busy_month,
-    response_time_analysis,
-    conversation_initiator,
-    longest_message,
-    most_wordy_message,
-    most_common_words,
-    emoji_analysis,
-    most_busy_hour
+from fastapi.responses import JSONResponse, Response, PlainTextResponse, StreamingResponse
+from functools import partial
+from typing import List, Optional
+import asyncio
+import os
+import time
+import traceback
+from app.pipeline import (
+    analyze_chat_timed,
+    resolve_sections,
+    options_variant,
+    EmptyChatError,
+    InvalidOptionError,
+    ANALYSIS_WORKERS,
+    get_executor,
+    reset_executor
 )
+from app.jobs import init_store, create_job, get_job, cancel_job, fail_job, run_job, CANCELLED
+from app.cache import get_cache, content_key
+from app.metrics import record, render_metrics
+from app.profiling import profile_chat, PROFILING_ENABLED
+from app.batch import stream_batch, analyze_chat_rendered, BATCH_MAX_CHATS, BATCH_MAX_BYTES
+from app.archive import read_chat, chat_sources, ChatArchiveError, ChatTooLargeError
 
-from app.topics import (
-    get_topics_analytics,
-    get_topic_timeline
-)
+# Analyses allowed to run at once, and how many more may wait for a slot
+# before new uploads are turned away with 429
+ANALYSIS_CONCURRENCY = int(os.environ.get('CHATLYTICS_ANALYSIS_CONCURRENCY', max(1, ANALYSIS_WORKERS)))
+ANALYSIS_QUEUE_SIZE = int(os.environ.get('CHATLYTICS_ANALYSIS_QUEUE', 8))
+# Seconds clients are told to wait before retrying a rejected upload
+RETRY_AFTER = int(os.environ.get('CHATLYTICS_RETRY_AFTER', 10))
 
-from ml.sentiment_inference import (
-    overall_sentiment,
-    user_wise_sentiment,
-    attach_sentiment_to_df
-)
+_semaphore = None
+_waiting = 0
+_running = 0
+# job id -> task of a job submitted by this process, and the ids of those holding a slot
+_jobs = {}
+_jobs_started = set()
 
-from ml.health import get_chat_health
-from ml.anomalies import get_anomalies
-from ml.roles import assign_participant_roles
+@asynccontextmanager
+async def lifespan(app):
+    init_store()
+    # Warm start: spawn every worker (each loads the sentiment lexicon) before
+    # the first upload instead of on it
+    executor = get_executor()
+    if executor is not None:
+        await asyncio.gather(*(
+            asyncio.get_running_loop().run_in_executor(executor, int) for _ in range(ANALYSIS_WORKERS)
+        ))
+    yield
+    reset_executor()
 
-app = FastAPI(title="WhatsApp Chat Analyzer API")
+app = FastAPI(title="WhatsApp Chat Analyzer API", lifespan=lifespan)
 
 # Enable CORS
 app.add_middleware(
@@ -52,200 +64,263 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def _busy(status_code, detail):
+    return HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": str(RETRY_AFTER)})
 
+def _queue_full():
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(ANALYSIS_CONCURRENCY)
+    return _semaphore.locked() and _waiting >= ANALYSIS_QUEUE_SIZE
 
-# Pre-calc global stats function to avoid passing full DF repeatedly or recalculating
-def precompute_global_stats(df):
-    resp_times = response_time_analysis(df, 'Overall')
-    initiators = conversation_initiator(df, 'Overall')
-    return resp_times, initiators
-
-def get_all_analytics(df, selected_user, global_resp_times=None, global_initiators=None):
-    # Ensure nested dicts and Series are fully converted to JSON-safe types
-    
-    # We expect 'df' to be already filtered for the specific user if selected_user != 'Overall'
-    # EXCEPT for response_time_analysis and conversation_initiator which might rely on global context
-    # But for those, we heavily prefer using the pre-calculated globals passed in.
-    
-    basic_stats = fetch_basic_stats(df, selected_user)
-    links_shared = count_links(df, selected_user)
-    
-    # Timelines - convert date objects to string
-    def clean_timeline(timeline_df):
-        temp = timeline_df.copy()
-        for col in temp.columns:
-            if temp[col].dtype == 'object' or 'date' in col:
-                temp[col] = temp[col].apply(lambda x: str(x) if not isinstance(x, (int, float)) else x)
-        return temp.to_dict(orient="records")
-
-    # Most busy day/month - convert Series to string-safe dict
-    def clean_series(ser):
-        if hasattr(ser, 'to_dict'):
-            d = ser.to_dict()
-            return {str(k): (str(v) if not isinstance(v, (int, float)) else v) for k, v in d.items()}
-        return {}
-
-    # Longest/Most wordy - convert Timestamp in dict
-    def clean_message_dict(msg_dict):
-        if not msg_dict: return {}
-        return {k: (str(v) if 'date' in k or isinstance(v, pd.Timestamp) else v) for k, v in msg_dict.items()}
-
-    # Helper for extracting user specific stats from global dicts
-    def get_user_stat(global_dict, user):
-        if user == 'Overall': return global_dict
-        if isinstance(global_dict, (pd.Series, dict)):
-            val = global_dict.get(user, 0 if isinstance(global_dict, dict) else None)
-            if val is None: return {} # pandas series get might return None/NaN
-            # Standardize return format: {user: value}
-            return {user: val}
-        return {}
-
-    # Logic for response times: use global if provided
-    if global_resp_times is not None:
-        if selected_user == 'Overall':
-            resp_stats = global_resp_times
-        else:
-            # Reconstruct the expected {user: time} format
-            val = global_resp_times.get(selected_user)
-            resp_stats = {selected_user: val} if val is not None else {}
-    else:
-        # Fallback (slow)
-        resp_stats = response_time_analysis(df, selected_user)
-
-    # Logic for initiators: use global if provided
-    if global_initiators is not None:
-         if selected_user == 'Overall':
-             # Convert Series to dict for JSON
-             init_stats = global_initiators.to_dict()
-         else:
-             val = global_initiators.get(selected_user)
-             init_stats = {selected_user: val} if val is not None else {}
-    else:
-        init_stats = conversation_initiator(df, selected_user)
-        if hasattr(init_stats, 'to_dict'): init_stats = init_stats.to_dict()
-
-    
-    res = {
-        "basic_stats": basic_stats,
-        "links_shared": links_shared,
-        # most_active_users needs FULL df if calculating for Overall, but if selected_user is specific, it's just meant to be empty?
-        # Original code: if selected_user == 'Overall' else {}
-        # We can just return {} if filtered df is passed, or we'd need full df. 
-        # But usually client only asks mostly active users for Overall view. 
-        # If we passed filtered DF, we can't calculate most active users (it would just be the one user).
-        "most_active_users": {str(k): v for k, v in most_active_users(df).to_dict().items()} if selected_user == 'Overall' else {},
-        "daily_timeline": clean_timeline(daily_timeline(df, selected_user)),
-        "hourly_activity": clean_timeline(hourly_activity(df, selected_user)),
-        "weekly_activity": clean_timeline(weekly_activity(df, selected_user)),
-        "monthly_activity": clean_timeline(monthly_activity(df, selected_user)),
-        "quarterly_activity": clean_timeline(quarterly_activity(df, selected_user)),
-        "yearly_activity": clean_timeline(yearly_activity(df, selected_user)),
-        "most_busy_day": clean_series(most_busy_day(df)) if selected_user == 'Overall' else {},
-        "most_busy_weekday": most_busy_weekday(df) if selected_user == 'Overall' else "",
-        "most_busy_month": clean_series(most_busy_month(df)) if selected_user == 'Overall' else {},
-        "response_time_analysis": resp_stats,
-        "conversation_initiator": {str(k): v for k, v in init_stats.items()},
-        "longest_message": clean_message_dict(longest_message(df, selected_user)),
-        "most_wordy_message": clean_message_dict(most_wordy_message(df, selected_user)),
-        "most_common_words": {str(k): v for k, v in most_common_words(df, selected_user).to_dict().items()},
-        "emoji_analysis": {str(k): v for k, v in emoji_analysis(df, selected_user).to_dict().items()},
-        "most_busy_hour": most_busy_hour(df, selected_user),
-        "sentiment_analysis": overall_sentiment(df),
-        "user_sentiment_breakdown": user_wise_sentiment(df) if selected_user == 'Overall' else {},
-        "topic_modeling": get_topics_analytics(df, selected_user),
-        "topic_timeline": get_topic_timeline(df, selected_user),
-        "chat_health": get_chat_health(df),
-        "anomalies": get_anomalies(df),
-        "conversation_roles": assign_participant_roles(df)
+@asynccontextmanager
+async def analysis_slot(admitted=False):
+    """
+    Holds one of the ANALYSIS_CONCURRENCY analysis slots, waiting in the
+    queue for it. Raises 429 when the wait queue is full, unless admitted
+    (the chats of a batch or a job that was already accepted).
+    """
+    global _waiting, _running
+    if _queue_full() and not admitted:
+        raise _busy(429, "Too many analyses in progress. Please retry shortly.")
+
+    _waiting += 1
+    try:
+        await _semaphore.acquire()
+    finally:
+        _waiting -= 1
+    _running += 1
+    try:
+        yield
+    finally:
+        _running -= 1
+        _semaphore.release()
+
+async def run_analysis(raw_data, task=analyze_chat_timed, admitted=False):
+    """
+    Runs task (analyze_chat_timed or profile_chat) off the event loop in an
+    analysis slot and returns the body with its StageTimer. Raises 429 when
+    the wait queue is full (see analysis_slot) and 503 when the worker pool
+    died mid-analysis.
+    """
+    queued_at = time.perf_counter()
+    async with analysis_slot(admitted):
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        try:
+            body, timer = await loop.run_in_executor(get_executor(), task, raw_data)
+        except BrokenProcessPool:
+            reset_executor()
+            raise _busy(503, "Analysis worker crashed. Please retry shortly.")
+        # Time in the worker that no stage accounts for (mostly pickling the upload and result)
+        timer.add("worker_transfer", max(0.0, time.perf_counter() - started_at - timer.total()))
+        timer.add("queue", started_at - queued_at)
+        return body, timer
+
+def analysis_response(body, timer, headers=None, record_metrics=True):
+    """
+    JSONResponse for a fresh analysis, with its stage timings in Server-Timing.
+    record_metrics=False keeps them out of the /metrics histograms.
+    """
+    with timer.stage("serialize"):
+        response = JSONResponse(content=body, headers=headers)
+    if record_metrics:
+        record(timer)
+    response.headers["Server-Timing"] = timer.server_timing()
+    return response
+
+async def cached_analysis(raw_data, task=analyze_chat_timed, variant=''):
+    """
+    /analyze response for an upload: the stored bytes when this exact upload
+    was analyzed before with the same options (variant), otherwise a fresh
+    analysis by task (which is then stored).
+    """
+    cache = get_cache()
+    if cache is None:
+        return analysis_response(*await run_analysis(raw_data, task=task))
+
+    # Hashing and gzip I/O stay off the event loop too
+    loop = asyncio.get_running_loop()
+    lookup_at = time.perf_counter()
+    key = await loop.run_in_executor(None, partial(content_key, raw_data, variant=variant))
+    body = await loop.run_in_executor(None, cache.get, key)
+    lookup = time.perf_counter() - lookup_at
+    if body is not None:
+        return Response(content=body, media_type="application/json", headers={
+            "X-Cache": "HIT",
+            "Server-Timing": f'result_cache;dur={lookup * 1000:.1f};desc="hit"'
+        })
+
+    result, timer = await run_analysis(raw_data, task=task)
+    timer.add("result_cache", lookup)
+    response = analysis_response(result, timer, headers={"X-Cache": "MISS"})
+    await loop.run_in_executor(None, cache.put, key, response.body)
+    return response
+
+@app.get("/health")
+async def health():
+    cache = get_cache()
+    return {
+        "status": "ok",
+        "analyses_running": _running,
+        "analyses_waiting": _waiting,
+        "cache": cache.metrics() if cache is not None else None
     }
-    return res
 
-import traceback
+@app.get("/metrics")
+async def metrics():
+    """Stage timing histograms and server gauges in the Prometheus text format."""
+    gauges = {
+        "chatlytics_analyses_running": _running,
+        "chatlytics_analyses_waiting": _waiting,
+        "chatlytics_jobs_pending": len(_jobs),
+    }
+    cache = get_cache()
+    if cache is not None:
+        for name, value in cache.metrics().items():
+            gauges[f"chatlytics_result_cache_{name}"] = value
+    return PlainTextResponse(render_metrics(gauges), media_type="text/plain; version=0.0.4")
 
-import numpy as np
-
-def json_safe(obj):
-    if isinstance(obj, dict):
-        return {str(k): json_safe(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [json_safe(i) for i in obj]
-    elif isinstance(obj, (np.integer, np.int64, np.int32)):
-        return int(obj)
-    elif isinstance(obj, (np.floating, np.float64, np.float32)):
-        return float(obj)
-    elif isinstance(obj, (pd.Timestamp, pd.Series, pd.DataFrame)):
-        if hasattr(obj, 'to_dict'):
-            return json_safe(obj.to_dict())
-        return str(obj)
-    elif hasattr(obj, 'isoformat'): # Dates/Timestamps
-        return obj.isoformat()
-    elif isinstance(obj, (int, float, str, bool)) or obj is None:
-        return obj
-    else:
-        return str(obj)
+def _names(value):
+    """Comma-separated query parameter -> list of names (None when absent or empty)."""
+    if value is None:
+        return None
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    return names or None
 
 @app.post("/analyze")
-async def analyze_chat(file: UploadFile = File(...)):
+async def analyze_chat(file: UploadFile = File(...), profile: bool = False, sections: Optional[str] = None, users: Optional[str] = None):
+    """
+    Analyzes an uploaded export. sections=basic_stats,daily_timeline and
+    users=Overall (comma-separated) restrict the response, and skip the work
+    (sentiment scoring, topic and anomaly models) that only other sections need.
+    A zip ("export with media") is accepted too: only its chat entry is
+    decompressed, and its media counts are returned as "media_types".
+    """
+    if profile and not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled on this server (set CHATLYTICS_PROFILING=1).")
+    sections, users = _names(sections), _names(users)
     try:
+        # Unknown sections are rejected before the upload is read; unknown users once it is parsed
+        resolve_sections(sections)
         print(f"Analyzing file: {file.filename}")
-        # Read uploaded file with flexible encoding
-        raw_data = await file.read()
-        try:
-            data = raw_data.decode("utf-8")
-        except UnicodeDecodeError:
-            try:
-                data = raw_data.decode("utf-16")
-            except UnicodeDecodeError:
-                data = raw_data.decode("latin-1")
-
-        # Preprocess chat (Now returns GLOBALLY SORTED df)
-        df = preprocess_whatsapp_text(data)
-        
-        # Attach sentiment to DF globally for anomaly detection
-        print("Attaching sentiment scores...")
-        df = attach_sentiment_to_df(df)
-        
-        if df.empty:
-            print("Error: DataFrame is empty")
-            raise HTTPException(status_code=400, detail="No messages found. The file might be in an unsupported format or empty.")
-
-        users = get_user_list(df)
-        print(f"Found users: {users}")
-        
-        # Pre-compute heavy global stats ONCE
-        print("Pre-computing global statistics...")
-        global_resp_times, global_initiators = precompute_global_stats(df)
-        
-        # Store analytics for each user
-        all_analytics = {}
-        for user in users:
-            # print(f"Computing analytics for user: {user}") # Reduce log spam
-            try:
-                # Efficient Filtering
-                if user == 'Overall':
-                    df_context = df
-                else:
-                    df_context = df[df['user'] == user]
-                
-                raw_user_analytics = get_all_analytics(
-                    df_context, 
-                    user, 
-                    global_resp_times=global_resp_times, 
-                    global_initiators=global_initiators
-                )
-                all_analytics[user] = json_safe(raw_user_analytics)
-            except Exception as user_err:
-                print(f"Error computing analytics for user {user}: {user_err}")
-                traceback.print_exc()
-                raise HTTPException(status_code=500, detail=f"Error analyzing user {user}: {str(user_err)}")
-
-        return json_safe({
-            "users": users,
-            "analytics": all_analytics
-        })
+        # Zips are read straight from the spooled upload, off the event loop
+        raw_data, media = await asyncio.get_running_loop().run_in_executor(None, read_chat, file.filename, file.file)
+        options = {"sections": sections, "users": users} if sections or users else {}
+        if media is not None:
+            options["media_types"] = media
+        if profile:
+            # Never served from or stored in the result cache, and its timings (slowed
+            # down by tracemalloc) stay out of the latency histograms
+            body, timer = await run_analysis(raw_data, task=partial(profile_chat, **options))
+            return analysis_response(body, timer, record_metrics=False)
+        return await cached_analysis(raw_data, task=partial(analyze_chat_timed, **options), variant=options_variant(**options))
     except HTTPException as he:
         raise he
+    except (EmptyChatError, InvalidOptionError, ChatArchiveError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ChatTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         print("CRITICAL ERROR DURING ANALYSIS:")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/analyze/batch")
+async def analyze_batch(files: List[UploadFile] = File(...), sections: Optional[str] = None, users: Optional[str] = None):
+    """
+    Analyzes many exports (several files, or zips of exports) on the worker
+    pool and streams one NDJSON line per chat as it finishes (see app.batch).
+    sections= and users= apply to every chat. Its chats take the same slots
+    as /analyze calls; the batch as a whole is turned away with 429 when
+    the wait queue is full.
+    """
+    sections, users = _names(sections), _names(users)
+    if _queue_full():
+        raise _busy(429, "Too many analyses in progress. Please retry shortly.")
+    try:
+        resolve_sections(sections)
+        loop = asyncio.get_running_loop()
+        # Only listed here (zip directories); each chat is read when its turn comes
+        chats, size = [], 0
+        for file in files:
+            for name, chat_size, read in await loop.run_in_executor(None, chat_sources, file.filename, file.file):
+                chats.append((name, read))
+                size += chat_size
+            if len(chats) > BATCH_MAX_CHATS:
+                raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_CHATS} chats per batch.")
+            if size > BATCH_MAX_BYTES:
+                raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_BYTES // 2**20} MB of chats per batch.")
+    except (InvalidOptionError, ChatArchiveError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ChatTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    if not chats:
+        raise HTTPException(status_code=400, detail="No chat exports found in the upload.")
+
+    print(f"Analyzing batch of {len(chats)} chats")
+    options = {"sections": sections, "users": users} if sections or users else {}
+    lines = stream_batch(chats, partial(run_analysis, admitted=True), task=partial(analyze_chat_rendered, **options),
+                         variant=options_variant(**options))
+    return StreamingResponse(lines, media_type="application/x-ndjson")
+
+async def _run_job(job_id, raw_data):
+    """Runs a submitted job in an analysis slot and records how it ended."""
+    loop = asyncio.get_running_loop()
+    try:
+        async with analysis_slot(admitted=True):
+            _jobs_started.add(job_id)
+            timer = await loop.run_in_executor(get_executor(), run_job, job_id, raw_data)
+    except asyncio.CancelledError:
+        # Cancelled by DELETE /jobs/{id}, which already recorded it
+        raise
+    except Exception as error:
+        if isinstance(error, BrokenProcessPool):
+            reset_executor()
+        await loop.run_in_executor(None, fail_job, job_id, f"Analysis worker failed: {error}")
+    else:
+        if timer is not None:
+            record(timer)
+    finally:
+        _jobs.pop(job_id, None)
+        _jobs_started.discard(job_id)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(file: UploadFile = File(...)):
+    """
+    Queues an analysis of the upload (an export, or a zip of one) and returns
+    its job id immediately. Jobs take the same analysis slots as /analyze
+    calls and are turned away with 429 when the wait queue is full.
+    """
+    if _queue_full():
+        raise _busy(429, "Too many analyses in progress. Please retry shortly.")
+    loop = asyncio.get_running_loop()
+    try:
+        raw_data, _ = await loop.run_in_executor(None, read_chat, file.filename, file.file)
+    except ChatArchiveError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ChatTooLargeError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    job_id = await loop.run_in_executor(None, create_job, file.filename)
+    _jobs[job_id] = asyncio.ensure_future(_run_job(job_id, raw_data))
+    return {"id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    # The store (and decoding a large result) stays off the event loop
+    job = await asyncio.get_running_loop().run_in_executor(None, get_job, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    """Cancels a pending job, or deletes a finished one and its result."""
+    status = await asyncio.get_running_loop().run_in_executor(None, cancel_job, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if status == CANCELLED and job_id in _jobs and job_id not in _jobs_started:
+        # Frees its place in the queue. A running job keeps its slot until it
+        # stops at its next progress update
+        _jobs[job_id].cancel()
+    return {"id": job_id, "status": status}
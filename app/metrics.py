@@ -0,0 +1,133 @@
+"""
+Per-stage timing of analyses, exposed as Server-Timing headers and
+Prometheus histograms.
+
+A StageTimer travels with one analysis (into the worker process and back)
+and records the self time of every named stage: time spent in a nested
+stage is counted there, not in its parent, so the stages of one analysis add
+up to its total. Finished timers are folded into process-wide histograms
+that GET /metrics renders in the Prometheus text format.
+"""
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the histogram buckets
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# Size classes used as labels (exact counts would make a series per chat)
+MESSAGE_CLASSES = ((1000, "<=1k"), (10000, "1k-10k"), (100000, "10k-100k"), (None, ">100k"))
+USER_CLASSES = ((2, "1-2"), (10, "3-10"), (50, "11-50"), (None, ">50"))
+
+
+class StageTimer:
+    """Self time and call count of each stage of one analysis."""
+
+    def __init__(self):
+        # stage -> [seconds, calls], in first-run order
+        self.stages = {}
+        self.messages = 0
+        self.users = 0
+        self._open = []
+
+    @contextmanager
+    def stage(self, name):
+        self._open.append(0.0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._open.pop()
+            self.add(name, elapsed - nested)
+            if self._open:
+                self._open[-1] += elapsed
+
+    def add(self, name, seconds):
+        entry = self.stages.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+    def total(self):
+        return sum(seconds for seconds, _ in self.stages.values())
+
+    def server_timing(self):
+        """Server-Timing header value: one metric per stage, plus the total."""
+        metrics = [f"{_token(name)};dur={seconds * 1000:.1f}" for name, (seconds, _) in self.stages.items()]
+        metrics.append(f'total;dur={self.total() * 1000:.1f};desc="messages={self.messages} users={self.users}"')
+        return ", ".join(metrics)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, rendered in the Prometheus text format."""
+
+    def __init__(self, name, documentation, labelnames, buckets=STAGE_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.setdefault(labelvalues, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        for labelvalues, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, labelvalues))
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-1]}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-2]}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "chatlytics_stage_seconds",
+    "Self time of each analysis stage.",
+    ("stage", "messages", "users")
+)
+ANALYSIS_SECONDS = Histogram(
+    "chatlytics_analysis_seconds",
+    "Total time of each analysis.",
+    ("messages", "users")
+)
+
+
+def record(timer):
+    """Adds a finished analysis to the process-wide histograms."""
+    messages = _size_class(timer.messages, MESSAGE_CLASSES)
+    users = _size_class(timer.users, USER_CLASSES)
+    for name, (seconds, _) in timer.stages.items():
+        STAGE_SECONDS.observe(seconds, name, messages, users)
+    ANALYSIS_SECONDS.observe(timer.total(), messages, users)
+
+def render_metrics(gauges=None):
+    """Prometheus exposition of the histograms, plus the given {name: value} gauges."""
+    lines = STAGE_SECONDS.render() + ANALYSIS_SECONDS.render()
+    for name, value in (gauges or {}).items():
+        lines += [f"# TYPE {name} gauge", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
+
+def _size_class(n, classes):
+    for bound, label in classes:
+        if bound is None or n <= bound:
+            return label
+
+def _token(name):
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", name)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
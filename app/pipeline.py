@@ -0,0 +1,442 @@
+"""
+Synchronous analysis pipeline behind /analyze.
+
+Everything here is plain CPU-bound pandas/sklearn work with no FastAPI
+dependency, so it can run in a worker process (see get_executor) while the
+event loop keeps serving other requests.
+"""
+
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from app.preprocess import preprocess_whatsapp_text
+from app.analytics import (
+    get_user_list,
+    fetch_basic_stats,
+    most_active_users,
+    count_links,
+    daily_timeline,
+    hourly_activity,
+    weekly_activity,
+    monthly_activity,
+    quarterly_activity,
+    yearly_activity,
+    most_busy_day,
+    most_busy_weekday,
+    most_busy_month,
+    response_time_analysis,
+    conversation_initiator,
+    longest_message,
+    most_wordy_message,
+    most_common_words,
+    emoji_analysis,
+    most_busy_hour
+)
+
+from app.topics import (
+    run_topics_analytics,
+    run_topic_timeline
+)
+from app.context import ChatContext
+from app.metrics import StageTimer
+from app.incremental import get_chat_store
+from app.cache import get_frame_cache, content_key, FRAME_VERSION
+
+from ml.sentiment_inference import (
+    overall_sentiment,
+    user_wise_sentiment,
+    attach_sentiment_to_df
+)
+
+from ml.health import get_chat_health
+from ml.anomalies import get_anomalies
+from ml.roles import assign_participant_roles
+from ml.sentiment_vader import get_analyzer
+
+# Worker processes for whole-chat analyses; 0 runs them on the event loop's
+# default thread pool instead (no process isolation, no warm start)
+ANALYSIS_WORKERS = int(os.environ.get('CHATLYTICS_ANALYSIS_WORKERS', 2))
+
+_executor = None
+
+
+# Response sections of each user's analytics, in response order
+SECTIONS = (
+    "basic_stats", "links_shared", "most_active_users", "daily_timeline", "hourly_activity",
+    "weekly_activity", "monthly_activity", "quarterly_activity", "yearly_activity", "most_busy_day",
+    "most_busy_weekday", "most_busy_month", "response_time_analysis", "conversation_initiator",
+    "longest_message", "most_wordy_message", "most_common_words", "emoji_analysis", "most_busy_hour",
+    "sentiment_analysis", "user_sentiment_breakdown", "topic_modeling", "topic_timeline",
+    "topics_timed_out", "chat_health", "health_leaderboard", "health_timeline", "anomalies",
+    "conversation_roles"
+)
+# Sections that read the per-message sentiment scores; without any of them
+# VADER is not run at all
+SENTIMENT_SECTIONS = frozenset({
+    "sentiment_analysis", "user_sentiment_breakdown", "chat_health", "health_leaderboard",
+    "health_timeline", "anomalies"
+})
+# Sections that fit topic models; topics_timed_out comes with either
+TOPIC_SECTIONS = frozenset({"topic_modeling", "topic_timeline"})
+
+
+class EmptyChatError(ValueError):
+    """The upload parsed to zero messages."""
+
+
+class InvalidOptionError(ValueError):
+    """An unknown section or user was requested."""
+
+
+def resolve_sections(sections):
+    """
+    Requested section names in response order, or None for all of them.
+    Raises InvalidOptionError for names not in SECTIONS.
+    """
+    if sections is None:
+        return None
+    requested = set(sections)
+    unknown = requested.difference(SECTIONS)
+    if unknown:
+        raise InvalidOptionError(f"Unknown sections: {', '.join(sorted(unknown))}. Available: {', '.join(SECTIONS)}")
+    if requested & TOPIC_SECTIONS:
+        requested.add("topics_timed_out")
+    return tuple(name for name in SECTIONS if name in requested)
+
+def select_users(users, requested):
+    """The requested users in chat order (all of them when requested is None)."""
+    if requested is None:
+        return users
+    unknown = set(requested).difference(users)
+    if unknown:
+        raise InvalidOptionError(f"Unknown users: {', '.join(sorted(unknown))}")
+    return [user for user in users if user in requested]
+
+def options_variant(sections=None, users=None, media_types=None):
+    """Canonical text of the analysis options, for cache keys ('' for a full analysis)."""
+    sections = resolve_sections(sections)
+    parts = []
+    if sections is not None:
+        parts.append("sections=" + ",".join(sections))
+    if users is not None:
+        parts.append("users=" + ",".join(sorted(set(users))))
+    if media_types is not None:
+        parts.append("media=" + ",".join(f"{kind}:{count}" for kind, count in sorted(media_types.items())))
+    return ";".join(parts)
+
+
+def get_all_analytics(df, selected_user, global_resp_times=None, global_initiators=None, dtm=None, fingerprint=None, context=None, timer=None, sections=None):
+    # Ensure nested dicts and Series are fully converted to JSON-safe types
+    # sections (names from SECTIONS) limits the result to those sections; the
+    # rest, and whatever only they depend on, is never computed
+    
+    # We expect 'df' to be already filtered for the specific user if selected_user != 'Overall'
+    # EXCEPT for response_time_analysis and conversation_initiator which might rely on global context
+    # But for those, we heavily prefer using the pre-calculated globals passed in.
+    # A ChatContext supplies all of those (and memoized anomalies/health) at once,
+    # each built only when a requested section first reads it.
+    if context is not None:
+        timer = context.timer
+    if timer is None:
+        timer = StageTimer()
+    
+    # Daily feature panel, built on first use
+    def features():
+        return context.daily_features if context is not None else None
+    
+    # Timelines - convert date objects to string
+    def clean_timeline(timeline_df):
+        temp = timeline_df.copy()
+        for col in temp.columns:
+            if temp[col].dtype == 'object' or 'date' in col:
+                temp[col] = temp[col].apply(lambda x: str(x) if not isinstance(x, (int, float)) else x)
+        return temp.to_dict(orient="records")
+
+    # Most busy day/month - convert Series to string-safe dict
+    def clean_series(ser):
+        if hasattr(ser, 'to_dict'):
+            d = ser.to_dict()
+            return {str(k): (str(v) if not isinstance(v, (int, float)) else v) for k, v in d.items()}
+        return {}
+
+    # Longest/Most wordy - convert Timestamp in dict
+    def clean_message_dict(msg_dict):
+        if not msg_dict: return {}
+        return {k: (str(v) if 'date' in k or isinstance(v, pd.Timestamp) else v) for k, v in msg_dict.items()}
+
+    # Logic for response times: use global if provided
+    def response_stats():
+        resp_times = context.response_times if context is not None else global_resp_times
+        if resp_times is None:
+            # Fallback (slow)
+            return response_time_analysis(df, selected_user)
+        if selected_user == 'Overall':
+            return resp_times
+        # Reconstruct the expected {user: time} format
+        val = resp_times.get(selected_user)
+        return {selected_user: val} if val is not None else {}
+
+    # Logic for initiators: use global if provided
+    def initiator_stats():
+        initiators = context.initiators if context is not None else global_initiators
+        if initiators is None:
+            init_stats = conversation_initiator(df, selected_user)
+            if hasattr(init_stats, 'to_dict'): init_stats = init_stats.to_dict()
+        elif selected_user == 'Overall':
+            # Convert Series to dict for JSON
+            init_stats = initiators.to_dict()
+        else:
+            val = initiators.get(selected_user)
+            init_stats = {selected_user: val} if val is not None else {}
+        return {str(k): v for k, v in init_stats.items()}
+
+    def common_words():
+        if context is not None:
+            return context.aggregates.most_common_words(selected_user)
+        return most_common_words(df, selected_user)
+
+    def emojis():
+        if context is not None:
+            return context.aggregates.emoji_analysis(selected_user)
+        return emoji_analysis(df, selected_user)
+
+    # Topic fits run in the topic process pool; a timeout yields empty/partial topics
+    topic_runs = []
+    def topics(run, key):
+        if context is not None:
+            result = run(df, selected_user, dtm=context.dtm, fingerprint=context.fingerprint)
+        else:
+            result = run(df, selected_user, dtm=dtm, fingerprint=fingerprint)
+        topic_runs.append(result)
+        return result[key]
+
+    overall = selected_user == 'Overall'
+    # Sections in response order (SECTIONS); each is timed as its own stage
+    builders = {
+        "basic_stats": lambda: fetch_basic_stats(df, selected_user),
+        "links_shared": lambda: count_links(df, selected_user, features=features()),
+        # most_active_users needs FULL df if calculating for Overall, but if selected_user is specific, it's just meant to be empty?
+        # Original code: if selected_user == 'Overall' else {}
+        # We can just return {} if filtered df is passed, or we'd need full df. 
+        # But usually client only asks mostly active users for Overall view. 
+        # If we passed filtered DF, we can't calculate most active users (it would just be the one user).
+        "most_active_users": lambda: {str(k): v for k, v in most_active_users(df).to_dict().items()} if overall else {},
+        "daily_timeline": lambda: clean_timeline(daily_timeline(df, selected_user, features=features())),
+        "hourly_activity": lambda: clean_timeline(hourly_activity(df, selected_user)),
+        "weekly_activity": lambda: clean_timeline(weekly_activity(df, selected_user)),
+        "monthly_activity": lambda: clean_timeline(monthly_activity(df, selected_user)),
+        "quarterly_activity": lambda: clean_timeline(quarterly_activity(df, selected_user)),
+        "yearly_activity": lambda: clean_timeline(yearly_activity(df, selected_user)),
+        "most_busy_day": lambda: clean_series(most_busy_day(df)) if overall else {},
+        "most_busy_weekday": lambda: most_busy_weekday(df) if overall else "",
+        "most_busy_month": lambda: clean_series(most_busy_month(df)) if overall else {},
+        "response_time_analysis": response_stats,
+        "conversation_initiator": initiator_stats,
+        "longest_message": lambda: clean_message_dict(longest_message(df, selected_user)),
+        "most_wordy_message": lambda: clean_message_dict(most_wordy_message(df, selected_user)),
+        "most_common_words": lambda: {str(k): v for k, v in common_words().to_dict().items()},
+        "emoji_analysis": lambda: {str(k): v for k, v in emojis().to_dict().items()},
+        "most_busy_hour": lambda: most_busy_hour(df, selected_user),
+        "sentiment_analysis": lambda: overall_sentiment(df),
+        "user_sentiment_breakdown": lambda: user_wise_sentiment(df) if overall else {},
+        "topic_modeling": lambda: topics(run_topics_analytics, "topics"),
+        "topic_timeline": lambda: topics(run_topic_timeline, "timeline"),
+        "topics_timed_out": lambda: any(run["timed_out"] for run in topic_runs),
+        "chat_health": lambda: context.health(selected_user) if context is not None else get_chat_health(df),
+        "health_leaderboard": lambda: context.health_leaderboard() if context is not None and overall else [],
+        "health_timeline": lambda: context.health_timeline() if context is not None and overall else [],
+        "anomalies": lambda: context.anomalies(selected_user) if context is not None else get_anomalies(df),
+        "conversation_roles": lambda: context.roles if context is not None else assign_participant_roles(df)
+    }
+
+    res = {}
+    for name, compute in builders.items():
+        if sections is not None and name not in sections:
+            continue
+        with timer.stage(name):
+            res[name] = compute()
+    return res
+
+def json_safe(obj):
+    if isinstance(obj, dict):
+        return {str(k): json_safe(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [json_safe(i) for i in obj]
+    elif isinstance(obj, (np.integer, np.int64, np.int32)):
+        return int(obj)
+    elif isinstance(obj, (np.floating, np.float64, np.float32)):
+        return float(obj)
+    elif isinstance(obj, (pd.Timestamp, pd.Series, pd.DataFrame)):
+        if hasattr(obj, 'to_dict'):
+            return json_safe(obj.to_dict())
+        return str(obj)
+    elif hasattr(obj, 'isoformat'): # Dates/Timestamps
+        return obj.isoformat()
+    elif isinstance(obj, (int, float, str, bool)) or obj is None:
+        return obj
+    else:
+        return str(obj)
+
+def decode_chat(raw_data):
+    # Read uploaded file with flexible encoding
+    try:
+        return raw_data.decode("utf-8")
+    except UnicodeDecodeError:
+        try:
+            return raw_data.decode("utf-16")
+        except UnicodeDecodeError:
+            return raw_data.decode("latin-1")
+
+def parse_chat(raw_data, progress, timer, cached=True, sentiment=True):
+    """
+    Parsed, globally sorted frame of one upload with sentiment attached, plus
+    its word/emoji aggregates when the incremental store already built them.
+    Re-uploads of a chat are read back from the frame cache; cached=False
+    parses from scratch without touching the frame cache or incremental store.
+
+    sentiment=False skips scoring when the frame cache has no scored copy;
+    such a frame is neither cached nor kept in the incremental store.
+    """
+    frames = get_frame_cache() if cached else None
+    if frames is not None:
+        with timer.stage("frame_cache"):
+            key = content_key(raw_data, FRAME_VERSION)
+            df = frames.get(key)
+        if df is not None:
+            return df, None
+
+    with timer.stage("decode"):
+        data = decode_chat(raw_data)
+
+    store = get_chat_store() if cached and sentiment else None
+    if store is not None:
+        # Parses and scores only what is new since a stored earlier export
+        progress("sentiment", 0.1)
+        df, aggregates = store.parse(data, timer=timer)
+    else:
+        # Preprocess chat (Now returns GLOBALLY SORTED df)
+        with timer.stage("preprocess"):
+            df = preprocess_whatsapp_text(data)
+        aggregates = None
+
+    if df.empty:
+        print("Error: DataFrame is empty")
+        raise EmptyChatError("No messages found. The file might be in an unsupported format or empty.")
+
+    if store is None and sentiment:
+        # Attach sentiment to DF globally for anomaly detection
+        print("Attaching sentiment scores...")
+        progress("sentiment", 0.1)
+        with timer.stage("sentiment"):
+            df = attach_sentiment_to_df(df)
+
+    if frames is not None and sentiment:
+        with timer.stage("frame_cache"):
+            frames.put(key, df)
+    return df, aggregates
+
+def analyze_chat_bytes(raw_data, progress=None, timer=None, cached=True, sections=None, users=None, media_types=None):
+    """
+    Full /analyze pipeline for one uploaded export: parse, attach sentiment and
+    build every user's analytics. Returns the JSON-safe response body.
+
+    sections and users (lists of names) restrict the response to those
+    analytics sections and user views; sentiment is only scored when a
+    section in SENTIMENT_SECTIONS is requested. Unknown names raise
+    InvalidOptionError. media_types, the media counts of an uploaded zip
+    (app.archive.media_types), is returned as the body's "media_types".
+
+    progress, if given, is called as progress(stage, fraction) when a stage
+    starts and after each user; exceptions it raises abort the analysis.
+    timer, if given, is a StageTimer that records how long each stage took.
+    cached=False skips the parsed-frame cache and the incremental store.
+
+    Raises EmptyChatError when no messages are found; any other failure is
+    re-raised with the user it happened for.
+    """
+    if progress is None:
+        progress = lambda stage, fraction: None
+    if timer is None:
+        timer = StageTimer()
+    sections = resolve_sections(sections)
+    sentiment = sections is None or not SENTIMENT_SECTIONS.isdisjoint(sections)
+
+    progress("parsing", 0.0)
+    df, aggregates = parse_chat(raw_data, progress, timer, cached=cached, sentiment=sentiment)
+
+    all_users = get_user_list(df)
+    print(f"Found users: {all_users}")
+    timer.messages = len(df)
+    timer.users = len(all_users) - 1
+    users = select_users(all_users, users)
+    
+    # Heavy per-chat state (global reply stats, doc-term matrix, anomaly fits)
+    # is computed once on first use and shared by every user view
+    context = ChatContext(df, aggregates=aggregates, timer=timer)
+    
+    # Store analytics for each user
+    all_analytics = {}
+    progress("analytics", 0.3)
+    for done, user in enumerate(users, 1):
+        # print(f"Computing analytics for user: {user}") # Reduce log spam
+        try:
+            # Efficient Filtering
+            df_context = context.user_frame(user)
+            
+            raw_user_analytics = get_all_analytics(df_context, user, context=context, sections=sections)
+            with timer.stage("json_safe"):
+                all_analytics[user] = json_safe(raw_user_analytics)
+        except Exception as user_err:
+            print(f"Error computing analytics for user {user}: {user_err}")
+            traceback.print_exc()
+            raise RuntimeError(f"Error analyzing user {user}: {str(user_err)}") from user_err
+        progress("analytics", 0.3 + 0.7 * done / len(users))
+
+    with timer.stage("json_safe"):
+        result = json_safe({
+            "users": users,
+            "analytics": all_analytics
+        })
+    if media_types is not None:
+        result["media_types"] = media_types
+    print(f"Analyzed {timer.messages} messages from {timer.users} users in {timer.total():.2f}s")
+    return result
+
+def analyze_chat_timed(raw_data, sections=None, users=None, media_types=None):
+    """Worker entry point for /analyze: the response body and its StageTimer."""
+    timer = StageTimer()
+    return analyze_chat_bytes(raw_data, timer=timer, sections=sections, users=users, media_types=media_types), timer
+
+def warm_up():
+    """Pool initializer: load the sentiment lexicon before the first chat arrives."""
+    get_analyzer()
+
+def get_executor():
+    global _executor
+    if ANALYSIS_WORKERS <= 0:
+        return None
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS, mp_context=worker_context(), initializer=warm_up)
+    return _executor
+
+def worker_context():
+    """
+    Multiprocessing context for analysis pools. Workers come from a fork
+    server with the pipeline already imported: forking the API process itself
+    would copy its threads and open SQLite state (see app.jobs) into every worker.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return None
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['app.pipeline'])
+    return context
+
+def reset_executor():
+    """Drops a broken pool (e.g. a worker was OOM-killed); the next call starts a fresh one."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
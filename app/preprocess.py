@@ -2,10 +2,32 @@ import re
 import pandas as pd
 
 
+# Start of every message: "dd/mm/yy, hh:mm am - "
+MESSAGE_PATTERN = r"\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s?(?:am|pm)\s-\s"
+
+
 def preprocess_whatsapp_text(data: str) -> pd.DataFrame:
     """
     Takes raw WhatsApp chat text and returns a structured DataFrame
     """
+    df = parse_whatsapp_text(data)
+
+    # -----------------------------
+    # 8. Global Sort
+    # -----------------------------
+    # Stable, so messages sent within the same minute keep their chat order
+    df.sort_values('date', inplace=True, kind='stable')
+    df.reset_index(drop=True, inplace=True)
+
+    return df
+
+
+def parse_whatsapp_text(data: str) -> pd.DataFrame:
+    """
+    Structured DataFrame of the messages in file order (not yet sorted by date).
+    Parsing is per message, so text split at a message start parses to the
+    same rows as the whole.
+    """
 
     # -----------------------------
     # 1. Normalize unicode space
@@ -15,7 +37,7 @@ def preprocess_whatsapp_text(data: str) -> pd.DataFrame:
     # -----------------------------
     # 2. Timestamp regex pattern
     # -----------------------------
-    pattern = r"\d{1,2}/\d{1,2}/\d{2,4},\s\d{1,2}:\d{2}\s?(?:am|pm)\s-\s"
+    pattern = MESSAGE_PATTERN
 
     # -----------------------------
     # 3. Split messages & extract dates
@@ -84,11 +106,5 @@ def preprocess_whatsapp_text(data: str) -> pd.DataFrame:
     df['hour'] = df['date'].dt.hour
     df['minute'] = df['date'].dt.minute
 
-    # -----------------------------
-    # 8. Global Sort
-    # -----------------------------
-    df.sort_values('date', inplace=True)
-    df.reset_index(drop=True, inplace=True)
-
     return df
 
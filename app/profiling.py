@@ -0,0 +1,127 @@
+"""
+Opt-in profiling of a single /analyze request (?profile=1).
+
+Enabled only when CHATLYTICS_PROFILING=1. The analysis runs in its worker as
+usual, but under cProfile with tracemalloc tracking allocations, and with the
+result and frame caches bypassed so the whole pipeline is measured on exactly
+the uploaded input. The response gets a "profile" section with the hottest
+app/ and ml/ functions, the peak traced memory and the sites of the memory
+the run still held at its end (temporaries freed before then, which make up
+most of the peak, are not among them); the raw cProfile stats are saved
+next to a JSON copy of the report for snakeviz/pstats.
+"""
+
+import cProfile
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from app.cache import content_key
+from app.metrics import StageTimer
+from app.pipeline import analyze_chat_bytes
+
+PROFILING_ENABLED = os.environ.get('CHATLYTICS_PROFILING', '0') == '1'
+PROFILE_DIR = os.environ.get('CHATLYTICS_PROFILE_DIR', os.path.join('.cache', 'profiles'))
+# Entries in each top-N list
+PROFILE_TOP = int(os.environ.get('CHATLYTICS_PROFILE_TOP', 25))
+# Stack depth recorded per allocation: deeper stacks find the app/ml line
+# behind more library calls, but 8 frames already slow an analysis ~4x
+# (25 frames, ~50x)
+TRACEMALLOC_FRAMES = int(os.environ.get('CHATLYTICS_PROFILE_FRAMES', 8))
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_PROJECT_DIRS = tuple(os.path.join(_ROOT, package) + os.sep for package in ('app', 'ml'))
+
+
+def profile_chat(raw_data, sections=None, users=None, media_types=None):
+    """
+    Worker entry point for /analyze?profile=1: the response body with a
+    "profile" report added, and its StageTimer.
+    """
+    timer = StageTimer()
+    profiler = cProfile.Profile()
+    was_tracing = tracemalloc.is_tracing()
+    if not was_tracing:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    tracemalloc.reset_peak()
+    # Allocations that predate the run (when tracing was already on) are not charged to it
+    baseline = tracemalloc.take_snapshot()
+
+    started = time.perf_counter()
+    profiler.enable()
+    try:
+        body = analyze_chat_bytes(raw_data, timer=timer, cached=False, sections=sections, users=users, media_types=media_types)
+    finally:
+        profiler.disable()
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if not was_tracing:
+            tracemalloc.stop()
+
+    report = {
+        "wall_seconds": round(wall, 3),
+        "peak_memory_mb": round(peak / 2**20, 1),
+        "top_functions": top_functions(profiler),
+    }
+    report["retained_allocations"], report["unattributed_kb"] = retained_allocations(snapshot, baseline)
+    try:
+        report["saved_to"] = save_profile(raw_data, profiler, report)
+    except OSError as e:
+        # The analysis itself succeeded; a full disk should not fail the request
+        print(f"Could not save profile: {e}")
+        report["saved_to"] = None
+    body["profile"] = report
+    return body, timer
+
+def top_functions(profiler, limit=PROFILE_TOP):
+    """app/ and ml/ functions by cumulative time."""
+    rows = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in pstats.Stats(profiler).stats.items():
+        if _is_project_file(filename):
+            rows.append({
+                "function": f"{_relative(filename)}:{line}({name})",
+                "calls": calls,
+                "own_seconds": round(own, 4),
+                "cumulative_seconds": round(cumulative, 4),
+            })
+    rows.sort(key=lambda row: -row["cumulative_seconds"])
+    return rows[:limit]
+
+def retained_allocations(snapshot, baseline, limit=PROFILE_TOP):
+    """
+    Memory allocated during the run and still held at its end (snapshot
+    minus baseline), by the innermost app/ or ml/ line on each allocation's
+    stack (so a pandas allocation is charged to the project line that called
+    pandas). This is what a run leaves behind (results, caches), not what
+    made up its peak. Also returns the KB whose recorded stack has no
+    project frame.
+    """
+    sites = {}
+    unattributed = 0
+    for stat in snapshot.compare_to(baseline, 'traceback'):
+        frame = next((f for f in reversed(stat.traceback) if _is_project_file(f.filename)), None)
+        if frame is None:
+            unattributed += stat.size_diff
+            continue
+        site = sites.setdefault(f"{_relative(frame.filename)}:{frame.lineno}", [0, 0])
+        site[0] += stat.size_diff
+        site[1] += stat.count_diff
+    ranked = sorted((item for item in sites.items() if item[1][0] > 0), key=lambda item: -item[1][0])[:limit]
+    return [{"site": site, "size_kb": round(size / 1024, 1), "blocks": count} for site, (size, count) in ranked], round(max(0, unattributed) / 1024, 1)
+
+def save_profile(raw_data, profiler, report):
+    """Writes <hash>-<time>.prof (cProfile stats) and .json (the report); returns the .prof path."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{content_key(raw_data)[:16]}-{time.strftime('%Y%m%d-%H%M%S')}")
+    profiler.dump_stats(base + ".prof")
+    with open(base + ".json", 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=1)
+    return base + ".prof"
+
+def _is_project_file(filename):
+    return os.path.abspath(filename).startswith(_PROJECT_DIRS)
+
+def _relative(filename):
+    return os.path.relpath(os.path.abspath(filename), _ROOT)
@@ -1,7 +1,20 @@
-from ml.topic_modeling import extract_topics
+from ml.topic_modeling import extract_topics, TopicModeler, TOPIC_ENGINE, TOPIC_TIME_BUDGET
+from collections import OrderedDict
+import hashlib
+import os
+import time
 import pandas as pd
 
-def get_topics_analytics(df, selected_user='Overall'):
+# Topic jobs run in the process analyzing the chat (an analysis pool worker
+# behind the API, see app.pipeline.get_executor), one after another. Seconds
+# one run_* call may spend on its jobs; each fit's time budget enforces it
+TOPIC_JOB_TIMEOUT = float(os.environ.get('CHATLYTICS_TOPIC_TIMEOUT', 20))
+# Topic results per (chat fingerprint, user, month), kept per process
+TOPIC_CACHE_SIZE = 512
+
+_cache = OrderedDict()
+
+def get_topics_analytics(df, selected_user='Overall', dtm=None):
     # Filter by user if not Overall
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
@@ -10,10 +23,10 @@ def get_topics_analytics(df, selected_user='Overall'):
         return []
 
     # Get overall topics for this context
-    topics = extract_topics(df)
+    topics = extract_topics(df, dtm=dtm)
     return topics
 
-def get_topic_timeline(df, selected_user='Overall'):
+def get_topic_timeline(df, selected_user='Overall', dtm=None):
     # Group by month and get topics for each month
     if selected_user != 'Overall':
         df = df[df['user'] == selected_user]
@@ -21,22 +34,139 @@ def get_topic_timeline(df, selected_user='Overall'):
     if df.empty:
         return []
 
-    # Ensure date is datetime
-    df['date'] = pd.to_datetime(df['date'])
-    df['month_year'] = df['date'].dt.to_period('M').astype(str)
-    
     timeline = []
-    months = sorted(df['month_year'].unique())
+    
+    for month, month_df in _timeline_months(df):
+        month_topics = extract_topics(month_df, n_topics=3, dtm=dtm)
+        if month_topics:
+            timeline.append({
+                "month": month,
+                "topics": month_topics
+            })
+    
+    return timeline
+
+def _timeline_months(df):
+    # Month key as a standalone Series so the caller's frame is not mutated
+    month_year = pd.to_datetime(df['date']).dt.to_period('M').astype(str)
+    months = sorted(month_year.unique())
     
     # Analyze last 6 months or all if fewer
     for month in months[-6:]:
-        month_df = df[df['month_year'] == month]
+        month_df = df[month_year == month]
         if len(month_df) > 10:
-            month_topics = extract_topics(month_df, n_topics=3)
-            if month_topics:
-                timeline.append({
-                    "month": month,
-                    "topics": month_topics
-                })
-    
-    return timeline
+            yield month, month_df
+
+# -----------------------------
+# Execution with a deadline and caching
+# -----------------------------
+
+def chat_fingerprint(df):
+    """Content hash of a parsed chat, used to key cached topic results."""
+    hashed = pd.util.hash_pandas_object(df[['date', 'user', 'message']], index=False)
+    return hashlib.sha1(hashed.values.tobytes()).hexdigest()
+
+def run_topics_analytics(df, selected_user='Overall', dtm=None, fingerprint=None):
+    """
+    Deadline-bound, cached variant of get_topics_analytics.
+
+    Returns {"topics": [...], "timed_out": bool}; on timeout the topic list is empty.
+    """
+    if selected_user != 'Overall':
+        df = df[df['user'] == selected_user]
+
+    if df.empty:
+        return {"topics": [], "timed_out": False}
+
+    results, timed_out = _run_jobs(
+        [((fingerprint, selected_user, None), df, 5)], dtm
+    )
+    return {"topics": results.get(None, []), "timed_out": timed_out}
+
+def run_topic_timeline(df, selected_user='Overall', dtm=None, fingerprint=None):
+    """
+    Deadline-bound, cached variant of get_topic_timeline.
+
+    Returns {"timeline": [...], "timed_out": bool}; months that did not finish
+    in time are left out, so a timed-out timeline is partial.
+    """
+    if selected_user != 'Overall':
+        df = df[df['user'] == selected_user]
+
+    if df.empty:
+        return {"timeline": [], "timed_out": False}
+
+    jobs = [((fingerprint, selected_user, month), month_df, 3) for month, month_df in _timeline_months(df)]
+    results, timed_out = _run_jobs(jobs, dtm)
+
+    timeline = [
+        {"month": month, "topics": results[month]}
+        for (_, _, month), _, _ in jobs
+        if results.get(month)
+    ]
+    return {"timeline": timeline, "timed_out": timed_out}
+
+def _run_jobs(jobs, dtm):
+    """
+    Runs (cache_key, frame, n_topics) jobs, serving cache hits directly.
+    Returns ({month: topics}, timed_out).
+    """
+    results = {}
+    pending = []
+    for key, frame, n_topics in jobs:
+        if len(frame) < 10: # Minimum messages to find meaningful topics
+            results[key[2]] = []
+        elif key[0] is not None and key in _cache:
+            _cache.move_to_end(key)
+            results[key[2]] = _cache[key]
+        else:
+            pending.append((key, _job_args(frame, n_topics, dtm)))
+
+    if not pending:
+        return results, False
+
+    # One deadline for all the jobs: each fit gets at most what is left of it,
+    # and jobs past it are not started
+    timed_out = False
+    deadline = time.monotonic() + TOPIC_JOB_TIMEOUT
+    for key, args in pending:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            timed_out = True
+            continue
+        topics, job_timed_out = _topic_job(*args[:-1], min(args[-1], remaining))
+        results[key[2]] = topics
+        if job_timed_out:
+            timed_out = True
+        else:
+            _remember(key, topics)
+    return results, timed_out
+
+def _job_args(frame, n_topics, dtm):
+    # Fits never re-tokenize; take only the slice and the columns it uses
+    time_budget = min(TOPIC_TIME_BUDGET or TOPIC_JOB_TIMEOUT, TOPIC_JOB_TIMEOUT)
+    if dtm is None:
+        return None, None, frame['message'].tolist(), n_topics, time_budget
+
+    tf = dtm.rows(frame.index)
+    used = pd.unique(tf.indices)
+    used.sort()
+    return tf[:, used], dtm.feature_names[used], None, n_topics, time_budget
+
+def _topic_job(tf, feature_names, messages, n_topics, time_budget):
+    # The time budget makes the fit give up on its own, returning the best
+    # topics found so far
+    modeler = TopicModeler(n_topics=n_topics, engine=TOPIC_ENGINE, time_budget=time_budget)
+    if tf is not None:
+        topics = modeler.fit_matrix(tf, feature_names)
+    else:
+        topics = modeler.fit_transform(messages)
+    return topics, modeler.timed_out
+
+def _remember(key, topics):
+    if key[0] is None:
+        return
+    _cache[key] = topics
+    _cache.move_to_end(key)
+    while len(_cache) > TOPIC_CACHE_SIZE:
+        _cache.popitem(last=False)
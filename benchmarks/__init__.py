@@ -0,0 +1 @@
+"""Synthetic chat exports and the stage-level benchmark suite (python -m benchmarks.bench)."""
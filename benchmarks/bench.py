@@ -0,0 +1,298 @@
+"""
+Stage-level benchmarks on synthetic chats.
+
+    python -m benchmarks.bench                              # 1k, 10k, 100k messages
+    python -m benchmarks.bench --sizes 1k,10k,100k,1M,5M --skip topics
+    python -m benchmarks.bench --output new.json --baseline old.json
+
+For each size a deterministic export is generated (benchmarks.synthetic) and
+every function in BENCHMARKS is timed on it, best of --repeat runs. Up to
+--pipeline-max messages the whole /analyze pipeline also runs once with a
+StageTimer, giving the same per-stage breakdown as the Server-Timing header.
+
+The report lists seconds per size, throughput at the largest size and the
+scaling exponent (slope of log time against log messages from 10k up; 1.0
+is linear, 2.0 quadratic). The run fails (exit status 1) when a benchmark
+breaks a limit in thresholds.json, or is more than --tolerance slower than
+in a --baseline report from an earlier run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import numpy as np
+import pandas as pd
+from benchmarks.synthetic import generate_export, parse_size
+from app import analytics
+from app.aggregates import MessageAggregates
+from app.context import ChatContext
+from app.metrics import StageTimer
+from app.pipeline import analyze_chat_bytes, decode_chat
+from app.preprocess import preprocess_whatsapp_text
+from ml.anomalies import get_anomalies, get_anomalies_batch
+from ml.features import DailyFeatureStore
+from ml.health import get_chat_health, get_chat_health_batch, get_health_timeline
+from ml.roles import assign_participant_roles
+from ml.sentiment_inference import attach_sentiment_to_df, overall_sentiment, user_wise_sentiment
+from ml.sentiment_vader import get_analyzer
+from ml.topic_modeling import build_doc_term_matrix, extract_topics
+
+THRESHOLDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'thresholds.json')
+# Sizes below this are dominated by fixed overheads and left out of the scaling fit
+MIN_SCALING_SIZE = 10000
+# Slowdowns smaller than this many seconds are noise, whatever the ratio
+NOISE_SECONDS = 0.05
+
+
+class Chat:
+    """One synthetic chat at every stage of the pipeline, built on first use."""
+
+    def __init__(self, messages, users, seed=0):
+        self.messages = messages
+        self.text = generate_export(messages=messages, users=users, years=max(1.0, messages / 200000), seed=seed)
+        self.raw = self.text.encode('utf-8')
+        self._parsed = None
+        self._df = None
+        self._context = None
+
+    @property
+    def parsed(self):
+        if self._parsed is None:
+            self._parsed = preprocess_whatsapp_text(self.text)
+        return self._parsed
+
+    @property
+    def df(self):
+        if self._df is None:
+            self._df = attach_sentiment_to_df(self.parsed)
+        return self._df
+
+    @property
+    def context(self):
+        # Shared inputs (features, reply stats, doc-term matrix) for functions that take them
+        if self._context is None:
+            self._context = ChatContext(self.df)
+        return self._context
+
+
+# name -> (group, function of a Chat); groups are what --only/--skip select
+BENCHMARKS = {
+    "decode_chat": ("parse", lambda c: decode_chat(c.raw)),
+    "preprocess_whatsapp_text": ("parse", lambda c: preprocess_whatsapp_text(c.text)),
+    "attach_sentiment_to_df": ("sentiment", lambda c: attach_sentiment_to_df(c.parsed)),
+    "overall_sentiment": ("sentiment", lambda c: overall_sentiment(c.df)),
+    "user_wise_sentiment": ("sentiment", lambda c: user_wise_sentiment(c.df)),
+
+    "get_user_list": ("analytics", lambda c: analytics.get_user_list(c.df)),
+    "fetch_basic_stats": ("analytics", lambda c: analytics.fetch_basic_stats(c.df)),
+    "most_active_users": ("analytics", lambda c: analytics.most_active_users(c.df)),
+    "count_links": ("analytics", lambda c: analytics.count_links(c.df)),
+    "daily_timeline": ("analytics", lambda c: analytics.daily_timeline(c.df)),
+    "hourly_activity": ("analytics", lambda c: analytics.hourly_activity(c.df)),
+    "weekly_activity": ("analytics", lambda c: analytics.weekly_activity(c.df)),
+    "monthly_activity": ("analytics", lambda c: analytics.monthly_activity(c.df)),
+    "quarterly_activity": ("analytics", lambda c: analytics.quarterly_activity(c.df)),
+    "yearly_activity": ("analytics", lambda c: analytics.yearly_activity(c.df)),
+    "most_busy_day": ("analytics", lambda c: analytics.most_busy_day(c.df)),
+    "most_busy_weekday": ("analytics", lambda c: analytics.most_busy_weekday(c.df)),
+    "most_busy_month": ("analytics", lambda c: analytics.most_busy_month(c.df)),
+    "most_common_words": ("analytics", lambda c: analytics.most_common_words(c.df)),
+    "emoji_analysis": ("analytics", lambda c: analytics.emoji_analysis(c.df)),
+    "response_time_analysis": ("analytics", lambda c: analytics.response_time_analysis(c.df)),
+    "conversation_initiator": ("analytics", lambda c: analytics.conversation_initiator(c.df)),
+    "longest_message": ("analytics", lambda c: analytics.longest_message(c.df)),
+    "most_wordy_message": ("analytics", lambda c: analytics.most_wordy_message(c.df)),
+    "most_busy_hour": ("analytics", lambda c: analytics.most_busy_hour(c.df)),
+    "MessageAggregates.from_frame": ("analytics", lambda c: MessageAggregates.from_frame(c.df)),
+
+    "DailyFeatureStore": ("ml", lambda c: DailyFeatureStore(c.df)),
+    "get_anomalies": ("ml", lambda c: get_anomalies(c.df)),
+    "get_anomalies_batch": ("ml", lambda c: get_anomalies_batch(c.df, features=c.context.daily_features)),
+    "get_chat_health": ("ml", lambda c: get_chat_health(c.df)),
+    "get_chat_health_batch": ("ml", lambda c: get_chat_health_batch(c.df, features=c.context.daily_features)),
+    "get_health_timeline": ("ml", lambda c: get_health_timeline(c.df)),
+    "assign_participant_roles": ("ml", lambda c: assign_participant_roles(c.df)),
+
+    "build_doc_term_matrix": ("topics", lambda c: build_doc_term_matrix(c.df)),
+    "extract_topics": ("topics", lambda c: extract_topics(c.df, dtm=c.context.dtm)),
+}
+
+
+def time_call(func, repeat, budget):
+    """Best of up to `repeat` runs; stops repeating once `budget` seconds have been spent."""
+    best = float('inf')
+    spent = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = min(best, elapsed)
+        spent += elapsed
+        if spent >= budget:
+            break
+    return best
+
+def pipeline_stages(chat):
+    """Self time of each /analyze stage (cache-free) for the chat."""
+    timer = StageTimer()
+    analyze_chat_bytes(chat.raw, timer=timer, cached=False)
+    stages = {name: seconds for name, (seconds, _) in timer.stages.items()}
+    stages["total"] = timer.total()
+    return stages
+
+def scaling_exponent(timings):
+    """Slope of log(seconds) against log(messages) over sizes >= MIN_SCALING_SIZE, or None."""
+    points = [(n, t) for n, t in timings.items() if n >= MIN_SCALING_SIZE and t and t > 0]
+    if len(points) < 2:
+        return None
+    sizes, seconds = zip(*points)
+    return float(np.polyfit(np.log(sizes), np.log(seconds), 1)[0])
+
+def run(sizes, users=8, repeat=3, budget=60.0, groups=None, skip=(), pipeline_max=100000, log=print):
+    """
+    Times every selected benchmark at every size. A benchmark that takes
+    longer than `budget` seconds at one size is not run at larger sizes.
+    """
+    get_analyzer()
+
+    selected = {
+        name: func for name, (group, func) in BENCHMARKS.items()
+        if (groups is None or group in groups) and group not in skip and name not in skip
+    }
+    results = {name: {} for name in selected}
+    pipeline = {}
+    over_budget = set()
+
+    for n in sizes:
+        log(f"--- {n:,} messages")
+        started = time.perf_counter()
+        chat = Chat(n, users)
+        log(f"generated in {time.perf_counter() - started:.1f}s")
+        for name, func in selected.items():
+            if name in over_budget:
+                results[name][n] = None
+                continue
+            seconds = time_call(lambda: func(chat), repeat, budget)
+            results[name][n] = seconds
+            log(f"{name:<30} {seconds:10.4f}s {n / seconds:14,.0f} msg/s")
+            if seconds > budget:
+                over_budget.add(name)
+        if "pipeline" not in skip and n <= pipeline_max:
+            pipeline[n] = pipeline_stages(chat)
+            log(f"{'pipeline total':<30} {pipeline[n]['total']:10.4f}s")
+
+    return {
+        "sizes": list(sizes),
+        "users": users,
+        "environment": {
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+        },
+        "results": results,
+        "pipeline": pipeline,
+        "exponents": {name: scaling_exponent(timings) for name, timings in results.items()},
+    }
+
+def check(report, thresholds, baseline=None, tolerance=0.25):
+    """Threshold and baseline violations in a report, as human-readable strings."""
+    failures = []
+    largest = max(report["sizes"])
+    max_exponent = thresholds.get("max_exponent")
+    exponent_limits = thresholds.get("exponent_limits", {})
+    min_throughput = thresholds.get("min_messages_per_second", {})
+
+    for name, timings in report["results"].items():
+        limit = exponent_limits.get(name, max_exponent)
+        exponent = report["exponents"].get(name)
+        if limit is not None and exponent is not None and exponent > limit:
+            failures.append(f"{name}: scales as n^{exponent:.2f} (limit n^{limit})")
+
+        seconds = timings.get(largest)
+        if name in min_throughput and largest >= MIN_SCALING_SIZE and seconds:
+            if largest / seconds < min_throughput[name]:
+                failures.append(f"{name}: {largest / seconds:,.0f} msg/s at {largest:,} (limit {min_throughput[name]:,})")
+
+    if baseline is not None:
+        for name, timings in report["results"].items():
+            for n, seconds in timings.items():
+                before = baseline.get("results", {}).get(name, {}).get(str(n))
+                if seconds is None or before is None:
+                    continue
+                if seconds > before * (1 + tolerance) and seconds - before > NOISE_SECONDS:
+                    failures.append(f"{name}: {seconds:.3f}s at {n:,} messages, was {before:.3f}s")
+    return failures
+
+def format_report(report):
+    sizes = report["sizes"]
+    largest = max(sizes)
+    header = f"{'benchmark':<30}" + "".join(f"{_size_label(n):>10}" for n in sizes) + f"{'msg/s':>14}{'exponent':>10}"
+    lines = [header, "-" * len(header)]
+    for name, timings in report["results"].items():
+        cells = "".join(f"{timings[n]:10.3f}" if timings.get(n) is not None else f"{'-':>10}" for n in sizes)
+        seconds = timings.get(largest)
+        throughput = f"{largest / seconds:14,.0f}" if seconds else f"{'-':>14}"
+        exponent = report["exponents"].get(name)
+        exponent = f"{exponent:10.2f}" if exponent is not None else f"{'-':>10}"
+        lines.append(f"{name:<30}{cells}{throughput}{exponent}")
+
+    if report["pipeline"]:
+        measured = sorted(report["pipeline"])
+        lines += ["", f"{'pipeline stage':<30}" + "".join(f"{_size_label(n):>10}" for n in measured)]
+        stages = list(dict.fromkeys(stage for n in measured for stage in report["pipeline"][n]))
+        for stage in stages:
+            lines.append(f"{stage:<30}" + "".join(f"{report['pipeline'][n].get(stage, 0.0):10.3f}" for n in measured))
+    return "\n".join(lines)
+
+def _size_label(n):
+    if n >= 1000000 and n % 100000 == 0:
+        return f"{n / 1000000:g}M"
+    if n >= 1000 and n % 100 == 0:
+        return f"{n / 1000:g}k"
+    return str(n)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every pipeline stage on synthetic chats.")
+    parser.add_argument('--sizes', default='1k,10k,100k', help="comma-separated message counts, e.g. 1k,10k,100k,1M,5M")
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=3, help="runs per benchmark and size (best is kept)")
+    parser.add_argument('--budget', type=float, default=60.0, help="seconds per benchmark and size before larger sizes are skipped")
+    parser.add_argument('--only', help="comma-separated groups: parse, sentiment, analytics, ml, topics")
+    parser.add_argument('--skip', default='', help="comma-separated groups or benchmark names (and 'pipeline')")
+    parser.add_argument('--pipeline-max', type=parse_size, default=100000, help="largest size the full pipeline runs at")
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    parser.add_argument('--baseline', help="report JSON from an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed slowdown against --baseline (0.25 = 25%%)")
+    parser.add_argument('--output', help="write the report JSON here")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(parse_size(size) for size in args.sizes.split(','))
+    groups = set(args.only.split(',')) if args.only else None
+    skip = set(filter(None, args.skip.split(',')))
+    report = run(sizes, users=args.users, repeat=args.repeat, budget=args.budget, groups=groups,
+                 skip=skip, pipeline_max=args.pipeline_max, log=lambda line: print(line, file=sys.stderr))
+
+    with open(args.thresholds, encoding='utf-8') as f:
+        thresholds = json.load(f)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    report["failures"] = check(report, thresholds, baseline=baseline, tolerance=args.tolerance)
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    if report["failures"]:
+        print("\nRegressions:\n" + "\n".join(f"  {failure}" for failure in report["failures"]))
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
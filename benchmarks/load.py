@@ -0,0 +1,399 @@
+"""
+Load test of the /analyze service on localhost.
+
+    python -m benchmarks.load                                   # 40 uploads, 4 at a time
+    python -m benchmarks.load --workers 4 --rate 2 --requests 200 --output w4.json
+    python -m benchmarks.load --url http://127.0.0.1:8000 --server-pid 1234
+    python -m benchmarks.load --compare w1.json w2.json w4.json
+
+By default a uvicorn server for app.main:app is started on a free port with
+the result and frame caches off (so every upload is analyzed, --cache keeps
+them) and stopped afterwards. --workers, --queue and --env KEY=VALUE set its
+configuration.
+
+Uploads are deterministic synthetic exports drawn from --mix (size:weight
+pairs). Without --rate the load is closed-loop: --concurrency clients each
+send their next upload as soon as the previous one returns. With --rate
+uploads arrive as a Poisson process at that many per second (open loop),
+at most --concurrency in flight; latency then counts from the scheduled
+arrival, so client-side waiting is not hidden.
+
+The report has p50/p95/p99 latency overall and per size, throughput,
+errors by status (429 and 503 are the server shedding load) and the
+server's memory, sampled over the run: PSS (RSS where PSS is unavailable)
+summed over the server and its worker processes, which is what a container
+limit has to cover. --compare prints several reports side by side, e.g.
+runs with different worker counts.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlsplit
+import numpy as np
+from benchmarks.bench import _size_label
+from benchmarks.synthetic import generate_export, parse_size
+
+DEFAULT_MIX = '1k:6,10k:3,100k:1'
+# Seconds between server memory samples
+SAMPLE_INTERVAL = 0.25
+# Seconds to wait for a started server to answer /health
+STARTUP_TIMEOUT = 120
+
+
+def parse_mix(text):
+    """'1k:6,10k:3' -> [(1000, 0.666..), (10000, 0.333..)]; a size without a weight counts 1."""
+    pairs = []
+    for item in text.split(','):
+        size, _, weight = item.partition(':')
+        pairs.append((parse_size(size), float(weight or 1)))
+    total = sum(weight for _, weight in pairs)
+    return [(size, weight / total) for size, weight in pairs]
+
+def build_uploads(sizes, users=8, variants=1):
+    """`variants` different exports per size (different seeds), as bytes."""
+    return {
+        n: [generate_export(messages=n, users=users, years=max(1.0, n / 200000), seed=seed).encode('utf-8')
+            for seed in range(variants)]
+        for n in sizes
+    }
+
+def multipart(data, filename='chat.txt'):
+    """(content type, body) of a form upload with the file in the 'file' field."""
+    boundary = uuid.uuid4().hex
+    body = b''.join([
+        f'--{boundary}\r\n'.encode(),
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'.encode(),
+        b'Content-Type: text/plain\r\n\r\n',
+        data,
+        f'\r\n--{boundary}--\r\n'.encode(),
+    ])
+    return f'multipart/form-data; boundary={boundary}', body
+
+async def http_request(host, port, method, path, body=b'', content_type=None, timeout=None):
+    """
+    One HTTP/1.1 request on a fresh connection. Returns (status, headers,
+    body); headers are lower-cased.
+    """
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            head = [f'{method} {path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: close',
+                    f'Content-Length: {len(body)}']
+            if content_type:
+                head.append(f'Content-Type: {content_type}')
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            response = await reader.read()
+        finally:
+            writer.close()
+        header_block, _, payload = response.partition(b'\r\n\r\n')
+        lines = header_block.decode('latin-1').split('\r\n')
+        if not lines[0].startswith('HTTP/'):
+            raise ConnectionError("no HTTP response")
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        return int(lines[0].split()[1]), headers, payload
+
+    return await asyncio.wait_for(exchange(), timeout)
+
+def process_memory(pid):
+    """
+    PSS in bytes (RSS where smaps_rollup is unavailable) of pid and all its
+    descendants, or None without /proc.
+    """
+    try:
+        parents = {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        # ppid is the second field after the parenthesised command name
+                        parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+    except OSError:
+        return None
+
+    tree = {pid}
+    grew = True
+    while grew:
+        children = {child for child, parent in parents.items() if parent in tree} - tree
+        grew = bool(children)
+        tree |= children
+    return sum(_process_bytes(member) for member in tree)
+
+def _process_bytes(pid):
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith('Pss:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return 0
+
+class Server:
+    """A uvicorn process serving app.main:app on a free localhost port."""
+
+    def __init__(self, workers=None, queue=None, cache=False, env=None, log_path=os.devnull):
+        self.env = {
+            "CHATLYTICS_JOB_DB": os.path.join(tempfile.mkdtemp(), 'jobs.db'),
+        }
+        if not cache:
+            self.env.update({"CHATLYTICS_CACHE": "0", "CHATLYTICS_FRAME_CACHE": "0"})
+        if workers is not None:
+            self.env["CHATLYTICS_ANALYSIS_WORKERS"] = str(workers)
+        if queue is not None:
+            self.env["CHATLYTICS_ANALYSIS_QUEUE"] = str(queue)
+        self.env.update(env or {})
+        self.log_path = log_path
+        self.host = '127.0.0.1'
+        self.port = None
+        self.process = None
+
+    async def __aenter__(self):
+        with socket.socket() as probe:
+            probe.bind((self.host, 0))
+            self.port = probe.getsockname()[1]
+        self._log = open(self.log_path, 'ab')
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'uvicorn', 'app.main:app', '--host', self.host, '--port', str(self.port)],
+            env={**os.environ, **self.env}, stdout=self._log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while True:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited with status {self.process.returncode} (log: {self.log_path})")
+            try:
+                status, _, _ = await http_request(self.host, self.port, 'GET', '/health', timeout=5)
+                if status == 200:
+                    return self
+            except (OSError, asyncio.TimeoutError):
+                pass
+            if time.monotonic() > deadline:
+                await self.__aexit__()
+                raise RuntimeError(f"server did not answer /health within {STARTUP_TIMEOUT}s")
+            await asyncio.sleep(0.2)
+
+    async def __aexit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self._log.close()
+
+async def sample_memory(pid, samples, interval=SAMPLE_INTERVAL):
+    """Appends the server's memory to `samples` every `interval` seconds until cancelled."""
+    while True:
+        value = await asyncio.get_running_loop().run_in_executor(None, process_memory, pid)
+        if value is not None:
+            samples.append(value)
+        await asyncio.sleep(interval)
+
+async def run_load(host, port, uploads, mix, requests=40, concurrency=4, rate=None, seed=0, timeout=600, log=print):
+    """
+    Sends `requests` uploads drawn from `mix` and returns one record per
+    upload: size, status (or exception name), seconds, and the server's
+    X-Cache header.
+    """
+    rng = np.random.default_rng(seed)
+    sizes = [int(n) for n in rng.choice([n for n, _ in mix], size=requests, p=[weight for _, weight in mix])]
+    arrivals = np.cumsum(rng.exponential(1.0 / rate, size=requests)) if rate else None
+    records = []
+    limit = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async def send(i, scheduled):
+        n = sizes[i]
+        variants = uploads[n]
+        content_type, body = multipart(variants[i % len(variants)])
+        async with limit:
+            sent = time.perf_counter()
+            try:
+                status, headers, _ = await http_request(host, port, 'POST', '/analyze', body, content_type, timeout)
+                cache = headers.get('x-cache')
+            except Exception as e:
+                status, cache = type(e).__name__, None
+            done = time.perf_counter()
+        # Open loop: measured from the scheduled arrival, so waiting for a free client counts
+        seconds = done - (scheduled if scheduled is not None else sent)
+        records.append({"messages": n, "status": status, "seconds": seconds, "cache": cache, "finished": done - started})
+        if len(records) % max(1, requests // 10) == 0:
+            log(f"{len(records)}/{requests} done")
+
+    if arrivals is None:
+        await asyncio.gather(*(send(i, None) for i in range(requests)))
+    else:
+        tasks = []
+        for i, at in enumerate(arrivals):
+            delay = started + at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(send(i, started + at)))
+        await asyncio.gather(*tasks)
+    return records
+
+def _latency(seconds):
+    if not seconds:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(seconds, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3), "max": round(max(seconds), 3)}
+
+def summarize(records, memory_samples, config):
+    """Report for one run."""
+    wall = max((r["finished"] for r in records), default=0.0)
+    ok = [r for r in records if r["status"] == 200]
+    errors = {}
+    for r in records:
+        if r["status"] != 200:
+            errors[str(r["status"])] = errors.get(str(r["status"]), 0) + 1
+
+    by_size = {}
+    for n in sorted({r["messages"] for r in records}):
+        at_size = [r for r in records if r["messages"] == n]
+        done = [r["seconds"] for r in at_size if r["status"] == 200]
+        by_size[_size_label(n)] = {"requests": len(at_size), "ok": len(done), **_latency(done)}
+
+    memory = None
+    if memory_samples:
+        memory = {
+            "start_mb": round(memory_samples[0] / 2**20, 1),
+            "peak_mb": round(max(memory_samples) / 2**20, 1),
+            "mean_mb": round(float(np.mean(memory_samples)) / 2**20, 1),
+        }
+    return {
+        "config": config,
+        "requests": len(records),
+        "wall_seconds": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 3) if wall else None,
+        "messages_per_second": round(sum(r["messages"] for r in ok) / wall) if wall else None,
+        "latency": _latency([r["seconds"] for r in ok]),
+        "by_size": by_size,
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(records), 4) if records else None,
+        "cache_hits": sum(1 for r in ok if r["cache"] == "HIT"),
+        "server_memory": memory,
+    }
+
+def format_comparison(reports, labels):
+    """One row per report: configuration, throughput, latency, errors and peak memory."""
+    columns = ["run", "workers", "conc", "rate", "req/s", "p50", "p95", "p99", "errors", "peak MB"]
+    rows = []
+    for label, report in zip(labels, reports):
+        config = report["config"]
+        latency = report["latency"]
+        memory = report["server_memory"]
+        rows.append([
+            label,
+            config.get("server", {}).get("CHATLYTICS_ANALYSIS_WORKERS", "-"),
+            config["concurrency"],
+            config["rate"] or "closed",
+            report["throughput_rps"],
+            latency["p50"], latency["p95"], latency["p99"],
+            f"{report['error_rate']:.1%}",
+            memory["peak_mb"] if memory else "-",
+        ])
+    widths = [max(len(str(row[i])) for row in rows + [columns]) for i in range(len(columns))]
+    lines = ["  ".join(str(cell).rjust(width) for cell, width in zip(row, widths)) for row in [columns] + rows]
+    return "\n".join(lines)
+
+def format_report(report):
+    lines = [format_comparison([report], ["this run"]), ""]
+    lines.append(f"{'size':>8} {'requests':>9} {'ok':>5} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for size, row in report["by_size"].items():
+        lines.append(f"{size:>8} {row['requests']:>9} {row['ok']:>5} " + " ".join(f"{str(row[p]):>8}" for p in ("p50", "p95", "p99")))
+    if report["errors"]:
+        lines.append("errors: " + ", ".join(f"{status} x{count}" for status, count in sorted(report["errors"].items())))
+    return "\n".join(lines)
+
+async def load_test(args, log):
+    mix = parse_mix(args.mix)
+    log("generating uploads...")
+    uploads = build_uploads([n for n, _ in mix], users=args.users, variants=args.variants)
+    config = {"mix": args.mix, "requests": args.requests, "concurrency": args.concurrency,
+              "rate": args.rate, "users": args.users, "seed": args.seed}
+
+    if args.url:
+        url = urlsplit(args.url)
+        config["server"] = {"url": args.url}
+        return await _measure(url.hostname, url.port or 80, args.server_pid, uploads, mix, args, config, log)
+
+    env = dict(item.split('=', 1) for item in args.env)
+    async with Server(workers=args.workers, queue=args.queue, cache=args.cache, env=env, log_path=args.server_log) as server:
+        config["server"] = server.env
+        log(f"server ready on port {server.port}")
+        return await _measure(server.host, server.port, server.process.pid, uploads, mix, args, config, log)
+
+async def _measure(host, port, pid, uploads, mix, args, config, log):
+    samples = []
+    sampler = asyncio.ensure_future(sample_memory(pid, samples)) if pid else None
+    try:
+        records = await run_load(host, port, uploads, mix, requests=args.requests, concurrency=args.concurrency,
+                                 rate=args.rate, seed=args.seed, timeout=args.timeout, log=log)
+    finally:
+        if sampler is not None:
+            sampler.cancel()
+    return summarize(records, samples, config)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the /analyze service with synthetic uploads.")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="size:weight pairs, e.g. 1k:6,10k:3,100k:1")
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=4, help="uploads in flight at once")
+    parser.add_argument('--rate', type=float, help="Poisson arrivals per second (open loop); default closed loop")
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--variants', type=int, default=1, help="different exports per size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--timeout', type=float, default=600, help="seconds before an upload counts as failed")
+    parser.add_argument('--url', help="load an already running server instead of starting one")
+    parser.add_argument('--server-pid', type=int, help="with --url: process whose memory to sample")
+    parser.add_argument('--workers', type=int, help="CHATLYTICS_ANALYSIS_WORKERS for the started server")
+    parser.add_argument('--queue', type=int, help="CHATLYTICS_ANALYSIS_QUEUE for the started server")
+    parser.add_argument('--cache', action='store_true', help="keep the result and frame caches on")
+    parser.add_argument('--env', action='append', default=[], help="KEY=VALUE for the started server (repeatable)")
+    parser.add_argument('--server-log', default=os.devnull, help="file for the started server's output")
+    parser.add_argument('--label', help="name of this run in comparisons (default: --output file name)")
+    parser.add_argument('--baseline', help="report JSON from an earlier run to compare with")
+    parser.add_argument('--output', help="write the report JSON here")
+    parser.add_argument('--compare', nargs='+', metavar='REPORT', help="only print these reports side by side")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        reports = []
+        for path in args.compare:
+            with open(path, encoding='utf-8') as f:
+                reports.append(json.load(f))
+        print(format_comparison(reports, [r.get("label") or os.path.basename(p) for r, p in zip(reports, args.compare)]))
+        return 0
+
+    report = asyncio.run(load_test(args, log=lambda line: print(line, file=sys.stderr)))
+    report["label"] = args.label or (os.path.basename(args.output) if args.output else None)
+    print(format_report(report))
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        print()
+        print(format_comparison([baseline, report], [baseline.get("label") or "baseline", report["label"] or "this run"]))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
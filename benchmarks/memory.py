@@ -0,0 +1,266 @@
+"""
+Memory footprint of each benchmarked stage on synthetic chats.
+
+    python -m benchmarks.memory                             # 10k, 100k messages
+    python -m benchmarks.memory --sizes 10k,100k,1M --only analytics,ml
+
+Every function in benchmarks.bench.BENCHMARKS runs once per size, in two
+passes:
+
+- peak RSS growth above the RSS before the call (Linux: VmHWM is reset
+  through /proc/self/clear_refs; elsewhere the column is null). This sees
+  Arrow-backed string buffers, which tracemalloc does not.
+- peak tracemalloc allocation above the allocation before the call. In
+  this pass every DataFrame.copy() that copies data on behalf of app/ or
+  ml/ code (called there, or inside pandas on its behalf, like the
+  copy(deep=None) of assign() before copy-on-write) is recorded when it
+  copies all of the input's columns and at least FULL_COPY_ROWS of its
+  rows (dropping notifications does not make a copy cheap), and the input frames are fingerprinted before and after to
+  catch functions that mutate them.
+
+The run fails (exit status 1) when a function mutates its input, makes
+more full-frame copies than thresholds.json allows it, or peaks above its
+bytes-per-message budget at the largest size (10k messages up). Peak
+memory per request is what decides how many workers fit on a node.
+
+tracemalloc makes topic fits many times slower (about 30 minutes at 100k
+messages); --skip topics gives a quick run.
+"""
+
+import argparse
+import gc
+import json
+import sys
+import os
+import tracemalloc
+import pandas as pd
+from benchmarks.bench import BENCHMARKS, MIN_SCALING_SIZE, THRESHOLDS_PATH, Chat, _size_label
+from benchmarks.synthetic import parse_size
+from app.profiling import _is_project_file, _relative
+from ml.sentiment_vader import get_analyzer
+
+# Share of the input's rows from which a copy counts as a full-frame copy
+FULL_COPY_ROWS = 0.9
+
+# Peaks below this are allocator and RSS noise, whatever the budget
+NOISE_BYTES = 8 * 2**20
+
+_PANDAS_DIR = os.path.dirname(os.path.abspath(pd.__file__)) + os.sep
+
+_CLEAR_REFS = '/proc/self/clear_refs'
+_STATUS = '/proc/self/status'
+
+
+def rss_peak_supported():
+    """True when the peak RSS can be reset per call (Linux with a writable clear_refs)."""
+    try:
+        with open(_CLEAR_REFS, 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def _rss_kb():
+    """(current, peak) resident set size in KB since the last reset."""
+    values = {}
+    with open(_STATUS) as f:
+        for line in f:
+            if line.startswith(('VmRSS:', 'VmHWM:')):
+                key, value = line.split(':')
+                values[key] = int(value.split()[0])
+    return values['VmRSS'], values['VmHWM']
+
+def measure_rss(func):
+    """Bytes by which the peak RSS during func() exceeded the RSS before it."""
+    gc.collect()
+    with open(_CLEAR_REFS, 'w') as f:
+        f.write('5')
+    before, _ = _rss_kb()
+    func()
+    _, peak = _rss_kb()
+    return max(0, peak - before) * 1024
+
+def fingerprint(df):
+    """Columns, dtypes and a hash of every value, to detect in-place changes."""
+    return (
+        tuple(df.columns),
+        tuple(str(dtype) for dtype in df.dtypes),
+        int(pd.util.hash_pandas_object(df, index=True).sum()),
+    )
+
+def pandas_copy_on_write():
+    """Whether pandas shares data on copy(deep=None): always from pandas 3, an option before."""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    return pd.options.mode.copy_on_write is True
+
+class CopyTracker:
+    """
+    Records DataFrame.copy() calls that copy the data of a frame with all of
+    the input's columns and nearly all its rows, by the app/ or ml/ call site
+    they were made for. Copies inside pandas are charged to the project code
+    that called into pandas; copy(deep=None) copies data unless copy_on_write
+    (default: pandas_copy_on_write()).
+    """
+
+    def __init__(self, frames, copy_on_write=None):
+        self.shapes = {(len(df), frozenset(df.columns)) for df in frames}
+        self.copy_on_write = pandas_copy_on_write() if copy_on_write is None else copy_on_write
+        self.sites = []
+        self._original = None
+
+    def __enter__(self):
+        self._original = original = pd.DataFrame.copy
+        tracker = self
+
+        def copy(df, deep=True):
+            copies = deep or (deep is None and not tracker.copy_on_write)
+            if copies and tracker._is_full(df):
+                caller = sys._getframe(1)
+                while caller is not None and caller.f_code.co_filename.startswith(_PANDAS_DIR):
+                    caller = caller.f_back
+                if caller is not None and _is_project_file(caller.f_code.co_filename):
+                    code = caller.f_code
+                    tracker.sites.append(f"{_relative(code.co_filename)}:{code.co_name}")
+            return original(df, deep=deep)
+
+        pd.DataFrame.copy = copy
+        return self
+
+    def __exit__(self, *exc):
+        pd.DataFrame.copy = self._original
+
+    def _is_full(self, df):
+        columns = frozenset(df.columns)
+        return any(len(df) >= FULL_COPY_ROWS * rows and columns >= full for rows, full in self.shapes)
+
+def measure(chat, func, rss=True):
+    """Memory report for one function on one chat."""
+    inputs = {"parsed": chat.parsed, "df": chat.df}
+    before = {name: fingerprint(df) for name, df in inputs.items()}
+
+    rss_bytes = measure_rss(lambda: func(chat)) if rss else None
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        with CopyTracker(inputs.values()) as copies:
+            func(chat)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "peak_traced_bytes": peak - start,
+        "peak_rss_bytes": rss_bytes,
+        "full_frame_copies": copies.sites,
+        "mutated": sorted(name for name, df in inputs.items() if fingerprint(df) != before[name]),
+    }
+
+def run(sizes, users=8, groups=None, skip=(), log=print):
+    """Measures every selected benchmark at every size."""
+    get_analyzer()
+    rss = rss_peak_supported()
+    selected = {
+        name: func for name, (group, func) in BENCHMARKS.items()
+        if (groups is None or group in groups) and group not in skip and name not in skip
+    }
+    results = {name: {} for name in selected}
+    frames = {}
+
+    for n in sizes:
+        log(f"--- {n:,} messages")
+        chat = Chat(n, users)
+        # Shared inputs are built before any measurement, so no function is charged for them
+        chat.context.daily_features
+        chat.context.dtm
+        frames[n] = int(chat.df.memory_usage(deep=True).sum())
+        for name, func in selected.items():
+            result = measure(chat, func, rss=rss)
+            results[name][n] = result
+            flags = ", ".join(
+                [f"copies {site}" for site in sorted(set(result["full_frame_copies"]))]
+                + [f"mutates {name}" for name in result["mutated"]]
+            )
+            log(f"{name:<30} {_mb(result['peak_traced_bytes']):>9} traced {_mb(result['peak_rss_bytes']):>9} rss  {flags}")
+
+    return {"sizes": list(sizes), "users": users, "frame_bytes": frames, "results": results}
+
+def peak_bytes(result):
+    """The larger of the traced and RSS peaks."""
+    return max(result["peak_traced_bytes"], result["peak_rss_bytes"] or 0)
+
+def check(report, thresholds):
+    """Mutations, unexpected full-frame copies and budget overruns, as human-readable strings."""
+    limits = thresholds.get("memory", {})
+    default_budget = limits.get("max_peak_bytes_per_message")
+    budgets = limits.get("peak_bytes_per_message", {})
+    allowed_copies = limits.get("full_frame_copies", {})
+    largest = max(report["sizes"])
+    failures = []
+
+    for name, by_size in report["results"].items():
+        for n, result in sorted(by_size.items()):
+            if result["mutated"]:
+                failures.append(f"{name}: mutates its input ({', '.join(result['mutated'])}) at {n:,}")
+            if len(result["full_frame_copies"]) > allowed_copies.get(name, 0):
+                failures.append(
+                    f"{name}: {len(result['full_frame_copies'])} full-frame copies at {n:,} "
+                    f"(allowed {allowed_copies.get(name, 0)}): {', '.join(result['full_frame_copies'])}"
+                )
+
+        budget = budgets.get(name, default_budget)
+        result = by_size.get(largest)
+        if budget is not None and result is not None and largest >= MIN_SCALING_SIZE:
+            per_message = peak_bytes(result) / largest
+            if per_message > budget and peak_bytes(result) > NOISE_BYTES:
+                failures.append(f"{name}: peaks at {per_message:,.0f} bytes/message at {largest:,} (budget {budget:,})")
+    return failures
+
+def format_report(report):
+    sizes = report["sizes"]
+    lines = [f"{'peak MB (traced / rss)':<30}" + "".join(f"{_size_label(n):>20}" for n in sizes)]
+    lines.append(f"{'(parsed frame)':<30}" + "".join(f"{_mb(report['frame_bytes'][n]):>20}" for n in sizes))
+    for name, by_size in report["results"].items():
+        cells = [
+            f"{_mb(by_size[n]['peak_traced_bytes'])} / {_mb(by_size[n]['peak_rss_bytes'])}" if n in by_size else "-"
+            for n in sizes
+        ]
+        lines.append(f"{name:<30}" + "".join(f"{cell:>20}" for cell in cells))
+    return "\n".join(lines)
+
+def _mb(size):
+    return "-" if size is None else f"{size / 2**20:.1f}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure peak memory per stage on synthetic WhatsApp chats.")
+    parser.add_argument('--sizes', default='10k,100k', help="comma-separated message counts, e.g. 10k,100k,1M")
+    parser.add_argument('--users', type=int, default=8)
+    parser.add_argument('--only', help="comma-separated groups: parse, sentiment, analytics, ml, topics")
+    parser.add_argument('--skip', default='', help="comma-separated groups or benchmark names to leave out")
+    parser.add_argument('--thresholds', default=THRESHOLDS_PATH)
+    parser.add_argument('--output', help="write the report JSON here")
+    args = parser.parse_args(argv)
+
+    sizes = sorted(parse_size(size) for size in args.sizes.split(','))
+    groups = set(args.only.split(',')) if args.only else None
+    skip = set(filter(None, args.skip.split(',')))
+    report = run(sizes, users=args.users, groups=groups, skip=skip, log=lambda line: print(line, file=sys.stderr))
+
+    with open(args.thresholds, encoding='utf-8') as f:
+        thresholds = json.load(f)
+    failures = check(report, thresholds)
+    report["failures"] = failures
+
+    print(format_report(report))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+Deterministic synthetic WhatsApp exports for tests and benchmarks.
+
+generate_export() writes text in exactly the format preprocess_whatsapp_text
+parses ("dd/mm/yy, h:mm am - User: message"), with realistic structure:
+a few talkative participants and a long tail of quiet ones, messages that
+arrive in bursts separated by long silences, a daily rhythm, Hinglish words
+from HINGLISH_LEXICON mixed into English, emojis, links, media placeholders,
+multi-line messages and group notifications. The same arguments always give
+the same text.
+
+Command line:
+    python -m benchmarks.synthetic --messages 100000 --users 8 -o chat.txt
+"""
+
+import argparse
+import datetime
+import numpy as np
+from ml.sentiment_vader import HINGLISH_LEXICON
+from ml.topic_modeling import HINGLISH_STOPWORDS
+
+ENGLISH_WORDS = (
+    "the a to and is it you that of in for on this was with have are be at so just "
+    "not but what all we can do if about get like will one my me your they there out "
+    "up when time now how today tomorrow tonight morning night week weekend plan "
+    "project meeting office work deadline code bug deploy release client call email "
+    "lunch dinner pizza chai coffee party movie trip beach train flight ticket "
+    "football cricket match game score gym run weather rain sunny cold exam class "
+    "notes assignment birthday gift photo video song music home mom dad family"
+).split()
+HINGLISH_WORDS = sorted(HINGLISH_LEXICON)
+FILLER_WORDS = sorted(HINGLISH_STOPWORDS)
+EMOJIS = ["😂", "❤️", "😍", "👍", "🙏", "😭", "🔥", "😅", "🎉", "😊", "🤣", "😎", "💯", "😡", "🥳"]
+LINKS = ["https://youtu.be/", "https://www.instagram.com/p/", "https://example.com/post/", "http://maps.google.com/?q="]
+MEDIA_MESSAGE = "<Media omitted>"
+NOTIFICATIONS = ("{a} added {b}", "{a} left", "{a} changed the group description", "{a} changed this group's icon")
+
+# Relative activity by hour of day (quiet nights, busy evenings)
+HOURLY_WEIGHTS = np.array([
+    2, 1, 0.5, 0.3, 0.2, 0.3, 1, 3, 5, 6, 6, 6,
+    7, 6, 5, 5, 6, 7, 8, 9, 10, 10, 8, 5
+], dtype=float)
+
+
+def generate_export(messages=10000, users=5, years=1.0, emoji_rate=0.15, link_rate=0.02,
+                    media_rate=0.05, hinglish_rate=0.3, burstiness=0.8, multiline_rate=0.02,
+                    notification_rate=0.002, start=datetime.datetime(2021, 1, 1), seed=0):
+    """
+    WhatsApp export text with exactly `messages` messages (notifications
+    included) from `users` participants spread over `years` years.
+
+    Rates are per message (emoji_rate, link_rate, media_rate, multiline_rate,
+    notification_rate) or per word (hinglish_rate). burstiness is the share
+    of messages that follow the previous one within a few minutes; the rest
+    open a new burst after a long gap.
+    """
+    rng = np.random.default_rng(seed)
+    names = [f"User {i + 1}" for i in range(users)]
+
+    dates = _timestamps(rng, messages, years, burstiness, start)
+    # Zipf-like activity: the first few participants send most messages
+    weights = 1.0 / np.arange(1, users + 1) ** 0.9
+    senders = rng.choice(users, size=messages, p=weights / weights.sum())
+    # Within a burst the same person often sends several messages in a row
+    repeat = rng.random(messages) < 0.35
+    for i in np.flatnonzero(repeat[1:]) + 1:
+        senders[i] = senders[i - 1]
+
+    kinds = rng.random(messages)
+    lengths = np.minimum(rng.geometric(0.12, size=messages), 60)
+    hinglish = rng.random(lengths.sum()) < hinglish_rate
+    english_ids = rng.integers(len(ENGLISH_WORDS), size=lengths.sum())
+    hinglish_ids = rng.integers(len(HINGLISH_WORDS) + len(FILLER_WORDS), size=lengths.sum())
+    extras = rng.random((messages, 3))
+
+    lines = []
+    word = 0
+    for i in range(messages):
+        stamp = _stamp(dates[i])
+        kind = kinds[i]
+        if kind < notification_rate:
+            a, b = names[senders[i]], names[(senders[i] + 1) % users]
+            lines.append(f"{stamp} - {NOTIFICATIONS[i % len(NOTIFICATIONS)].format(a=a, b=b)}")
+            continue
+        if kind < notification_rate + media_rate:
+            text = MEDIA_MESSAGE
+        else:
+            n = lengths[i]
+            text = " ".join(
+                _hinglish_word(hinglish_ids[j]) if hinglish[j] else ENGLISH_WORDS[english_ids[j]]
+                for j in range(word, word + n)
+            )
+            word += n
+            if extras[i, 0] < link_rate:
+                text += f" {LINKS[i % len(LINKS)]}{i:x}"
+            if extras[i, 1] < emoji_rate:
+                text += " " + EMOJIS[(i * 7 + senders[i]) % len(EMOJIS)] * (1 + i % 3)
+            if extras[i, 2] < multiline_rate:
+                text += "\n" + ENGLISH_WORDS[i % len(ENGLISH_WORDS)] + " " + ENGLISH_WORDS[(i * 3) % len(ENGLISH_WORDS)]
+        lines.append(f"{stamp} - {names[senders[i]]}: {text}")
+    return "\n".join(lines) + "\n"
+
+def _hinglish_word(index):
+    if index < len(HINGLISH_WORDS):
+        return HINGLISH_WORDS[index]
+    return FILLER_WORDS[index - len(HINGLISH_WORDS)]
+
+def _timestamps(rng, messages, years, burstiness, start):
+    """
+    Sorted minute-resolution timestamps. Bursts open on random days at an
+    hour drawn from HOURLY_WEIGHTS; messages inside a burst follow within a
+    few minutes of each other.
+    """
+    opens = rng.random(messages) >= burstiness
+    opens[0] = True
+    burst = np.cumsum(opens) - 1
+    n_bursts = burst[-1] + 1
+
+    days = np.floor(rng.random(n_bursts) * years * 365)
+    hours = rng.choice(24, size=n_bursts, p=HOURLY_WEIGHTS / HOURLY_WEIGHTS.sum())
+    starts = np.sort(days * 1440 + hours * 60 + rng.integers(60, size=n_bursts))
+
+    # Minutes since the message's burst opened
+    elapsed = np.cumsum(np.where(opens, 0.0, rng.exponential(2.0, messages)))
+    elapsed -= elapsed[np.flatnonzero(opens)][burst]
+    # A long burst can run into the next one; keep the export in order
+    minutes = np.maximum.accumulate(starts[burst] + np.floor(elapsed)).astype(np.int64)
+    return (np.datetime64(start, 'm') + minutes.astype('timedelta64[m]')).astype(datetime.datetime)
+
+def _stamp(moment):
+    hour = moment.hour % 12 or 12
+    return f"{moment.day:02d}/{moment.month:02d}/{moment.year % 100:02d}, {hour}:{moment.minute:02d} {'am' if moment.hour < 12 else 'pm'}"
+
+def parse_size(text):
+    """'1k' -> 1000, '2.5M' -> 2500000, '300' -> 300."""
+    text = text.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic WhatsApp export.")
+    parser.add_argument('--messages', type=parse_size, default=10000)
+    parser.add_argument('--users', type=int, default=5)
+    parser.add_argument('--years', type=float, default=1.0)
+    parser.add_argument('--emoji-rate', type=float, default=0.15)
+    parser.add_argument('--link-rate', type=float, default=0.02)
+    parser.add_argument('--media-rate', type=float, default=0.05)
+    parser.add_argument('--hinglish-rate', type=float, default=0.3)
+    parser.add_argument('--burstiness', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='-')
+    args = parser.parse_args(argv)
+
+    text = generate_export(
+        messages=args.messages, users=args.users, years=args.years, emoji_rate=args.emoji_rate,
+        link_rate=args.link_rate, media_rate=args.media_rate, hinglish_rate=args.hinglish_rate,
+        burstiness=args.burstiness, seed=args.seed
+    )
+    if args.output == '-':
+        print(text, end='')
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+if __name__ == '__main__':
+    main()
@@ -1,30 +1,40 @@
+import os
+import warnings
+from collections import deque
 import pandas as pd
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.ensemble import IsolationForest
+from ml.features import DailyFeatureStore
 
-def detect_anomalies_if(df):
+# Pattern detector used by get_anomalies:
+#   isolation_forest - multidimensional IsolationForest refit on every call (default)
+#   streaming        - rolling median/MAD + EWMA scores, O(n) and updatable day by day
+ANOMALY_DETECTORS = ('isolation_forest', 'streaming')
+ANOMALY_DETECTOR = os.environ.get('CHATLYTICS_ANOMALY_DETECTOR', 'isolation_forest')
+# Per-user anomalies for a whole chat in one pass (see get_anomalies_batch)
+ANOMALY_BATCH = os.environ.get('CHATLYTICS_ANOMALY_BATCH', '0') == '1'
+
+def daily_anomaly_features(df):
+    """
+    Per-day feature frame used by the anomaly detectors, indexed by date.
+    Columns: [message_count, avg_sentiment, media_count, link_count]
+    """
+    return DailyFeatureStore(df).anomaly_features()
+
+def detect_anomalies_if(df, daily_stats=None):
     """
     Uses Isolation Forest to detect multidimensional anomalies.
     Features: [message_count, avg_sentiment, media_count, link_count]
+
+    daily_stats can be passed in (see daily_anomaly_features) when the caller
+    already built it for this frame.
     """
     if df.empty:
         return []
-        
-    df_copy = df.copy()
-    df_copy['date_only'] = df_copy['date'].dt.date
-    
-    # Feature Engineering per Day
-    daily_stats = df_copy.groupby('date_only').agg({
-        'message': 'count',
-        'sentiment_score': 'mean'
-    }).rename(columns={'message': 'message_count', 'sentiment_score': 'avg_sentiment'})
-    
-    # Media and Link counts per day
-    url_pattern = r'https?://\S+|www\.\S+'
-    daily_stats['media_count'] = df_copy[df_copy['message'] == '<Media omitted>'].groupby('date_only').size()
-    daily_stats['link_count'] = df_copy['message'].str.count(url_pattern).groupby(df_copy['date_only']).sum()
-    
-    daily_stats = daily_stats.fillna(0)
+
+    if daily_stats is None:
+        daily_stats = daily_anomaly_features(df)
     
     if len(daily_stats) < 5:
         return []
@@ -35,78 +45,254 @@ def detect_anomalies_if(df):
     # Model configuration
     # contamination=0.10 means we expect ~10% of days to be anomalies
     model = IsolationForest(contamination=0.10, random_state=42)
-    # anomaly_score is -1 for outliers, 1 for inliers
-    daily_stats['anomaly_label'] = model.fit_predict(features)
-    # raw_scores: lower is more anomalous
-    daily_stats['raw_severity'] = model.decision_function(features)
-    
-    # anomaly_score is -1 for outliers, 1 for inliers
-    outliers = daily_stats[daily_stats['anomaly_label'] == -1]
+    model.fit(features)
+    # raw_scores: lower is more anomalous; predict() labels exactly the negative ones as outliers
+    raw_severity = model.decision_function(features)
     
-    anomalies = []
+    # Whole-series statistics, computed once for every outlier
     mean_count = daily_stats['message_count'].mean()
     mean_sent = daily_stats['avg_sentiment'].mean()
-    
-    for date, row in outliers.iterrows():
-        # Determine the primary reason for anomaly
+    mean_media = daily_stats['media_count'].mean()
+    std_count = daily_stats['message_count'].std()
+
+    is_outlier = raw_severity < 0
+    outliers = daily_stats[is_outlier]
+    if outliers.empty:
+        return []
+
+    records = _pattern_records(outliers, raw_severity[is_outlier], mean_count, mean_sent, mean_media, std_count)
+    return records.to_dict('records')
+
+def _pattern_records(outliers, raw_severity, mean_count, mean_sent, mean_media, std_count):
+    """
+    Builds the detect_anomalies_if records for the outlier days as one frame.
+    The series statistics may be scalars or per-row arrays (batch mode).
+    """
+    count = outliers['message_count'].to_numpy()
+    sentiment = outliers['avg_sentiment'].to_numpy()
+    media = outliers['media_count'].to_numpy()
+
+    # Reason masks (volume, then sentiment, then media decide the type)
+    burst = count > mean_count * 2.5
+    drought = ~burst & (count < mean_count * 0.3) & (count > 0)
+    mood_drop = sentiment < mean_sent - 0.4
+    joy = ~mood_drop & (sentiment > mean_sent + 0.4)
+    media_frenzy = (media > mean_media * 3) & (media > 5)
+
+    masks = [burst, drought, mood_drop, joy, media_frenzy]
+    anomaly_type = np.select(masks, ["Activity Burst", "Activity Drought", "Sentiment Shift", "Joy Spike", "Media Burst"], "Pattern Anomaly")
+    anomaly_category = np.select(masks, ["spikes", "drops", "drops", "spikes", "spikes"], "spikes")
+
+    # Each (volume, sentiment, media) reason combination maps to one description
+    volume_reason = np.select([burst, drought], [1, 2], 0)
+    mood_reason = np.select([mood_drop, joy], [1, 2], 0)
+    description = _PATTERN_DESCRIPTIONS[volume_reason * 6 + mood_reason * 2 + media_frenzy.astype(int)]
+
+    # Z-score for more intuitive severity weighting
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_score = np.where(std_count > 0, np.abs((count - mean_count) / std_count), 0.0)
+
+    return pd.DataFrame({
+        "type": anomaly_type,
+        "category": anomaly_category,
+        "date": outliers.index.get_level_values(-1).astype(str),
+        "value": count.astype(int),
+        "severity": np.select([raw_severity < -0.15, raw_severity < -0.1], ["Critical", "High"], "Medium"),
+        # Invert decision function: lower (more negative) means higher severity rank
+        # Builtin round on Python floats, as the row-wise records did (np.round
+        # rounds the scaled value half to even, e.g. 19.05 -> 19.0); the z-score
+        # there was a numpy float, so np.round matches it
+        "severity_score": [round(float(x), 4) for x in np.abs(raw_severity)],
+        "z_score": np.round(z_score, 2),
+        "description": description,
+        "metrics": [
+            {"messages": int(c), "sentiment": round(float(s), 2)}
+            for c, s in zip(count, sentiment)
+        ]
+    })
+
+def _pattern_descriptions():
+    volume = [None, "unusually high volume", "significant dip in activity"]
+    mood = [None, "notable drop in conversation mood", "exceptionally high positive energy"]
+    media = [None, "media sharing frenzy"]
+    descriptions = []
+    for v in volume:
+        for m in mood:
+            for f in media:
+                reasons = [r for r in (v, m, f) if r]
+                descriptions.append(f"Unique pattern detected: {', '.join(reasons) if reasons else 'statistical outlier'}.")
+    return np.array(descriptions, dtype=object)
+
+_PATTERN_DESCRIPTIONS = _pattern_descriptions()
+
+class StreamingAnomalyDetector:
+    """
+    Flags spikes, droughts and sentiment shifts from the daily feature series
+    without fitting a model.
+
+    Each day is scored against the days before it only: message and media
+    counts by a robust z-score over a rolling median/MAD window, sentiment by
+    an EWMA mean/variance. detect() scores a whole series with vectorized
+    rolling statistics and leaves the detector positioned after its last day,
+    so update() can then be fed newly completed days one at a time without
+    rescoring the history. Records match detect_anomalies_if's schema.
+    """
+
+    def __init__(self, window=28, alpha=0.1, threshold=3.5, warmup=7):
+        self.window = window
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self._counts = deque(maxlen=window)
+        self._media = deque(maxlen=window)
+        self._sent_mean = None
+        # EWMA of squared sentiment surprises; variance is (1 - alpha) times this
+        self._sent_sq = 0.0
+        self.days_seen = 0
+
+    def detect(self, daily_stats):
+        """Scores every day of a daily feature frame (see daily_anomaly_features)."""
+        if daily_stats.empty:
+            return []
+
+        counts = daily_stats['message_count'].to_numpy(dtype=float)
+        media = daily_stats['media_count'].to_numpy(dtype=float)
+        sentiment = daily_stats['avg_sentiment'].to_numpy(dtype=float)
+
+        count_med, count_scale = self._rolling_median_scale(counts)
+        media_med, media_scale = self._rolling_median_scale(media)
+
+        # EWMA state after each day, shifted so day t sees only days < t
+        ewm_mean = pd.Series(sentiment).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        prev_mean = np.concatenate(([np.nan], ewm_mean[:-1]))
+        surprise_sq = np.nan_to_num((sentiment - prev_mean) ** 2)
+        ewm_sq = pd.Series(surprise_sq).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
+        prev_std = np.sqrt((1 - self.alpha) * np.concatenate(([np.nan], ewm_sq[:-1])))
+
+        history = np.minimum(np.arange(len(counts)), self.window)
+        scored = (np.arange(len(counts)) >= self.warmup) & (history >= self.warmup)
+
+        count_z = np.where(scored, (counts - count_med) / count_scale, 0.0)
+        media_z = np.where(scored, (media - media_med) / media_scale, 0.0)
+        sent_z = np.where(scored, (sentiment - prev_mean) / np.maximum(prev_std, 0.05), 0.0)
+
+        self._resume_from(counts, media, ewm_mean[-1], ewm_sq[-1])
+
+        records = []
+        for i in np.flatnonzero(scored):
+            record = self._score(daily_stats.index[i], counts[i], sentiment[i], count_z[i], media_z[i], sent_z[i], media[i])
+            if record:
+                records.append(record)
+        return records
+
+    def update(self, date, message_count, avg_sentiment, media_count, link_count=0):
+        """
+        Scores one new day against the current state, then folds it in.
+        Days must arrive in order and complete; returns a record or None.
+        """
+        record = None
+        if self.days_seen >= self.warmup and len(self._counts) >= self.warmup:
+            count_med, count_scale = _median_scale(np.array(self._counts))
+            media_med, media_scale = _median_scale(np.array(self._media))
+            sent_std = max(np.sqrt((1 - self.alpha) * self._sent_sq), 0.05)
+            record = self._score(
+                date, message_count, avg_sentiment,
+                (message_count - count_med) / count_scale,
+                (media_count - media_med) / media_scale,
+                (avg_sentiment - self._sent_mean) / sent_std,
+                media_count
+            )
+
+        if self._sent_mean is None:
+            self._sent_mean = avg_sentiment
+        else:
+            surprise_sq = (avg_sentiment - self._sent_mean) ** 2
+            self._sent_sq = (1 - self.alpha) * self._sent_sq + self.alpha * surprise_sq
+            self._sent_mean = (1 - self.alpha) * self._sent_mean + self.alpha * avg_sentiment
+        self._counts.append(message_count)
+        self._media.append(media_count)
+        self.days_seen += 1
+        return record
+
+    def _rolling_median_scale(self, values):
+        # Window for day t is the `window` days before it (NaN-padded at the start)
+        padded = np.concatenate((np.full(self.window, np.nan), values))
+        windows = sliding_window_view(padded, self.window)[:len(values)]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            median = np.nanmedian(windows, axis=1)
+            mad = np.nanmedian(np.abs(windows - median[:, None]), axis=1)
+        return median, np.maximum(1.4826 * mad, 1.0)
+
+    def _resume_from(self, counts, media, sent_mean, sent_sq):
+        self._counts = deque(counts[-self.window:], maxlen=self.window)
+        self._media = deque(media[-self.window:], maxlen=self.window)
+        self._sent_mean = sent_mean
+        self._sent_sq = sent_sq
+        self.days_seen = len(counts)
+
+    def _score(self, date, count, sentiment, count_z, media_z, sent_z, media):
         reasons = []
-        anomaly_category = "spikes" # Default
-        anomaly_type = "Pattern Anomaly"
-        
-        # Volume Anomalies
-        if row['message_count'] > mean_count * 2.5:
+        anomaly_type = None
+        anomaly_category = None
+
+        if count_z > self.threshold:
             reasons.append("unusually high volume")
-            anomaly_type = "Activity Burst"
-            anomaly_category = "spikes"
-        elif row['message_count'] < mean_count * 0.3 and row['message_count'] > 0:
+            anomaly_type, anomaly_category = "Activity Burst", "spikes"
+        elif count_z < -self.threshold and count > 0:
             reasons.append("significant dip in activity")
-            anomaly_type = "Activity Drought"
-            anomaly_category = "drops"
-            
-        # Sentiment Anomalies
-        if row['avg_sentiment'] < mean_sent - 0.4:
+            anomaly_type, anomaly_category = "Activity Drought", "drops"
+
+        if sent_z < -self.threshold:
             reasons.append("notable drop in conversation mood")
-            if anomaly_type == "Pattern Anomaly": 
-                anomaly_type = "Sentiment Shift"
-                anomaly_category = "drops"
-        elif row['avg_sentiment'] > mean_sent + 0.4:
+            if anomaly_type is None:
+                anomaly_type, anomaly_category = "Sentiment Shift", "drops"
+        elif sent_z > self.threshold:
             reasons.append("exceptionally high positive energy")
-            if anomaly_type == "Pattern Anomaly": 
-                anomaly_type = "Joy Spike"
-                anomaly_category = "spikes"
-            
-        # Media/Link Anomalies
-        if row['media_count'] > daily_stats['media_count'].mean() * 3 and row['media_count'] > 5:
+            if anomaly_type is None:
+                anomaly_type, anomaly_category = "Joy Spike", "spikes"
+
+        if media_z > self.threshold and media > 5:
             reasons.append("media sharing frenzy")
-            if anomaly_type == "Pattern Anomaly": 
-                anomaly_type = "Media Burst"
-                anomaly_category = "spikes"
-            
-        desc = f"Unique pattern detected: {', '.join(reasons) if reasons else 'statistical outlier'}."
-        
-        # Invert decision function: lower (more negative) means higher severity rank
-        severity_rank = abs(float(row['raw_severity']))
-        
-        # Z-score for more intuitive severity weighting
-        std_count = daily_stats['message_count'].std()
-        z_score = (row['message_count'] - mean_count) / std_count if std_count > 0 else 0
+            if anomaly_type is None:
+                anomaly_type, anomaly_category = "Media Burst", "spikes"
+
+        if anomaly_type is None:
+            return None
 
-        anomalies.append({
+        strength = max(abs(count_z), abs(sent_z), media_z)
+        return {
             "type": anomaly_type,
             "category": anomaly_category,
             "date": str(date),
-            "value": int(row['message_count']),
-            "severity": "Critical" if row['raw_severity'] < -0.15 else "High" if row['raw_severity'] < -0.1 else "Medium",
-            "severity_score": round(severity_rank, 4),
-            "z_score": round(abs(z_score), 2),
-            "description": desc,
+            "value": int(count),
+            "severity": "Critical" if strength >= 2 * self.threshold else "High" if strength >= 1.5 * self.threshold else "Medium",
+            "severity_score": round(min(strength / 10, 1.0), 4),
+            "z_score": round(abs(float(count_z)), 2),
+            "description": f"Unique pattern detected: {', '.join(reasons)}.",
             "metrics": {
-                "messages": int(row['message_count']),
-                "sentiment": round(float(row['avg_sentiment']), 2)
+                "messages": int(count),
+                "sentiment": round(float(sentiment), 2)
             }
-        })
-        
-    return anomalies
+        }
+
+
+def _median_scale(values):
+    median = np.median(values)
+    return median, max(1.4826 * np.median(np.abs(values - median)), 1.0)
+
+
+def detect_anomalies_streaming(df, daily_stats=None, detector=None):
+    """
+    Streaming alternative to detect_anomalies_if (same record schema).
+    """
+    if df.empty:
+        return []
+
+    if daily_stats is None:
+        daily_stats = daily_anomaly_features(df)
+    detector = detector or StreamingAnomalyDetector()
+    return detector.detect(daily_stats)
 
 def detect_gaps(df, gap_threshold_hours=72):
     """
@@ -115,59 +301,202 @@ def detect_gaps(df, gap_threshold_hours=72):
     """
     if df.empty or len(df) < 5:
         return []
-        
-    df = df.sort_values('date')
-    df['gap'] = df['date'].diff().dt.total_seconds() / 3600
-    
-    gaps = df[df['gap'] > gap_threshold_hours].copy()
+
+    # The parsed chat is already sorted; only sort (stably) when it is not
+    dates = df['date']
+    if not dates.is_monotonic_increasing:
+        df = df.sort_values('date', kind='stable')
+        dates = df['date']
+    gap = dates.diff().dt.total_seconds() / 3600
     
-    anomalies = []
-    for _, row in gaps.iterrows():
-        days = round(row['gap'] / 24, 1)
-        # Get the actual message and user that broke the silence
-        breaking_message = row['message']
-        author = row['user']
-        
-        anomalies.append({
-            "type": "Silent Period",
-            "category": "drops",
-            "date": str(row['date'].date()),
-            "severity": "High" if row['gap'] > 168 else "Medium", # High if > 1 week
-            "severity_score": min(row['gap'] / 720, 1.0), # Normalized score
-            "description": f"The conversation went silent for about {days} days before this message.",
-            "metrics": {
-                "gap_hours": int(row['gap']),
-                "duration_days": days
-            },
-            "breaking_message": breaking_message,
-            "user": author
-        })
-    return anomalies
+    is_gap = (gap > gap_threshold_hours).to_numpy()
+    if not is_gap.any():
+        return []
 
-def get_anomalies(df):
+    records = _gap_records(
+        dates[is_gap], gap.to_numpy()[is_gap],
+        # The actual message and user that broke the silence
+        df['message'].to_numpy()[is_gap], df['user'].to_numpy()[is_gap]
+    )
+    return records.to_dict('records')
+
+def _gap_records(dates, gap, messages, users):
+    """Builds the detect_gaps records for the messages that ended a silence."""
+    # Builtin round as in the row-wise records: np.round gives 19.0 for a 457.2 h gap
+    days = [round(float(h) / 24, 1) for h in gap]
+    return pd.DataFrame({
+        "type": "Silent Period",
+        "category": "drops",
+        "date": dates.dt.date.astype(str).to_numpy(),
+        "severity": np.where(gap > 168, "High", "Medium"), # High if > 1 week
+        "severity_score": np.minimum(gap / 720, 1.0), # Normalized score
+        "description": [f"The conversation went silent for about {d} days before this message." for d in days],
+        "metrics": [
+            {"gap_hours": int(h), "duration_days": d}
+            for h, d in zip(gap, days)
+        ],
+        "breaking_message": messages,
+        "user": users
+    })
+
+def get_anomalies(df, daily_stats=None, detector=None, top_k=10):
     """
     Compiles detected anomalies and partitions into spikes and drops.
+
+    detector is one of ANOMALY_DETECTORS (default CHATLYTICS_ANOMALY_DETECTOR);
+    top_k caps each list.
     """
     if df.empty: return {"spikes": [], "drops": []}
+
+    detector = detector or ANOMALY_DETECTOR
+    if detector not in ANOMALY_DETECTORS:
+        raise ValueError(f"Unknown anomaly detector '{detector}', expected one of {ANOMALY_DETECTORS}")
     
-    # Pass 1: Pattern Anomalies (IF-based)
-    pattern_anomalies = detect_anomalies_if(df)
+    # Pass 1: Pattern Anomalies (IF-based or streaming)
+    if detector == 'streaming':
+        pattern_anomalies = detect_anomalies_streaming(df, daily_stats=daily_stats)
+    else:
+        pattern_anomalies = detect_anomalies_if(df, daily_stats=daily_stats)
     
     # Pass 2: Gap Detection
     gap_anomalies = detect_gaps(df)
     
     # Combine results
-    all_anomalies = pattern_anomalies + gap_anomalies
-    
-    # Partition
-    spikes = [a for a in all_anomalies if a.get('category') == 'spikes']
-    drops = [a for a in all_anomalies if a.get('category') == 'drops']
-    
-    # Sort each by severity_score descending
-    spikes.sort(key=lambda x: x.get('severity_score', 0), reverse=True)
-    drops.sort(key=lambda x: x.get('severity_score', 0), reverse=True)
+    return _partition(pattern_anomalies + gap_anomalies, top_k)
+
+def _partition(all_anomalies, top_k):
+    if not all_anomalies:
+        return {"spikes": [], "drops": []}
+
+    # Partition and keep the top_k of each by severity_score (ties keep detection order)
+    scores = pd.DataFrame({
+        'category': [a.get('category') for a in all_anomalies],
+        'severity_score': [a.get('severity_score', 0) for a in all_anomalies]
+    })
+
+    def top(category):
+        ranked = scores[scores['category'] == category].nlargest(top_k, 'severity_score', keep='first')
+        return [all_anomalies[i] for i in ranked.index]
     
     return {
-        "spikes": spikes[:10],
-        "drops": drops[:10]
+        "spikes": top('spikes'),
+        "drops": top('drops')
     }
+
+def get_anomalies_batch(df, users=None, detector=None, top_k=10, features=None):
+    """
+    get_anomalies for many users in one pass over the chat.
+
+    Builds the (user, day) feature panel once (or takes a DailyFeatureStore).
+    With the isolation_forest detector, one model is fitted on features
+    normalized per user (each user's days are compared with that user's own
+    mean and spread), instead of one model per user. The streaming detector
+    scores each user's series with its usual vectorized statistics. Gaps come
+    from one grouped diff over the whole chat.
+
+    Returns {user: {"spikes": [...], "drops": [...]}}, for every user in
+    `users` (default: all participants).
+    """
+    detector = detector or ANOMALY_DETECTOR
+    if detector not in ANOMALY_DETECTORS:
+        raise ValueError(f"Unknown anomaly detector '{detector}', expected one of {ANOMALY_DETECTORS}")
+
+    features = features or DailyFeatureStore(df)
+    panel = _user_feature_panel(features)
+    if users is None:
+        users = [u for u in panel.index.get_level_values('user').unique()]
+    users = list(users)
+
+    records = {user: [] for user in users}
+    panel = panel[panel.index.get_level_values('user').isin(users)]
+
+    # Pass 1: Pattern Anomalies
+    if detector == 'streaming':
+        for user, daily in panel.groupby(level='user', sort=False):
+            records[user].extend(StreamingAnomalyDetector().detect(daily.droplevel('user')))
+    else:
+        for user, user_records in _batch_isolation_forest(panel):
+            records[user].extend(user_records)
+
+    # Pass 2: Gap Detection
+    for user, user_records in _batch_gaps(df, users):
+        records[user].extend(user_records)
+
+    return {user: _partition(user_records, top_k) for user, user_records in records.items()}
+
+def _user_feature_panel(features):
+    panel = features.panel.drop(index='group_notification', level='user', errors='ignore')
+    daily = pd.DataFrame({
+        'message_count': panel['message_count'],
+        'avg_sentiment': panel['sentiment_sum'] / panel['sentiment_count'].replace(0, np.nan),
+        'media_count': panel['media_count'],
+        'link_count': panel['link_count'],
+    }).fillna(0)
+    daily.index = pd.MultiIndex.from_arrays(
+        [panel.index.get_level_values('user'), panel.index.get_level_values('only_date').date],
+        names=['user', 'date_only']
+    )
+    return daily
+
+def _batch_isolation_forest(panel):
+    columns = ['message_count', 'avg_sentiment', 'media_count', 'link_count']
+    user_index = panel.index.get_level_values('user')
+    grouped = panel.groupby(level='user', sort=False)
+
+    # Same minimum history as detect_anomalies_if
+    eligible = (grouped['message_count'].transform('size') >= 5).to_numpy()
+    panel = panel[eligible]
+    if panel.empty:
+        return []
+    user_index = user_index[eligible]
+    grouped = panel.groupby(level='user', sort=False)
+
+    means = grouped[columns].transform('mean')
+    stds = grouped[columns].transform('std')
+    normalized = ((panel[columns] - means) / stds.replace(0, np.nan)).fillna(0)
+
+    model = IsolationForest(contamination=0.10, random_state=42)
+    model.fit(normalized)
+    raw_severity = model.decision_function(normalized)
+
+    is_outlier = raw_severity < 0
+    if not is_outlier.any():
+        return []
+
+    outliers = panel[is_outlier]
+    frame = _pattern_records(
+        outliers, raw_severity[is_outlier],
+        means['message_count'].to_numpy()[is_outlier],
+        means['avg_sentiment'].to_numpy()[is_outlier],
+        means['media_count'].to_numpy()[is_outlier],
+        stds['message_count'].to_numpy()[is_outlier]
+    )
+    frame['_user'] = user_index[is_outlier]
+    return [
+        (user, group.drop(columns='_user').to_dict('records'))
+        for user, group in frame.groupby('_user', sort=False)
+    ]
+
+def _batch_gaps(df, users, gap_threshold_hours=72):
+    df = df[df['user'].isin(users)]
+    if df.empty:
+        return []
+    if not df['date'].is_monotonic_increasing:
+        df = df.sort_values('date', kind='stable')
+
+    grouped = df.groupby('user', sort=False)['date']
+    gap = grouped.diff().dt.total_seconds() / 3600
+    # Same minimum history as detect_gaps
+    enough = grouped.transform('size') >= 5
+    is_gap = ((gap > gap_threshold_hours) & enough).to_numpy()
+    if not is_gap.any():
+        return []
+
+    frame = _gap_records(
+        df['date'][is_gap], gap.to_numpy()[is_gap],
+        df['message'].to_numpy()[is_gap], df['user'].to_numpy()[is_gap]
+    )
+    return [
+        (user, group.to_dict('records'))
+        for user, group in frame.groupby('user', sort=False)
+    ]
@@ -0,0 +1,122 @@
+"""
+Daily Feature Store for WhatsApp Chat Analysis
+
+Builds one (user, day) panel of daily features for a whole chat in a single
+groupby. Anomaly detection, chat health, timelines and conversation initiators
+all read their per-day numbers from it instead of re-grouping the chat (and
+re-running the URL regex) for every user.
+
+New daily features are added with register_daily_feature().
+"""
+
+import numpy as np
+import pandas as pd
+
+URL_PATTERN = r'https?://\S+|www\.\S+'
+MEDIA_MESSAGE = '<Media omitted>'
+
+
+def _sentiment_scores(df):
+    if 'sentiment_score' not in df.columns:
+        return np.zeros(len(df))
+    return df['sentiment_score'].fillna(0).to_numpy()
+
+
+def _sentiment_counts(df):
+    if 'sentiment_score' not in df.columns:
+        return np.zeros(len(df), dtype=np.int64)
+    return df['sentiment_score'].notna().to_numpy().astype(np.int64)
+
+
+# name -> (per-message values, aggregation used within a day and across users)
+DAILY_FEATURES = {
+    'message_count': (lambda df: np.ones(len(df), dtype=np.int64), 'sum'),
+    'media_count': (lambda df: (df['message'] == MEDIA_MESSAGE).to_numpy().astype(np.int64), 'sum'),
+    'link_count': (lambda df: df['message'].str.count(URL_PATTERN).to_numpy(), 'sum'),
+    'sentiment_sum': (_sentiment_scores, 'sum'),
+    'sentiment_count': (_sentiment_counts, 'sum'),
+    # Row position of the day's first message; the chat is globally sorted by date
+    'first_position': (lambda df: np.arange(len(df)), 'min'),
+}
+
+
+def register_daily_feature(name, func, agg='sum'):
+    """
+    Adds a daily feature to every store built afterwards.
+
+    Args:
+        name: Column name in the daily frames
+        func: Callable taking the chat DataFrame and returning one value per message
+        agg: Aggregation applied per day and when combining users ('sum', 'min', 'max', 'mean')
+    """
+    DAILY_FEATURES[name] = (func, agg)
+
+
+class DailyFeatureStore:
+    """
+    Per-chat table of daily features, indexed by (user, day).
+
+    Daily frames returned by for_user() are indexed by python dates, the same
+    keys the analytics functions used to get from df['date'].dt.date.
+    """
+
+    def __init__(self, df):
+        self.aggs = {name: agg for name, (_, agg) in DAILY_FEATURES.items()}
+        values = {name: func(df) for name, (func, _) in DAILY_FEATURES.items()}
+        values['user'] = df['user'].to_numpy()
+        values['only_date'] = df['date'].dt.normalize().to_numpy()
+
+        self.panel = pd.DataFrame(values).groupby(['user', 'only_date'], sort=True).agg(self.aggs)
+        self._cache = {}
+
+    @property
+    def users(self):
+        return self.panel.index.get_level_values('user').unique()
+
+    def for_user(self, user='Overall', include_notifications=True):
+        """
+        Daily features for one user, or for the whole chat when user is 'Overall'.
+        Only days with at least one message are present.
+        """
+        key = (user, include_notifications)
+        if key not in self._cache:
+            if user == 'Overall':
+                panel = self.panel
+                if not include_notifications:
+                    panel = panel.drop(index='group_notification', level='user', errors='ignore')
+                daily = panel.groupby(level='only_date').agg(self.aggs)
+            elif user in self.users:
+                daily = self.panel.xs(user, level='user')
+            else:
+                daily = self.panel.iloc[:0].droplevel('user')
+            daily = daily.copy()
+            daily.index = pd.Index(daily.index.date, name='only_date')
+            self._cache[key] = daily
+        return self._cache[key]
+
+    def anomaly_features(self, user='Overall'):
+        """Features for the anomaly detectors: [message_count, avg_sentiment, media_count, link_count]."""
+        daily = self.for_user(user)
+        features = pd.DataFrame({
+            'message_count': daily['message_count'],
+            'avg_sentiment': daily['sentiment_sum'] / daily['sentiment_count'].replace(0, np.nan),
+            'media_count': daily['media_count'],
+            'link_count': daily['link_count'],
+        }, index=daily.index.rename('date_only'))
+        return features.fillna(0)
+
+    def timeline(self, user='Overall'):
+        """Messages per day, shaped like daily_timeline()."""
+        return self.for_user(user)['message_count'].reset_index()
+
+    def initiators(self):
+        """Who sent the first (non-notification) message of each day, counted per user."""
+        panel = self.panel.drop(index='group_notification', level='user', errors='ignore')
+        firsts = (
+            panel['first_position']
+            .reset_index()
+            .sort_values('first_position')
+            .drop_duplicates('only_date')
+            .sort_values('only_date')
+        )
+        return firsts['user'].value_counts()
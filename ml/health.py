@@ -1,12 +1,18 @@
 import pandas as pd
 import numpy as np
-from ml.anomalies import get_anomalies
 from app.analytics import response_time_analysis
 
-def get_chat_health(df):
+# Shape of get_anomalies output when nothing was flagged
+EMPTY_ANOMALY_REPORT = {"spikes": [], "drops": []}
+
+def get_chat_health(df, anomalies=None, resp_times=None, daily=None):
     """
     Calculates the health score using the user-defined formula:
     0.30 * Sentiment + 0.25 * Engagement + 0.20 * Response + 0.15 * Balance - 0.10 * Anomaly Penalty
+
+    anomalies (get_anomalies output), resp_times (response_time_analysis output)
+    and daily (notification-free DailyFeatureStore.for_user frame) can be passed
+    in when already computed for this frame.
     """
     if df.empty:
         return {"score": 0, "rating": "N/A", "metrics": {}}
@@ -24,7 +30,7 @@ def get_chat_health(df):
     # 2. Engagement Score (0-100)
     # messages_per_day and active_days_ratio
     days_range = (df_clean['date'].max() - df_clean['date'].min()).days + 1
-    active_days = df_clean['date'].dt.date.nunique()
+    active_days = len(daily) if daily is not None else df_clean['date'].dt.date.nunique()
     active_days_ratio = active_days / days_range
     msgs_per_day = len(df_clean) / days_range
     
@@ -33,7 +39,8 @@ def get_chat_health(df):
 
     # 3. Response Score (0-100)
     # Lower response time = higher score
-    resp_times = response_time_analysis(df_clean, 'Overall')
+    if resp_times is None:
+        resp_times = response_time_analysis(df_clean, 'Overall')
     if resp_times:
         avg_resp_min = np.mean(list(resp_times.values()))
         # Score 100 if < 5 mins, 0 if > 1440 mins (1 day)
@@ -51,10 +58,20 @@ def get_chat_health(df):
         balance_score = 20 # Low balance for one-sided chats
 
     # 5. Anomaly Penalty (0-10)
-    # Deduction based on detected anomalies
-    anomalies = get_anomalies(df_clean)
-    penalty = min(10, len(anomalies) * 2)
+    # Deduction based on detected anomalies (the same for any report, so none is fitted)
+    penalty = anomaly_penalty(anomalies if anomalies is not None else EMPTY_ANOMALY_REPORT)
+
+    return _health_report(sentiment_score, engagement_score, response_score, balance_score, penalty)
+
+def anomaly_penalty(anomalies):
+    """
+    Anomaly penalty (0-10) for a get_anomalies report. It counts the report's
+    categories (spikes, drops), not the anomalies in them, so every report
+    gives the same penalty and health never needs an IsolationForest fit.
+    """
+    return min(10, len(anomalies) * 2)
 
+def _health_report(sentiment_score, engagement_score, response_score, balance_score, penalty):
     # Final Calculation
     final_score = (
         (0.30 * sentiment_score) + 
@@ -64,18 +81,7 @@ def get_chat_health(df):
     ) - penalty
 
     final_score = round(max(0, min(100, final_score)), 1)
-
-    # Determine Rating
-    if final_score >= 85: 
-        rating, color = "Legendary", "text-emerald-400"
-    elif final_score >= 70:
-        rating, color = "Vibrant", "text-teal-400"
-    elif final_score >= 50:
-        rating, color = "Healthy", "text-indigo-400"
-    elif final_score >= 30:
-        rating, color = "Sporadic", "text-amber-400"
-    else:
-        rating, color = "Cold", "text-rose-400"
+    rating, color = _rating(final_score)
 
     return {
         "score": final_score,
@@ -90,3 +96,226 @@ def get_chat_health(df):
         },
         "description": f"This chat is {rating.lower()} with a refined health score of {final_score}%."
     }
+
+def _rating(final_score):
+    # Determine Rating
+    if final_score >= 85: 
+        return "Legendary", "text-emerald-400"
+    elif final_score >= 70:
+        return "Vibrant", "text-teal-400"
+    elif final_score >= 50:
+        return "Healthy", "text-indigo-400"
+    elif final_score >= 30:
+        return "Sporadic", "text-amber-400"
+    else:
+        return "Cold", "text-rose-400"
+
+def get_chat_health_batch(df, users=None, features=None, resp_times=None, anomalies=None):
+    """
+    get_chat_health for 'Overall' and every participant in one vectorized pass.
+
+    Each user's score is exactly what get_chat_health returns for that user's
+    filtered frame, but all components are numpy arrays over users built from
+    shared per-chat aggregates (label counts, first/last dates, active days).
+
+    Args:
+        df: Full chat with sentiment attached
+        users: Users to score (default: 'Overall' plus all participants)
+        features: DailyFeatureStore for df, used for active days
+        resp_times: response_time_analysis(df, 'Overall') if already computed
+        anomalies: {user: get_anomalies output} if already computed
+
+    Returns:
+        Dictionary mapping user -> get_chat_health result
+    """
+    df_clean = df[df['user'] != 'group_notification']
+    if df_clean.empty:
+        return {user: {"score": 0, "rating": "N/A", "metrics": {}} for user in (users or ['Overall'])}
+
+    codes, names = pd.factorize(df_clean['user'])
+    n_users = len(names)
+    if users is None:
+        users = ['Overall'] + sorted(names)
+    anomalies = anomalies or {}
+
+    # Shared per-user aggregates: one bincount per quantity
+    counts = np.bincount(codes, minlength=n_users)
+    positive = np.bincount(codes, weights=(df_clean['sentiment'] == 'Positive').to_numpy(), minlength=n_users)
+    negative = np.bincount(codes, weights=(df_clean['sentiment'] == 'Negative').to_numpy(), minlength=n_users)
+    date_span = df_clean['date'].groupby(codes).agg(['min', 'max'])
+    days_range = (date_span['max'] - date_span['min']).dt.days.to_numpy() + 1
+    if features is not None:
+        active_days = features.panel['message_count'].groupby(level='user').size().reindex(names).to_numpy()
+    else:
+        active_days = df_clean['date'].dt.normalize().groupby(codes).nunique().to_numpy()
+
+    # 1. Sentiment Score (0-100)
+    sentiment = np.clip((positive / counts - negative / counts + 1) * 50, 0, 100)
+
+    # 2. Engagement Score (0-100)
+    engagement = np.minimum(100, (counts / days_range * 5) + (active_days / days_range * 50))
+
+    # 3. Response / 4. Balance: a single-user frame has no replies (default 50)
+    # and a one-sided participation spread (20)
+    response = np.full(n_users, 50.0)
+    balance = np.full(n_users, 20.0)
+
+    results = {}
+    index = {name: i for i, name in enumerate(names)}
+    for user in users:
+        if user == 'Overall':
+            results[user] = _overall_health(df_clean, counts, positive, negative, features, resp_times, anomalies.get(user))
+        elif user in index:
+            i = index[user]
+            penalty = anomaly_penalty(anomalies.get(user, EMPTY_ANOMALY_REPORT))
+            results[user] = _health_report(float(sentiment[i]), float(engagement[i]), float(response[i]), float(balance[i]), penalty)
+        else:
+            results[user] = {"score": 0, "rating": "N/A", "metrics": {}}
+    return results
+
+def _overall_health(df_clean, counts, positive, negative, features, resp_times, anomalies):
+    total = counts.sum()
+    sentiment_score = max(0, min(100, (positive.sum() / total - negative.sum() / total + 1) * 50))
+
+    days_range = (df_clean['date'].max() - df_clean['date'].min()).days + 1
+    # Users' active days overlap, so the chat's own count comes from distinct dates
+    if features is not None:
+        chat_active_days = len(features.for_user('Overall', include_notifications=False))
+    else:
+        chat_active_days = df_clean['date'].dt.normalize().nunique()
+    engagement_score = min(100, (total / days_range * 5) + (chat_active_days / days_range * 50))
+
+    if resp_times is None:
+        resp_times = response_time_analysis(df_clean, 'Overall')
+    if resp_times:
+        avg_resp_min = np.mean(list(resp_times.values()))
+        response_score = max(0, 100 * (1 - (min(1440, avg_resp_min) / 1440)))
+    else:
+        response_score = 50
+
+    # Same ordering as value_counts() (descending), so std/mean round identically
+    user_counts = pd.Series(np.sort(counts)[::-1])
+    if len(user_counts) > 1:
+        cv = user_counts.std() / user_counts.mean()
+        balance_score = max(0, 100 * (1 - (cv / 2)))
+    else:
+        balance_score = 20
+
+    penalty = anomaly_penalty(anomalies if anomalies is not None else EMPTY_ANOMALY_REPORT)
+    return _health_report(sentiment_score, engagement_score, response_score, balance_score, penalty)
+
+def get_health_timeline(df, freq='M', anomalies=None):
+    """
+    Health score and its components per calendar week ('W') or month ('M').
+
+    Every per-day quantity (messages per user, sentiment labels, reply latency
+    sums and counts) is laid out as a prefix-sum array, so each window's
+    components are differences of two cumulative values rather than a
+    get_chat_health call on a sliced frame. Replies count towards the day they
+    were sent, and the penalty is anomaly_penalty, as in get_chat_health, so a
+    chat that fits in one window scores the same in both.
+
+    Args:
+        df: Chat with sentiment attached, sorted by date
+        freq: Window size, 'W' (weeks starting Monday) or 'M' (calendar months)
+        anomalies: get_anomalies(df) if already computed (no fit is needed)
+
+    Returns:
+        List of {date, score, rating, metrics} for every window with messages,
+        where date is the first day of the window
+    """
+    df_clean = df[df['user'] != 'group_notification']
+    if df_clean.empty:
+        return []
+
+    timestamps = df_clean['date'].to_numpy().astype('datetime64[ns]').astype(np.int64)
+    days = df_clean['date'].dt.normalize()
+    first_day = days.iloc[0]
+    day_idx = (days - first_day).dt.days.to_numpy()
+    n_days = int(day_idx[-1]) + 1
+    codes, names = pd.factorize(df_clean['user'])
+    n_users = len(names)
+
+    # Daily tables, (user, day) where per user
+    def per_day(weights=None):
+        return np.bincount(day_idx, weights=weights, minlength=n_days)
+
+    user_day = codes * n_days + day_idx
+    user_counts = np.bincount(user_day, minlength=n_users * n_days).reshape(n_users, n_days)
+    positive = per_day((df_clean['sentiment'] == 'Positive').to_numpy())
+    negative = per_day((df_clean['sentiment'] == 'Negative').to_numpy())
+
+    # Replies: consecutive messages by different users, as in response_time_analysis
+    changed = codes[1:] != codes[:-1]
+    reply_slot = user_day[1:][changed]
+    latency = (timestamps[1:] - timestamps[:-1])[changed] / 6e10
+    reply_sum = np.bincount(reply_slot, weights=latency, minlength=n_users * n_days).reshape(n_users, n_days)
+    reply_count = np.bincount(reply_slot, minlength=n_users * n_days).reshape(n_users, n_days)
+
+    # Window boundaries as day positions: [starts[i], ends[i])
+    periods = pd.date_range(first_day, periods=n_days, freq='D').to_period(freq)
+    starts = np.concatenate([[0], np.flatnonzero(periods[1:] != periods[:-1]) + 1])
+    ends = np.append(starts[1:], n_days)
+
+    def window_sum(daily):
+        prefix = np.concatenate([np.zeros(daily.shape[:-1] + (1,)), np.cumsum(daily, axis=-1)], axis=-1)
+        return prefix[..., ends] - prefix[..., starts]
+
+    counts = window_sum(user_counts)
+    total = counts.sum(axis=0)
+    keep = total > 0
+    starts, ends, counts, total = starts[keep], ends[keep], counts[:, keep], total[keep]
+
+    # 1. Sentiment Score (0-100)
+    sentiment = np.clip((window_sum(positive)[keep] / total - window_sum(negative)[keep] / total + 1) * 50, 0, 100)
+
+    # 2. Engagement Score (0-100): first/last message of the window's active days
+    active = np.flatnonzero(user_counts.sum(axis=0))
+    lo = np.searchsorted(active, starts)
+    hi = np.searchsorted(active, ends) - 1
+    first_ts = pd.Series(timestamps).groupby(day_idx).min().reindex(range(n_days)).to_numpy()
+    last_ts = pd.Series(timestamps).groupby(day_idx).max().reindex(range(n_days)).to_numpy()
+    days_range = (last_ts[active[hi]] - first_ts[active[lo]]) // (86400 * 10**9) + 1
+    engagement = np.minimum(100, (total / days_range * 5) + ((hi - lo + 1) / days_range * 50))
+
+    # 3. Response Score (0-100): mean over responders of their mean reply time
+    replies = window_sum(reply_count)[:, keep]
+    responded = replies > 0
+    n_responders = responded.sum(axis=0)
+    user_means = np.divide(window_sum(reply_sum)[:, keep], replies, out=np.zeros_like(replies), where=responded)
+    avg_resp = user_means.sum(axis=0) / np.maximum(n_responders, 1)
+    response = np.where(n_responders > 0, np.maximum(0, 100 * (1 - np.minimum(1440, avg_resp) / 1440)), 50)
+
+    # 4. Balance Score (0-100): coefficient of variation of active users' counts
+    present = counts > 0
+    n_present = present.sum(axis=0)
+    mean = total / n_present
+    with np.errstate(invalid='ignore', divide='ignore'):
+        std = np.sqrt(np.where(present, (counts - mean) ** 2, 0).sum(axis=0) / (n_present - 1))
+    balance = np.where(n_present > 1, np.maximum(0, 100 * (1 - (std / mean) / 2)), 20)
+
+    # 5. Anomaly Penalty (0-10), the same definition as get_chat_health
+    penalty = np.full(len(total), anomaly_penalty(anomalies if anomalies is not None else EMPTY_ANOMALY_REPORT), dtype=float)
+
+    score = np.round(np.clip(
+        (0.30 * sentiment) + (0.25 * engagement) + (0.20 * response) + (0.15 * balance) - penalty,
+        0, 100
+    ), 1)
+
+    window_dates = (first_day + pd.to_timedelta(starts, unit='D')).strftime('%Y-%m-%d')
+    timeline = []
+    for i, date in enumerate(window_dates):
+        rating, _ = _rating(score[i])
+        timeline.append({
+            "date": date,
+            "score": float(score[i]),
+            "rating": rating,
+            "metrics": {
+                "sentiment": round(float(sentiment[i]), 1),
+                "engagement": round(float(engagement[i]), 1),
+                "response": round(float(response[i]), 1),
+                "balance": round(float(balance[i]), 1),
+                "penalty": round(float(penalty[i]), 1)
+            }
+        })
+    return timeline
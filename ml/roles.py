@@ -1,133 +1,133 @@
 import pandas as pd
 import numpy as np
-from app.analytics import response_time_analysis, conversation_initiator
+from app.analytics import conversation_initiator
 
-def assign_participant_roles(df):
-    """
-    Identifies the Top 3 people who fit each role best.
+# Per-user metric columns of the roles matrix
+METRICS = ['starts', 'responses', 'msg_count', 'avg_words', 'media_links', 'night_msgs', 'listener_score', 'responder_score']
+# Metrics displayed as whole numbers (the rest are shown with one decimal)
+COUNT_METRICS = {'starts', 'responses', 'msg_count', 'media_links', 'night_msgs'}
+
+def build_role_matrix(df, initiators=None):
     """
-    if df.empty:
-        return {}
+    Builds the user x metric matrix behind the conversation roles.
+
+    All per-message quantities are computed once as vectorized columns and
+    reduced in a single groupby. initiators (conversation_initiator output for
+    the whole chat) can be passed in when already computed.
 
-    df_clean = df[df['user'] != 'group_notification'].copy()
+    Returns (users, matrix) with users in order of first appearance and one
+    matrix column per entry of METRICS.
+    """
+    df_clean = df[df['user'] != 'group_notification']
     if df_clean.empty:
-        return {}
+        return np.array([], dtype=object), np.zeros((0, len(METRICS)))
 
-    users = df_clean['user'].unique()
-    if len(users) == 0:
-        return {}
+    codes, users = pd.factorize(df_clean['user'])
+    n_users = len(users)
 
     # 1. Initiator Stats
-    initiator_counts = conversation_initiator(df_clean, 'Overall')
-    if isinstance(initiator_counts, pd.Series):
-        initiator_counts = initiator_counts.to_dict()
-    
-    # 2. Response Stats
-    users_arr = df_clean['user'].values
-    mask = (users_arr[1:] != users_arr[:-1])
-    responders = users_arr[1:][mask]
-    response_counts = pd.Series(responders).value_counts().to_dict()
-    
-    # 3. Basic Stats
-    user_stats = df_clean.groupby('user').agg({
-        'message': ['count', lambda x: x.str.len().mean(), lambda x: x.str.split().str.len().mean()]
-    })
-    user_stats.columns = ['msg_count', 'avg_chars', 'avg_words']
+    if initiators is None:
+        initiators = conversation_initiator(df_clean, 'Overall')
+    starts = pd.Series(initiators).reindex(users, fill_value=0).to_numpy(dtype=float)
+
+    # 2. Response Stats: a message answers the previous one when the author changes
+    changed = codes[1:] != codes[:-1]
+    responses = np.bincount(codes[1:][changed], minlength=n_users).astype(float)
 
-    # 4. Media & Links
+    # 3-5. Basic, media/link and night owl (11 PM - 5 AM) stats in one groupby
     url_pattern = r'https?://\S+|www\.\S+'
-    df_clean['is_media'] = df_clean['message'] == '<Media omitted>'
-    df_clean['link_count'] = df_clean['message'].str.count(url_pattern)
-    
-    media_link_stats = df_clean.groupby('user').agg({
-        'is_media': 'sum',
-        'link_count': 'sum'
+    messages = df_clean['message']
+    hours = df_clean['date'].dt.hour.to_numpy()
+    per_message = pd.DataFrame({
+        'msg_count': np.ones(len(df_clean)),
+        'words': messages.str.split().str.len().to_numpy(dtype=float),
+        'media_links': (messages == '<Media omitted>').to_numpy() + messages.str.count(url_pattern).to_numpy(),
+        'night_msgs': ((hours >= 23) | (hours < 5)).astype(float),
     })
+    totals = per_message.groupby(codes).sum().reindex(range(n_users), fill_value=0)
 
-    # 5. Night Owl Stats (11 PM - 5 AM)
-    df_clean['hour'] = df_clean['date'].dt.hour
-    night_stats = df_clean[(df_clean['hour'] >= 23) | (df_clean['hour'] < 5)].groupby('user').size().to_dict()
-
-    # Calculate scores for each user
-    user_metrics = {}
-    for user in users:
-        msg_count = user_stats.loc[user, 'msg_count']
-        avg_words = user_stats.loc[user, 'avg_words']
-        starts = initiator_counts.get(user, 0)
-        responses = response_counts.get(user, 0)
-        media_links = media_link_stats.loc[user, 'is_media'] + media_link_stats.loc[user, 'link_count']
-        night_msgs = night_stats.get(user, 0)
-        
-        user_metrics[user] = {
-            "starts": starts,
-            "responses": responses,
-            "msg_count": msg_count,
-            "avg_words": avg_words,
-            "media_links": media_links,
-            "night_msgs": night_msgs,
-            "listener_score": -(msg_count * avg_words) # Lower engagement = higher score
-        }
+    msg_count = totals['msg_count'].to_numpy()
+    avg_words = totals['words'].to_numpy() / msg_count
+
+    matrix = np.column_stack([
+        starts,
+        responses,
+        msg_count,
+        avg_words,
+        totals['media_links'].to_numpy(dtype=float),
+        totals['night_msgs'].to_numpy(),
+        -(msg_count * avg_words), # Lower engagement = higher listener score
+        # Responder: High responses, Low starts relative to responses
+        responses / np.maximum(1, starts),
+    ])
+    return np.asarray(users, dtype=object), matrix
+
+def top_k(values, k=3):
+    """
+    Indices of the k largest values, largest first. Uses argpartition to find
+    the cut-off; ties keep the users' original order, like a stable sort.
+    """
+    if len(values) <= k:
+        return np.argsort(-values, kind='stable')
+    kth = values[np.argpartition(-values, k - 1)[k - 1]]
+    candidates = np.flatnonzero(values >= kth)
+    return candidates[np.argsort(-values[candidates], kind='stable')][:k]
+
+def assign_participant_roles(df, initiators=None):
+    """
+    Identifies the Top 3 people who fit each role best.
+    """
+    if df.empty:
+        return {}
 
-    # Identify Top N
-    def get_top_n(metric_name, n=3, higher_is_better=True):
-        sorted_users = sorted(
-            user_metrics.items(), 
-            key=lambda x: x[1][metric_name], 
-            reverse=higher_is_better
-        )
-        return sorted_users[:n]
-
-    has_media = max((m.get("media_links", 0) for m in user_metrics.values()), default=0) > 0
-    top_initiators = get_top_n("starts")
-    top_drivers = get_top_n("msg_count")
-    top_broadcasters = get_top_n("media_links") if has_media else get_top_n("avg_words")
-    top_listeners = get_top_n("listener_score")
-    top_night_owls = get_top_n("night_msgs")
-    
-    # Responder: High responses, Low starts relative to responses
-    for u in user_metrics:
-        user_metrics[u]["responder_score"] = user_metrics[u]["responses"] / max(1, user_metrics[u]["starts"])
-    top_responders = get_top_n("responder_score")
-
-    def format_top(top_list, metric_key, suffix=""):
+    users, matrix = build_role_matrix(df, initiators=initiators)
+    if len(users) == 0:
+        return {}
+
+    column = {metric: matrix[:, i] for i, metric in enumerate(METRICS)}
+
+    def format_top(ranking_metric, metric_key, suffix=""):
         res = []
-        for u, v in top_list:
-            val = v.get(metric_key, 0)
-            if isinstance(val, (float, np.float64, np.float32)):
-                val_str = f"{float(val):.1f}{suffix}"
+        for idx in top_k(column[ranking_metric]):
+            val = column[metric_key][idx]
+            if metric_key in COUNT_METRICS:
+                val_str = f"{int(val)}{suffix}"
             else:
-                val_str = f"{val}{suffix}"
-            res.append({"user": str(u), "value": val_str})
+                val_str = f"{float(val):.1f}{suffix}"
+            res.append({"user": str(users[idx]), "value": val_str})
         return res
 
+    has_media = column["media_links"].max() > 0
+    broadcast_metric = "media_links" if has_media else "avg_words"
+
     roles_info = {
         "Initiator": {
-            "top": format_top(top_initiators, "starts", " starts"),
+            "top": format_top("starts", "starts", " starts"),
             "description": "Starts conversations frequently, setting the pace for everyone.",
             "label": "Start Power"
         },
         "Responder": {
-            "top": format_top(top_responders, "responses", " replies"),
+            "top": format_top("responder_score", "responses", " replies"),
             "description": "Mostly replies and keeps the thread alive without initiating much.",
             "label": "Reply Count"
         },
         "Driver": {
-            "top": format_top(top_drivers, "msg_count", " msgs"),
+            "top": format_top("msg_count", "msg_count", " msgs"),
             "description": "The engine of the chat. Keeps conversation going with heavy engagement.",
             "label": "Total Activity"
         },
         "Listener": {
-            "top": format_top(top_listeners, "avg_words", " words"),
+            "top": format_top("listener_score", "avg_words", " words"),
             "description": "Quiet observer. Prefers short replies and low overall message volume.",
             "label": "Avg Length"
         },
         "Broadcaster": {
-            "top": format_top(top_broadcasters, "media_links" if has_media else "avg_words", " items" if has_media else " words"),
+            "top": format_top(broadcast_metric, broadcast_metric, " items" if has_media else " words"),
             "description": "Information hub. Shares long messages, interesting links, or media files.",
             "label": "Shared Info"
         },
         "Night Owl": {
-            "top": format_top(top_night_owls, "night_msgs", " msgs"),
+            "top": format_top("night_msgs", "night_msgs", " msgs"),
             "description": "Most active when the world sleeps. Frequently messages between 11 PM and 5 AM.",
             "label": "Late Activity"
         }
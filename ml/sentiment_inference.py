@@ -41,7 +41,8 @@ def overall_sentiment(df: pd.DataFrame) -> dict:
     Compute overall sentiment statistics for the chat.
     
     Args:
-        df: DataFrame with 'message' column
+        df: DataFrame with 'message' column (scores already attached by
+            attach_sentiment_to_df are reused instead of re-analyzing)
         
     Returns:
         Dictionary with:
@@ -51,7 +52,9 @@ def overall_sentiment(df: pd.DataFrame) -> dict:
             - average_compound: Average compound score (-1 to +1)
             - total_messages: Total message count
     """
-    df = df.copy()
+    if _has_sentiment(df):
+        return aggregate_sentiment(df["sentiment"].tolist(), df["sentiment_score"].tolist())
+
     messages = df["message"].astype(str).tolist()
     
     analyzer = get_analyzer()
@@ -78,8 +81,11 @@ def user_wise_sentiment(df: pd.DataFrame) -> dict:
     analyzer = get_analyzer()
 
     for user, group in df.groupby("user"):
-        messages = group["message"].astype(str).tolist()
-        stats = analyzer.get_aggregate_sentiment(messages)
+        if _has_sentiment(group):
+            stats = aggregate_sentiment(group["sentiment"].tolist(), group["sentiment_score"].tolist())
+        else:
+            messages = group["message"].astype(str).tolist()
+            stats = analyzer.get_aggregate_sentiment(messages)
         
         results[user] = {
             "positive_percentage": stats["positive_percentage"],
@@ -92,6 +98,39 @@ def user_wise_sentiment(df: pd.DataFrame) -> dict:
     return results
 
 
+def aggregate_sentiment(labels: list, scores: list) -> dict:
+    """
+    Same statistics as HinglishVaderAnalyzer.get_aggregate_sentiment, from
+    labels and compound scores that were already computed.
+    """
+    total = len(labels)
+    if total == 0:
+        return {
+            'positive_percentage': 0.0,
+            'negative_percentage': 0.0,
+            'neutral_percentage': 0.0,
+            'average_compound': 0.0,
+            'total_messages': 0
+        }
+
+    positive_count = labels.count('Positive')
+    negative_count = labels.count('Negative')
+    neutral_count = labels.count('Neutral')
+    avg_compound = sum(scores) / total
+
+    return {
+        'positive_percentage': round((positive_count / total) * 100, 2),
+        'negative_percentage': round((negative_count / total) * 100, 2),
+        'neutral_percentage': round((neutral_count / total) * 100, 2),
+        'average_compound': round(avg_compound, 4),
+        'total_messages': total
+    }
+
+
+def _has_sentiment(df: pd.DataFrame) -> bool:
+    return "sentiment" in df.columns and "sentiment_score" in df.columns
+
+
 def attach_sentiment_to_df(df: pd.DataFrame) -> pd.DataFrame:
     """
     Add sentiment columns to the dataframe.
@@ -109,8 +148,10 @@ def attach_sentiment_to_df(df: pd.DataFrame) -> pd.DataFrame:
     analyzer = get_analyzer()
     results = analyzer.analyze_batch(messages)
 
-    df = df.copy()
+    # The columns go on a shallow copy: the input is left untouched and its
+    # data is shared, not copied, on any pandas (assign() deep-copies the
+    # whole frame before pandas 3's copy-on-write)
+    df = df.copy(deep=False)
     df["sentiment"] = [r["label"] for r in results]
     df["sentiment_score"] = [r["compound"] for r in results]
-
     return df
@@ -1,8 +1,13 @@
+import os
 import re
+import time
 import pandas as pd
 import numpy as np
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.decomposition import LatentDirichletAllocation
+import scipy.sparse as sp
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.decomposition import LatentDirichletAllocation, MiniBatchNMF
+from sklearn.utils import gen_batches
 from wordcloud import STOPWORDS
 from ml.sentiment_vader import HINGLISH_LEXICON
 
@@ -20,29 +25,139 @@ HINGLISH_STOPWORDS = {
 
 ALL_STOPWORDS = set(STOPWORDS).union(HINGLISH_STOPWORDS).union(set(HINGLISH_LEXICON.keys()))
 
+# Built once at import; vectorizers used to rebuild this 500+ word list on every call
+STOPWORD_LIST = sorted(ALL_STOPWORDS)
+
+# Document-frequency bounds applied to every topic fit (same as the old per-call vectorizer)
+MIN_DF = 2
+MAX_DF = 0.95
+
+# Topic engines:
+#   lda         - online LDA fitted in one call (original behaviour)
+#   online_lda  - LDA driven by partial_fit mini-batches, stops early once topics settle
+#   nmf         - mini-batch NMF on TF-IDF weights, usually the fastest
+#   sampled_lda - LDA on a capped random sample of the documents
+TOPIC_ENGINES = ('lda', 'online_lda', 'nmf', 'sampled_lda')
+TOPIC_ENGINE = os.environ.get('CHATLYTICS_TOPIC_ENGINE', 'lda')
+# Wall-clock seconds per topic fit; 0 means unbounded
+TOPIC_TIME_BUDGET = float(os.environ.get('CHATLYTICS_TOPIC_TIME_BUDGET', 0)) or None
+SAMPLE_MAX_DOCS = 5000
+
+
+def preprocess_text(text):
+    if not isinstance(text, str):
+        return ""
+    # Lowercase
+    text = text.lower()
+    # Remove media omitted
+    text = re.sub(r'<media omitted>', '', text)
+    # Remove non-alphabetic
+    text = re.sub(r'[^a-zA-Z\s]', '', text)
+    return text
+
+
+class DocTermMatrix:
+    """
+    Sparse document-term matrix for a whole chat, built once and sliced by rows.
+
+    Rows are aligned with the DataFrame index the matrix was built from, so any
+    user or time slice of that frame can be mapped back to its rows without
+    re-tokenizing. Columns are the chat-wide vocabulary (alphabetical), or hash
+    buckets when built with hashing=True.
+    """
+
+    def __init__(self, matrix, feature_names, index, nonempty):
+        self.matrix = matrix
+        self.feature_names = feature_names
+        self.index = index
+        # Messages whose cleaned text is blank are not documents for topic modeling
+        self.nonempty = nonempty
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def positions(self, index=None):
+        """Row positions of the documents for the given DataFrame index labels."""
+        if index is None:
+            positions = np.arange(len(self.index))
+        else:
+            positions = self.index.get_indexer(index)
+            positions = positions[positions >= 0]
+        return positions[self.nonempty[positions]]
+
+    def rows(self, index=None):
+        """Row slice (CSR) of the non-empty documents for the given index labels."""
+        return self.matrix[self.positions(index)]
+
+    def term_counts(self, index=None, top_n=None):
+        """Total term frequencies over a row slice, most frequent first."""
+        counts = np.asarray(self.rows(index).sum(axis=0)).ravel()
+        used = np.flatnonzero(counts)
+        series = pd.Series(counts[used], index=self.feature_names[used]).sort_values(ascending=False, kind='stable')
+        return series.head(top_n) if top_n else series
+
+
+def build_doc_term_matrix(df, hashing=False, n_features=2 ** 18, ngram_range=(1, 1)):
+    """
+    Tokenizes every message of the chat exactly once into a sparse count matrix.
+
+    With hashing=True the columns are capped at n_features hash buckets instead of
+    one per vocabulary term, which bounds memory on very large chats.
+    """
+    texts = [preprocess_text(m) for m in df['message'].tolist()]
+    nonempty = np.fromiter((bool(t.strip()) for t in texts), dtype=bool, count=len(texts))
+    vectorizer = CountVectorizer(stop_words=STOPWORD_LIST, ngram_range=ngram_range)
+
+    if not hashing:
+        try:
+            matrix = vectorizer.fit_transform(texts).tocsr()
+            feature_names = vectorizer.get_feature_names_out()
+        except ValueError:
+            # Empty vocabulary (e.g. only media/stopwords)
+            matrix = sp.csr_matrix((len(texts), 0), dtype=np.int64)
+            feature_names = np.array([], dtype=object)
+        return DocTermMatrix(matrix, feature_names, df.index, nonempty)
+
+    analyzer = vectorizer.build_analyzer()
+    tokens = [analyzer(t) for t in texts]
+    hasher = FeatureHasher(n_features=n_features, input_type='string', alternate_sign=False)
+    matrix = hasher.transform(tokens).tocsr()
+
+    # Map buckets back to a representative term so topics stay readable
+    terms = sorted(set().union(*tokens)) if tokens else []
+    feature_names = np.full(n_features, '', dtype=object)
+    if terms:
+        feature_names[hasher.transform([[t] for t in terms]).indices] = terms
+    return DocTermMatrix(matrix, feature_names, df.index, nonempty)
+
 class TopicModeler:
-    def __init__(self, n_topics=5, n_top_words=10):
+    def __init__(self, n_topics=5, n_top_words=10, engine='lda', time_budget=None,
+                 max_iter=10, batch_size=128, tol=1e-3, max_docs=SAMPLE_MAX_DOCS):
+        if engine not in TOPIC_ENGINES:
+            raise ValueError(f"Unknown topic engine '{engine}', expected one of {TOPIC_ENGINES}")
         self.n_topics = n_topics
         self.n_top_words = n_top_words
-        self.vectorizer = CountVectorizer(stop_words=list(ALL_STOPWORDS), max_df=0.95, min_df=2)
-        self.lda = LatentDirichletAllocation(n_components=n_topics, random_state=42, learning_method='online')
+        self.engine = engine
+        self.time_budget = time_budget
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+        self.tol = tol
+        self.max_docs = max_docs
+        # Set when the time budget cut a fit short; topics are the best found so far
+        self.timed_out = False
+        self.vectorizer = CountVectorizer(stop_words=STOPWORD_LIST, max_df=MAX_DF, min_df=MIN_DF)
+        self.lda = LatentDirichletAllocation(n_components=n_topics, random_state=42, learning_method='online',
+                                             max_iter=max_iter, batch_size=batch_size)
 
     def _preprocess_text(self, text):
-        if not isinstance(text, str):
-            return ""
-        # Lowercase
-        text = text.lower()
-        # Remove media omitted
-        text = re.sub(r'<media omitted>', '', text)
-        # Remove non-alphabetic
-        text = re.sub(r'[^a-zA-Z\s]', '', text)
-        return text
+        return preprocess_text(text)
 
     def fit_transform(self, messages):
         if not messages or len(messages) < 10: # Minimum messages to find meaningful topics
             return []
 
-        processed_messages = [self._preprocess_text(m) for m in messages if self._preprocess_text(m).strip()]
+        processed_messages = [p for p in map(self._preprocess_text, messages) if p.strip()]
         
         if not processed_messages:
             return []
@@ -52,25 +167,127 @@ class TopicModeler:
             if tf.shape[1] == 0:
                 return []
             
-            self.lda.fit(tf)
-            
-            feature_names = self.vectorizer.get_feature_names_out()
-            topics = []
-            
-            for topic_idx, topic in enumerate(self.lda.components_):
-                top_words_idx = topic.argsort()[:-self.n_top_words - 1:-1]
-                top_words = [feature_names[i] for i in top_words_idx]
-                topics.append({
-                    "topic_id": topic_idx + 1,
-                    "words": top_words
-                })
-            
-            return topics
+            return self._fit_topics(tf, self.vectorizer.get_feature_names_out())
         except Exception as e:
             print(f"Error in TopicModeler: {e}")
             return []
 
-def extract_topics(df, n_topics=5):
-    modeler = TopicModeler(n_topics=n_topics)
-    messages = df['message'].tolist()
-    return modeler.fit_transform(messages)
+    def fit_matrix(self, tf, feature_names):
+        """
+        Fits topics on a row slice of a DocTermMatrix. Applies the same document
+        frequency pruning as the vectorizer would have on this slice alone.
+        """
+        n_docs = tf.shape[0]
+        if n_docs == 0:
+            return []
+
+        try:
+            doc_freq = np.bincount(tf.indices, minlength=tf.shape[1])
+            max_doc_count = MAX_DF * n_docs
+            if max_doc_count < MIN_DF:
+                return []
+            keep = np.flatnonzero((doc_freq >= MIN_DF) & (doc_freq <= max_doc_count))
+            if keep.size == 0:
+                return []
+
+            return self._fit_topics(tf[:, keep], feature_names[keep])
+        except Exception as e:
+            print(f"Error in TopicModeler: {e}")
+            return []
+
+    def _fit_topics(self, tf, feature_names):
+        components = self._fit_components(tf)
+
+        topics = []
+        for topic_idx, topic in enumerate(components):
+            top_words_idx = topic.argsort()[:-self.n_top_words - 1:-1]
+            top_words = [feature_names[i] for i in top_words_idx]
+            topics.append({
+                "topic_id": topic_idx + 1,
+                "words": top_words
+            })
+
+        return topics
+
+    def _fit_components(self, tf):
+        deadline = time.perf_counter() + self.time_budget if self.time_budget else None
+
+        if self.engine == 'nmf':
+            return self._fit_nmf(tf, deadline)
+        if self.engine == 'sampled_lda':
+            tf = self._sample_rows(tf)
+        elif self.engine == 'lda' and deadline is None:
+            self.lda.fit(tf)
+            return self.lda.components_
+
+        # Plain LDA under a budget runs the same epochs as fit(), just interruptible
+        return self._fit_lda_minibatch(tf, deadline, tol=None if self.engine == 'lda' else self.tol)
+
+    def _fit_lda_minibatch(self, tf, deadline, tol):
+        n_docs = tf.shape[0]
+        # Scale the online updates to this corpus, as fit() does
+        self.lda.set_params(total_samples=n_docs)
+
+        previous = None
+        for _ in range(self.max_iter):
+            for batch in gen_batches(n_docs, self.batch_size):
+                self.lda.partial_fit(tf[batch])
+                if deadline is not None and time.perf_counter() > deadline:
+                    self.timed_out = True
+                    return self.lda.components_
+            if tol is not None and previous is not None and _relative_change(previous, self.lda.components_) < tol:
+                break
+            previous = self.lda.components_.copy()
+
+        return self.lda.components_
+
+    def _fit_nmf(self, tf, deadline):
+        weights = TfidfTransformer().fit_transform(tf)
+        n_docs = weights.shape[0]
+        nmf = MiniBatchNMF(n_components=self.n_topics, batch_size=self.batch_size, random_state=42)
+
+        previous = None
+        for _ in range(self.max_iter):
+            for batch in gen_batches(n_docs, self.batch_size):
+                nmf.partial_fit(weights[batch])
+                if deadline is not None and time.perf_counter() > deadline:
+                    self.timed_out = True
+                    return nmf.components_
+            if previous is not None and _relative_change(previous, nmf.components_) < self.tol:
+                break
+            previous = nmf.components_.copy()
+
+        return nmf.components_
+
+    def _sample_rows(self, tf):
+        n_docs = tf.shape[0]
+        if n_docs <= self.max_docs:
+            return tf
+        rng = np.random.default_rng(42)
+        return tf[np.sort(rng.choice(n_docs, self.max_docs, replace=False))]
+
+
+def _relative_change(previous, current):
+    return np.abs(current - previous).sum() / max(np.abs(previous).sum(), 1e-12)
+
+
+def extract_topics(df, n_topics=5, dtm=None, engine=None, time_budget=None):
+    """
+    Extracts topics for the messages in df. When a chat-wide DocTermMatrix is
+    given, df's rows are looked up in it instead of being re-tokenized.
+
+    engine and time_budget default to CHATLYTICS_TOPIC_ENGINE and
+    CHATLYTICS_TOPIC_TIME_BUDGET; see TOPIC_ENGINES.
+    """
+    modeler = TopicModeler(
+        n_topics=n_topics,
+        engine=engine or TOPIC_ENGINE,
+        time_budget=time_budget if time_budget is not None else TOPIC_TIME_BUDGET
+    )
+    if dtm is None:
+        messages = df['message'].tolist()
+        return modeler.fit_transform(messages)
+
+    if len(df) < 10: # Minimum messages to find meaningful topics
+        return []
+    return modeler.fit_matrix(dtm.rows(df.index), dtm.feature_names)
@@ -0,0 +1,197 @@
+import pandas as pd
+import numpy as np
+from app.context import ChatContext
+from sklearn.ensemble import IsolationForest
+from benchmarks.synthetic import generate_export
+from app.preprocess import preprocess_whatsapp_text
+from ml.anomalies import get_anomalies, StreamingAnomalyDetector, daily_anomaly_features, detect_gaps, get_anomalies_batch, detect_anomalies_if
+from ml.health import get_chat_health, get_chat_health_batch, get_health_timeline
+from ml.features import DailyFeatureStore, register_daily_feature, DAILY_FEATURES
+from app.analytics import daily_timeline, conversation_initiator, count_links
+
+# Mock chat: 60 days, quiet baseline with a burst on day 30 and a silent week
+rng = np.random.default_rng(7)
+rows = []
+for day in range(60):
+    if 40 <= day < 47:
+        continue
+    count = 40 if day == 30 else int(rng.integers(3, 8))
+    for i in range(count):
+        rows.append({
+            'date': pd.Timestamp('2023-01-01') + pd.Timedelta(days=day, minutes=10 * i),
+            'user': ['Alice', 'Bob', 'Charlie'][(day + i) % 3],
+            'message': '<Media omitted>' if i % 9 == 0 else f'message {i} on day {day}',
+        })
+df = pd.DataFrame(rows)
+df['sentiment_score'] = rng.uniform(-0.2, 0.6, len(df))
+df['sentiment'] = np.where(df['sentiment_score'] > 0.05, 'Positive', 'Neutral')
+df['hour'] = df['date'].dt.hour
+
+def test_context_memoizes_anomalies():
+    print("Testing per-chat anomaly memoization...")
+    context = ChatContext(df)
+    for user in ['Overall', 'Alice']:
+        frame = context.user_frame(user)
+        anomalies = context.anomalies(user)
+        assert anomalies == get_anomalies(frame)
+        assert context.anomalies(user) is anomalies
+        assert context.health(user) == get_chat_health(frame)
+    print("Spikes:", [a['date'] for a in context.anomalies()['spikes']])
+    print("Drops:", [a['date'] for a in context.anomalies()['drops']])
+
+def test_daily_feature_store():
+    print("Testing daily feature store...")
+    store = DailyFeatureStore(df)
+    pd.testing.assert_frame_equal(store.timeline(), daily_timeline(df))
+    pd.testing.assert_frame_equal(store.timeline('Bob'), daily_timeline(df[df['user'] == 'Bob'], 'Bob'))
+    # anomaly_features() must not rename the cached daily frames
+    store.anomaly_features('Bob')
+    pd.testing.assert_frame_equal(store.timeline('Bob'), daily_timeline(df[df['user'] == 'Bob'], 'Bob'))
+    pd.testing.assert_series_equal(store.initiators(), conversation_initiator(df))
+    assert count_links(df, features=store) == count_links(df)
+
+    register_daily_feature('night_count', lambda frame: (frame['hour'] < 5).to_numpy(), 'sum')
+    try:
+        night = DailyFeatureStore(df).for_user('Charlie')['night_count']
+        assert night.sum() == ((df['user'] == 'Charlie') & (df['hour'] < 5)).sum()
+    finally:
+        DAILY_FEATURES.pop('night_count')
+
+def test_streaming_detector():
+    print("Testing streaming anomaly detector...")
+    result = get_anomalies(df, detector='streaming')
+    assert '2023-01-31' in [a['date'] for a in result['spikes']]
+    assert set(result['spikes'][0]) == set(get_anomalies(df)['spikes'][0])
+
+    # Day-by-day updates after a batch pass give the same records as one batch pass
+    daily = daily_anomaly_features(df)
+    full = StreamingAnomalyDetector().detect(daily)
+    detector = StreamingAnomalyDetector()
+    records = detector.detect(daily.iloc[:20])
+    for date, row in daily.iloc[20:].iterrows():
+        record = detector.update(date, row['message_count'], row['avg_sentiment'], row['media_count'], row['link_count'])
+        if record:
+            records.append(record)
+    assert [(r['date'], r['type']) for r in records] == [(r['date'], r['type']) for r in full]
+
+def test_gap_records_and_top_k():
+    print("Testing gap records and top-K selection...")
+    columns = list(df.columns)
+    gaps = detect_gaps(df)
+    assert list(df.columns) == columns, "detect_gaps must not mutate its input"
+    assert [g['date'] for g in gaps] == ['2023-02-17']
+    assert gaps[0]['metrics'] == {"gap_hours": 191, "duration_days": 8.0}
+    assert gaps[0]['severity'] == "High"
+
+    result = get_anomalies(df, top_k=2)
+    assert len(result['spikes']) <= 2
+    scores = [a['severity_score'] for a in result['spikes']]
+    assert scores == sorted(scores, reverse=True)
+
+def rowwise_gaps(frame, gap_threshold_hours=72):
+    # The row-wise detect_gaps the vectorized records replaced
+    frame = frame.sort_values('date')
+    frame['gap'] = frame['date'].diff().dt.total_seconds() / 3600
+    records = []
+    for _, row in frame[frame['gap'] > gap_threshold_hours].iterrows():
+        days = round(row['gap'] / 24, 1)
+        records.append({"date": str(row['date'].date()), "severity_score": min(row['gap'] / 720, 1.0),
+                        "description": f"The conversation went silent for about {days} days before this message.",
+                        "metrics": {"gap_hours": int(row['gap']), "duration_days": days}})
+    return records
+
+def rowwise_pattern_scores(frame):
+    # (date, severity_score, z_score) of the row-wise detect_anomalies_if
+    daily_stats = daily_anomaly_features(frame)
+    features = daily_stats[['message_count', 'avg_sentiment', 'media_count', 'link_count']]
+    model = IsolationForest(contamination=0.10, random_state=42)
+    daily_stats['anomaly_label'] = model.fit_predict(features)
+    daily_stats['raw_severity'] = model.decision_function(features)
+    mean_count, std_count = daily_stats['message_count'].mean(), daily_stats['message_count'].std()
+    return [
+        (str(date), round(abs(float(row['raw_severity'])), 4),
+         round(abs((row['message_count'] - mean_count) / std_count if std_count > 0 else 0), 2))
+        for date, row in daily_stats[daily_stats['anomaly_label'] == -1].iterrows()
+    ]
+
+def test_records_match_rowwise():
+    print("Testing vectorized records against the row-wise ones...")
+    # 457.2 h is 19.05 days: round() gives 19.1 where np.round gives 19.0
+    last = df.iloc[[-1]].assign(date=df['date'].iloc[-1] + pd.Timedelta(hours=457.2))
+    silent = pd.concat([df, last], ignore_index=True)
+    chat = preprocess_whatsapp_text(generate_export(4000, users=5, seed=3))
+    chat['sentiment_score'] = np.random.default_rng(3).uniform(-0.5, 0.8, len(chat))
+    for frame in [silent, chat] + [chat[chat['user'] == user] for user in chat['user'].unique()]:
+        expected = rowwise_gaps(frame.copy())
+        gaps = detect_gaps(frame)
+        assert [{key: g[key] for key in expected[0]} for g in gaps] == expected if expected else gaps == []
+        patterns = detect_anomalies_if(frame)
+        assert [(p['date'], p['severity_score'], p['z_score']) for p in patterns] == rowwise_pattern_scores(frame)
+    assert {"gap_hours": 457, "duration_days": 19.1} in [g['metrics'] for g in detect_gaps(silent)]
+
+def test_batch_anomalies():
+    print("Testing batch per-user anomalies...")
+    users = ['Alice', 'Bob', 'Charlie']
+    batch = get_anomalies_batch(df, detector='streaming')
+    assert sorted(batch) == users
+    for user in users:
+        assert batch[user] == get_anomalies(df[df['user'] == user], detector='streaming')
+
+    # One pooled IsolationForest: same schema, one result per user
+    pooled = get_anomalies_batch(df, users=['Alice', 'Bob'])
+    assert sorted(pooled) == ['Alice', 'Bob']
+    for result in pooled.values():
+        for anomaly in result['spikes'] + result['drops']:
+            assert {'type', 'category', 'date', 'severity', 'severity_score'} <= set(anomaly)
+
+def test_health_batch():
+    print("Testing batch chat health...")
+    chat = df.copy()
+    chat.loc[chat.index % 4 == 0, 'sentiment'] = 'Negative'
+    anomalies = {'Overall': {'spikes': []}}
+    scores = get_chat_health_batch(chat, anomalies=anomalies)
+    assert list(scores) == ['Overall', 'Alice', 'Bob', 'Charlie']
+    assert scores['Overall'] == get_chat_health(chat, anomalies=anomalies['Overall'])
+    for user in ['Alice', 'Bob', 'Charlie']:
+        frame = chat[chat['user'] == user]
+        assert scores[user] == get_chat_health(frame, anomalies={'spikes': [], 'drops': []})
+
+    # Same scores from the daily feature store's active days
+    assert get_chat_health_batch(chat, features=DailyFeatureStore(chat), anomalies=anomalies) == scores
+
+def test_health_timeline():
+    print("Testing health timeline...")
+    report = get_anomalies(df)
+    timeline = get_health_timeline(df, freq='M', anomalies=report)
+    assert [w['date'] for w in timeline] == ['2023-01-01', '2023-02-01', '2023-03-01']
+
+    # Windows match get_chat_health on the month's slice (replies crossing a
+    # window boundary are the only difference, so response is left out)
+    for window, end in zip(timeline, ['2023-02-01', '2023-03-01', '2023-04-01']):
+        month = df[(df['date'] >= window['date']) & (df['date'] < end)]
+        expected = get_chat_health(month, anomalies=report)['metrics']
+        for metric in ['sentiment', 'engagement', 'balance']:
+            assert window['metrics'][metric] == expected[metric]
+
+    weekly = get_health_timeline(df, freq='W', anomalies=report)
+    # Weeks start on Monday; the first window starts at the first message
+    assert len(weekly) == 10
+    assert all(pd.Timestamp(w['date']).day_name() == 'Monday' for w in weekly[1:])
+    assert sum(w['metrics']['penalty'] for w in weekly) > 0
+
+    # A chat within one window scores the same as chat_health, with no anomaly fit
+    january = df[df['date'] < '2023-02-01']
+    [window] = get_health_timeline(january)
+    health = get_chat_health(january)
+    assert (window['score'], window['rating']) == (health['score'], health['rating'])
+    assert window['metrics'] == {key: health['metrics'][key] for key in window['metrics']}
+
+if __name__ == "__main__":
+    test_context_memoizes_anomalies()
+    test_daily_feature_store()
+    test_streaming_detector()
+    test_gap_records_and_top_k()
+    test_records_match_rowwise()
+    test_batch_anomalies()
+    test_health_batch()
+    test_health_timeline()
@@ -0,0 +1,411 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+import pandas as pd
+from fastapi import HTTPException
+from starlette.datastructures import UploadFile
+
+# Job results and cached responses go to throwaway locations (read on import)
+os.environ['CHATLYTICS_JOB_DB'] = os.path.join(tempfile.mkdtemp(), 'jobs.db')
+os.environ['CHATLYTICS_CACHE_DIR'] = tempfile.mkdtemp()
+os.environ['CHATLYTICS_FRAME_CACHE_DIR'] = tempfile.mkdtemp()
+os.environ['CHATLYTICS_PROFILE_DIR'] = tempfile.mkdtemp()
+import app.main as main
+import app.cache
+from app.jobs import expire_jobs
+from app.metrics import StageTimer
+from app.cache import ResultCache, FrameCache, content_key, get_cache, FRAME_VERSION
+from app.preprocess import preprocess_whatsapp_text
+from ml.sentiment_inference import attach_sentiment_to_df
+
+CHAT = "\n".join(
+    f"{day}/01/23, 10:{minute:02d} am - {user}: {text}"
+    for day in range(1, 15)
+    for minute, (user, text) in enumerate([
+        ("Alice", "good morning everyone"),
+        ("Bob", "morning! lunch plans today?"),
+        ("Alice", "pizza sounds great"),
+    ])
+) + "\n"
+
+def upload(text):
+    return UploadFile(file=io.BytesIO(text.encode()), filename="chat.txt")
+
+def analyze(text):
+    return json.loads(asyncio.run(main.analyze_chat(upload(text))).body)
+
+def test_analyze_offloaded():
+    print("Testing /analyze in the worker pool...")
+    result = analyze(CHAT)
+    assert result["users"] == ['Overall', 'Alice', 'Bob']
+    assert result["analytics"]["Alice"]["basic_stats"]["Total Number of Messages"] == 28
+
+def test_backpressure():
+    print("Testing 429 when the analysis queue is full...")
+    async def scenario():
+        main._semaphore = asyncio.Semaphore(1)
+        main.ANALYSIS_QUEUE_SIZE = 0
+        first = asyncio.create_task(main.analyze_chat(upload(CHAT)))
+        await asyncio.sleep(0.1)
+        assert (await main.health())["analyses_running"] == 1
+        try:
+            await main.analyze_chat(upload(CHAT))
+            assert False, "expected 429"
+        except HTTPException as e:
+            assert e.status_code == 429
+            assert e.headers["Retry-After"] == str(main.RETRY_AFTER)
+        return json.loads((await first).body)
+
+    get_cache().clear()
+    queue_size = main.ANALYSIS_QUEUE_SIZE
+    try:
+        assert asyncio.run(scenario())["users"] == ['Overall', 'Alice', 'Bob']
+    finally:
+        main._semaphore = None
+        main.ANALYSIS_QUEUE_SIZE = queue_size
+
+def test_jobs():
+    print("Testing background jobs...")
+    async def wait_for(job_id):
+        for _ in range(600):
+            job = await main.job_status(job_id)
+            if job["status"] not in ("queued", "running"):
+                return job
+            await asyncio.sleep(0.1)
+        raise TimeoutError(job_id)
+
+    async def scenario():
+        main.init_store()
+        submitted = await main.submit_job(upload(CHAT))
+        assert submitted["status"] == "queued"
+        job = await wait_for(submitted["id"])
+        assert job["status"] == "done" and job["progress"] == 1.0
+        assert job["result"] == json.loads((await main.analyze_chat(upload(CHAT))).body)
+
+        # Results are deleted on request
+        assert (await main.delete_job(job["id"]))["status"] == "deleted"
+        try:
+            await main.job_status(job["id"])
+            assert False, "expected 404"
+        except HTTPException as e:
+            assert e.status_code == 404
+
+        # A cancelled job never reports a result
+        cancelled = await main.submit_job(upload(CHAT))
+        assert (await main.delete_job(cancelled["id"]))["status"] == "cancelled"
+        await asyncio.sleep(1)
+        job = await wait_for(cancelled["id"])
+        assert job["status"] == "cancelled" and "result" not in job
+
+        # Finished jobs expire; a full queue turns new jobs away
+        assert expire_jobs(ttl=0) >= 1
+        try:
+            await main.job_status(cancelled["id"])
+            assert False, "expected 404"
+        except HTTPException as e:
+            assert e.status_code == 404
+        main._semaphore = asyncio.Semaphore(1)
+        await main._semaphore.acquire()
+        queue, main.ANALYSIS_QUEUE_SIZE = main.ANALYSIS_QUEUE_SIZE, 0
+        try:
+            await main.submit_job(upload(CHAT))
+            assert False, "expected 429"
+        except HTTPException as e:
+            assert e.status_code == 429
+        finally:
+            main.ANALYSIS_QUEUE_SIZE = queue
+            main._semaphore.release()
+
+    asyncio.run(scenario())
+
+def test_result_cache():
+    print("Testing the /analyze result cache...")
+    get_cache().clear()
+    first = asyncio.run(main.analyze_chat(upload(CHAT)))
+    second = asyncio.run(main.analyze_chat(upload(CHAT)))
+    assert first.headers["X-Cache"] == "MISS" and second.headers["X-Cache"] == "HIT"
+    assert second.body == first.body
+
+    # Disk tier: a fresh process-level cache over the same directory still hits
+    cache = ResultCache(directory=os.environ['CHATLYTICS_CACHE_DIR'])
+    assert cache.get(content_key(CHAT.encode())) == first.body
+    assert cache.metrics()["disk_hits"] == 1
+    # Disk usage is tracked as files are written, not listed on every metrics call
+    disk_file = os.path.join(cache.directory, content_key(CHAT.encode()) + cache.SUFFIX)
+    assert cache.metrics()["disk_bytes"] == os.path.getsize(disk_file)
+
+    # Least recently used files go once the disk budget is exceeded
+    small = ResultCache(directory=tempfile.mkdtemp(), memory_items=1, disk_bytes=100)
+    for i in range(3):
+        small.put(f"key{i}", os.urandom(60))
+    assert small.metrics()["evictions"] == 2
+    assert 0 < small.metrics()["disk_bytes"] <= 100
+    assert small.get("key0") is None and small.get("key2") is not None
+
+def test_frame_cache():
+    print("Testing the parsed-frame cache...")
+    frames = FrameCache(directory=tempfile.mkdtemp())
+    df = attach_sentiment_to_df(preprocess_whatsapp_text(CHAT))
+    key = content_key(CHAT.encode(), FRAME_VERSION)
+    assert frames.get(key) is None
+    frames.put(key, df)
+    pd.testing.assert_frame_equal(frames.get(key), df)
+
+    # Files written under another frame version are ignored
+    app.cache.FRAME_VERSION = "old"
+    try:
+        assert frames.get(key) is None
+    finally:
+        app.cache.FRAME_VERSION = FRAME_VERSION
+
+    # Only the most recently used frame fits in a tiny budget
+    frames.disk_bytes = os.path.getsize(frames._path(key)) + 1
+    frames.put("other", df)
+    assert frames.get(key) is None and frames.get("other") is not None
+    assert frames.stats == {"hits": 2, "misses": 3, "stores": 2, "evictions": 1}
+
+def test_stage_timing():
+    print("Testing Server-Timing and /metrics...")
+    timer = StageTimer()
+    started = time.perf_counter()
+    with timer.stage("outer"):
+        with timer.stage("inner"):
+            time.sleep(0.05)
+        with timer.stage("inner"):
+            time.sleep(0.05)
+    wall = time.perf_counter() - started
+    assert list(timer.stages) == ["inner", "outer"] and timer.stages["inner"][1] == 2
+    # Self times: the outer stage excludes its nested stages, so they add up to the wall time
+    outer, inner = timer.stages["outer"][0], timer.stages["inner"][0]
+    assert inner >= 0.1 and outer < 0.02
+    assert abs(outer + inner - wall) < 0.005
+
+    get_cache().clear()
+    response = asyncio.run(main.analyze_chat(upload(CHAT)))
+    stages = [metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")]
+    assert {"topic_modeling", "anomaly_fits", "json_safe", "queue", "total"} <= set(stages)
+    assert 'desc="messages=42 users=2"' in response.headers["Server-Timing"]
+
+    metrics = asyncio.run(main.metrics()).body.decode()
+    assert '# TYPE chatlytics_stage_seconds histogram' in metrics
+    assert 'chatlytics_stage_seconds_count{stage="topic_modeling",messages="<=1k",users="1-2"}' in metrics
+    assert 'chatlytics_analyses_running 0' in metrics
+
+def test_profile():
+    print("Testing /analyze?profile=1...")
+    try:
+        asyncio.run(main.analyze_chat(upload(CHAT), profile=True))
+        assert False, "profiling should be disabled by default"
+    except HTTPException as e:
+        assert e.status_code == 403
+
+    def analysis_counts():
+        text = asyncio.run(main.metrics()).body.decode()
+        return [line for line in text.splitlines() if line.startswith("chatlytics_analysis_seconds_count")]
+
+    before = analysis_counts()
+    main.PROFILING_ENABLED = True
+    try:
+        response = asyncio.run(main.analyze_chat(upload(CHAT), profile=True))
+    finally:
+        main.PROFILING_ENABLED = False
+    # Profiled runs are too slow to count towards the latency histograms
+    assert analysis_counts() == before
+    assert "X-Cache" not in response.headers
+    result = json.loads(response.body)
+    assert result["users"] == ['Overall', 'Alice', 'Bob']
+    profile = result["profile"]
+    functions = [row["function"] for row in profile["top_functions"]]
+    assert any(name.startswith(os.path.join("app", "pipeline.py")) for name in functions)
+    assert all(name.startswith(("app", "ml")) for name in functions)
+    assert profile["retained_allocations"] and profile["peak_memory_mb"] >= 0
+    assert all(row["size_kb"] > 0 for row in profile["retained_allocations"])
+    assert os.path.exists(profile["saved_to"])
+    assert profile["saved_to"].startswith(os.environ['CHATLYTICS_PROFILE_DIR'])
+
+def test_sections():
+    print("Testing /analyze?sections=...&users=...")
+    get_cache().clear()
+    full = analyze(CHAT)
+    response = asyncio.run(main.analyze_chat(upload(CHAT), sections="daily_timeline, basic_stats", users="Overall,Bob"))
+    result = json.loads(response.body)
+    assert result["users"] == ['Overall', 'Bob']
+    for user in result["users"]:
+        # Response order, and the same values as in the full analysis
+        assert list(result["analytics"][user]) == ["basic_stats", "daily_timeline"]
+        assert all(full["analytics"][user][name] == value for name, value in result["analytics"][user].items())
+    # Neither VADER nor any model ran
+    stages = {metric.split(";")[0] for metric in response.headers["Server-Timing"].split(", ")}
+    assert not stages & {"sentiment", "doc_term_matrix", "anomaly_fits", "role_matrix"}
+
+    # Cached separately from the full analysis, under the canonical options
+    assert response.headers["X-Cache"] == "MISS"
+    again = asyncio.run(main.analyze_chat(upload(CHAT), sections="basic_stats,daily_timeline", users="Bob,Overall"))
+    assert again.headers["X-Cache"] == "HIT" and again.body == response.body
+
+    # Health and its timeline need no anomaly model fits
+    response = asyncio.run(main.analyze_chat(upload(CHAT), sections="chat_health,health_timeline", users="Overall"))
+    assert "anomaly_fits" not in response.headers["Server-Timing"]
+    assert json.loads(response.body)["analytics"]["Overall"]["chat_health"] == full["analytics"]["Overall"]["chat_health"]
+
+    topics = json.loads(asyncio.run(main.analyze_chat(upload(CHAT), sections="topic_modeling", users="Alice")).body)
+    assert list(topics["analytics"]["Alice"]) == ["topic_modeling", "topics_timed_out"]
+
+    for options in ({"sections": "basic_stats,nope"}, {"users": "Carol"}):
+        try:
+            asyncio.run(main.analyze_chat(upload(CHAT), **options))
+            assert False, f"{options} should be rejected"
+        except HTTPException as e:
+            assert e.status_code == 400
+
+def test_batch():
+    print("Testing /analyze/batch...")
+    get_cache().clear()
+    other = CHAT.replace("Bob", "Carol")
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr("exports/one.txt", other)
+        z.writestr("exports/empty.txt", "not a chat\n")
+        z.writestr("exports/IMG-0001.jpg", b"\xff\xd8")
+    files = [upload(CHAT), UploadFile(file=io.BytesIO(archive.getvalue()), filename="tenant.zip")]
+
+    async def collect(files, **options):
+        response = await main.analyze_batch(files, **options)
+        assert response.media_type == "application/x-ndjson"
+        return [json.loads(line) async for line in response.body_iterator]
+
+    lines = asyncio.run(collect(files))
+    summary = lines.pop()["summary"]
+    assert summary["chats"] == 3 and summary["done"] == 2 and summary["failed"] == 1
+    by_name = {line["filename"]: line for line in sorted(lines, key=lambda line: line["index"])}
+    assert list(by_name) == ["chat.txt", "tenant.zip/exports/one.txt", "tenant.zip/exports/empty.txt"]
+    assert by_name["chat.txt"]["result"] == analyze(CHAT)
+    assert by_name["tenant.zip/exports/one.txt"]["result"]["users"] == ['Overall', 'Alice', 'Carol']
+    assert by_name["tenant.zip/exports/empty.txt"]["status"] == "failed"
+
+    # Chats analyzed before (by /analyze or a batch) come from the result cache
+    lines = asyncio.run(collect([upload(other)], sections="basic_stats"))
+    assert lines[0]["cached"] is False and list(lines[0]["result"]["analytics"]["Overall"]) == ["basic_stats"]
+    lines = asyncio.run(collect([upload(CHAT), upload(other)]))
+    assert [line["cached"] for line in lines[:2]] == [True, True] and lines[2]["summary"]["cached"] == 2
+
+    try:
+        asyncio.run(collect([UploadFile(file=io.BytesIO(archive.getvalue()), filename="x.zip")], sections="nope"))
+        assert False, "unknown sections should be rejected"
+    except HTTPException as e:
+        assert e.status_code == 400
+
+    # Batch chats take the same analysis slots as /analyze, and show in /health
+    async def counted():
+        batch = asyncio.ensure_future(collect([upload(CHAT.replace("Bob", "Dave"))]))
+        seen = 0
+        while not batch.done():
+            seen = max(seen, (await main.health())["analyses_running"])
+            await asyncio.sleep(0.01)
+        await batch
+        return seen
+    assert asyncio.run(counted()) == 1
+
+    async def busy():
+        main._semaphore = asyncio.Semaphore(1)
+        await main._semaphore.acquire()
+        queue, main.ANALYSIS_QUEUE_SIZE = main.ANALYSIS_QUEUE_SIZE, 0
+        try:
+            await main.analyze_batch([upload(CHAT)])
+            assert False, "expected 429"
+        except HTTPException as e:
+            assert e.status_code == 429
+        finally:
+            main.ANALYSIS_QUEUE_SIZE = queue
+            main._semaphore.release()
+    asyncio.run(busy())
+
+    # Limits are checked from the zip directories, before any chat is read
+    limits = main.BATCH_MAX_CHATS, main.BATCH_MAX_BYTES
+    for max_chats, max_bytes in ((2, limits[1]), (limits[0], len(CHAT))):
+        main.BATCH_MAX_CHATS, main.BATCH_MAX_BYTES = max_chats, max_bytes
+        try:
+            asyncio.run(main.analyze_batch([UploadFile(file=io.BytesIO(archive.getvalue()), filename="tenant.zip"), upload(CHAT)]))
+            assert False, "expected 413"
+        except HTTPException as e:
+            assert e.status_code == 413
+        finally:
+            main.BATCH_MAX_CHATS, main.BATCH_MAX_BYTES = limits
+
+def test_zip_upload():
+    print("Testing /analyze with an export-with-media zip...")
+    photo = b"A" * 4096
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr("_chat.txt", CHAT, compress_type=zipfile.ZIP_DEFLATED)
+        z.writestr("__MACOSX/._chat.txt", b"\x00")
+        z.writestr("00000003-PHOTO-2023-01-01-10-00-00.jpg", photo)
+        z.writestr("IMG-20230102-WA0001.jpg", b"\xff\xd8")
+        z.writestr("PTT-20230102-WA0002.opus", b"OggS")
+        z.writestr("notes.txt", "shared as a document")
+    # Corrupt the stored photo: reading any media member would fail its CRC check
+    data = archive.getvalue().replace(photo, b"B" * len(photo))
+
+    def zipped(data, name="export.zip"):
+        return UploadFile(file=io.BytesIO(data), filename=name)
+
+    response = asyncio.run(main.analyze_chat(zipped(data)))
+    result = json.loads(response.body)
+    assert result.pop("media_types") == {"audio": 1, "document": 1, "image": 2}
+    assert result == analyze(CHAT)
+    # The counts are part of the cache key, not mixed up with the plain export
+    assert "media_types" not in analyze(CHAT)
+    assert asyncio.run(main.analyze_chat(zipped(data))).headers["X-Cache"] == "HIT"
+
+    for members in ([], ["a.txt", "b.txt"]):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, 'w') as z:
+            z.writestr("IMG-0001.jpg", b"\xff\xd8")
+            for member in members:
+                z.writestr(member, CHAT)
+        try:
+            asyncio.run(main.analyze_chat(zipped(archive.getvalue())))
+            assert False, "zips without exactly one chat should be rejected"
+        except HTTPException as e:
+            assert e.status_code == 400
+
+    # Corrupt zips are rejected with 400 by every endpoint that takes uploads
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as z:
+        z.writestr("_chat.txt", CHAT, compress_type=zipfile.ZIP_DEFLATED)
+    data = archive.getvalue()
+    broken_directory = data.replace(b"PK\x01\x02", b"XX\x01\x02")
+    header = 30 + len("_chat.txt")
+    broken_entry = data[:header] + bytes(b ^ 0xFF for b in data[header:header + 20]) + data[header + 20:]
+    calls = [(main.analyze_chat, broken_directory), (main.submit_job, broken_directory),
+             (lambda file: main.analyze_batch([file]), broken_directory),
+             (main.analyze_chat, broken_entry), (main.submit_job, broken_entry)]
+    for call, broken in calls:
+        try:
+            asyncio.run(call(zipped(broken)))
+            assert False, "corrupt zips should be rejected"
+        except HTTPException as e:
+            assert e.status_code == 400
+
+    # A batch reads each chat only when its turn comes, so a corrupt one fails on its own line
+    async def batch_lines(file):
+        response = await main.analyze_batch([file])
+        return [json.loads(line) async for line in response.body_iterator]
+    line = asyncio.run(batch_lines(zipped(broken_entry)))[0]
+    assert line["status"] == "failed" and "could not be read" in line["error"]
+
+if __name__ == "__main__":
+    test_analyze_offloaded()
+    test_backpressure()
+    test_jobs()
+    test_result_cache()
+    test_frame_cache()
+    test_stage_timing()
+    test_profile()
+    test_sections()
+    test_batch()
+    test_zip_upload()
@@ -0,0 +1,39 @@
+from benchmarks.synthetic import generate_export, parse_size
+from benchmarks.bench import run, check, format_report
+from app.preprocess import preprocess_whatsapp_text
+
+def test_synthetic_export():
+    print("Testing the synthetic export generator...")
+    text = generate_export(messages=2000, users=4, years=1, media_rate=0.1, seed=3)
+    assert text == generate_export(messages=2000, users=4, years=1, media_rate=0.1, seed=3)
+    assert text != generate_export(messages=2000, users=4, years=1, media_rate=0.1, seed=4)
+
+    df = preprocess_whatsapp_text(text)
+    assert len(df) == 2000
+    assert set(df['user']) - {'group_notification'} == {'User 1', 'User 2', 'User 3', 'User 4'}
+    assert df['date'].is_monotonic_increasing
+    assert 0.07 < (df['message'] == '<Media omitted>').mean() < 0.13
+    # Multi-line messages stay one message
+    assert df['message'].str.contains('\n').any()
+    assert parse_size('1k') == 1000 and parse_size('2.5M') == 2500000
+
+def test_benchmark_suite():
+    print("Testing the benchmark suite...")
+    report = run([500, 1000], users=3, repeat=1, groups={'parse', 'analytics'}, skip={'pipeline'}, log=lambda line: None)
+    assert set(report["results"]["preprocess_whatsapp_text"]) == {500, 1000}
+    assert "extract_topics" not in report["results"]
+    assert "preprocess_whatsapp_text" in format_report(report)
+
+    # A function that went quadratic, and one that got slower than the baseline
+    report["sizes"] = [10000, 100000]
+    report["results"] = {"slow": {10000: 0.1, 100000: 10.0}, "steady": {10000: 0.1, 100000: 1.0}}
+    report["exponents"] = {"slow": 2.0, "steady": 1.0}
+    baseline = {"results": {"steady": {"100000": 0.5}}}
+    failures = check(report, {"max_exponent": 1.5}, baseline=baseline)
+    assert len(failures) == 2
+    assert failures[0].startswith("slow: scales as n^2.00")
+    assert failures[1].startswith("steady: 1.000s")
+
+if __name__ == "__main__":
+    test_synthetic_export()
+    test_benchmark_suite()
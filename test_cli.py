@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+import zipfile
+import pandas as pd
+from benchmarks.synthetic import generate_export
+from app import cli
+from app.pipeline import analyze_chat_bytes
+
+def test_cli_analyze():
+    print("Testing the offline batch CLI...")
+    exports = tempfile.mkdtemp()
+    out = tempfile.mkdtemp()
+    chats = {f"chat{seed}.txt": generate_export(400, users=3, seed=seed).encode('utf-8') for seed in (1, 2)}
+    for name, raw in chats.items():
+        with open(os.path.join(exports, name), 'wb') as f:
+            f.write(raw)
+    with zipfile.ZipFile(os.path.join(exports, 'tenant.zip'), 'w') as archive:
+        archive.writestr('chat1.txt', chats['chat1.txt'])
+        archive.writestr('IMG-0001.jpg', b'\xff\xd8')
+    with open(os.path.join(exports, 'empty.txt'), 'wb') as f:
+        f.write(b'\n')
+
+    # A failed chat is reported in the summary and the exit status; the rest are written
+    status = cli.main(['analyze', exports, os.path.join(exports, '*.txt'), '--jobs', '1', '--no-cache', '--out', out])
+    assert status == 1
+    with open(os.path.join(out, 'summary.json'), encoding='utf-8') as f:
+        summary = json.load(f)
+    assert (summary['chats'], summary['done'], summary['failed']) == (4, 3, 1)
+    assert summary['messages'] == 1200
+    assert [r['chat'] for r in summary['results'] if r['status'] == 'failed'] == [os.path.join(exports, 'empty.txt')]
+
+    # The tables hold the same numbers /analyze returns
+    chat = os.path.join(exports, 'chat1.txt')
+    body = analyze_chat_bytes(chats['chat1.txt'], cached=False, sections=sorted(s for t in cli.TABLES.values() for s in t))
+    timelines = pd.read_parquet(os.path.join(out, 'timelines.parquet'))
+    daily = timelines[(timelines['chat'] == chat) & (timelines['user'] == 'Overall') & (timelines['granularity'] == 'daily')]
+    assert daily['message_count'].tolist() == [p['message_count'] for p in body['analytics']['Overall']['daily_timeline']]
+    assert set(timelines['granularity']) == {'daily', 'hourly', 'weekly', 'monthly', 'quarterly', 'yearly'}
+
+    users = pd.read_parquet(os.path.join(out, 'users.parquet'))
+    assert list(users.columns) == cli.COLUMNS['users']
+    rows = users[users['chat'] == chat].set_index('user')
+    assert list(rows.index) == body['users']
+    assert rows.loc['Overall', 'messages'] == 400
+    assert rows.loc['Overall', 'conversations_started'] == sum(body['analytics']['Overall']['conversation_initiator'].values())
+    # The zipped copy of chat1 gives the same rows as the file
+    zipped = users[users['chat'] == os.path.join(exports, 'tenant.zip', 'chat1.txt')].set_index('user')
+    assert zipped.drop(columns='chat').equals(rows.drop(columns='chat'))
+
+    sentiment = pd.read_parquet(os.path.join(out, 'sentiment.parquet'))
+    overall = sentiment[(sentiment['chat'] == chat) & (sentiment['user'] == 'Overall')].iloc[0]
+    assert overall['positive_percentage'] == body['analytics']['Overall']['sentiment_analysis']['positive_percentage']
+
+    # Only the requested tables are written
+    out = tempfile.mkdtemp()
+    assert cli.main(['analyze', chat, '--jobs', '0', '--no-cache', '--tables', 'sentiment', '--format', 'csv', '--out', out]) == 0
+    assert sorted(os.listdir(out)) == ['sentiment.csv', 'summary.json']
+
+if __name__ == "__main__":
+    test_cli_analyze()
@@ -0,0 +1,79 @@
+import pandas as pd
+from app.incremental import ChatStore, block_hashes
+from app.aggregates import MessageAggregates
+from app.analytics import most_common_words, emoji_analysis
+from app.preprocess import preprocess_whatsapp_text
+from ml.sentiment_inference import attach_sentiment_to_df
+
+def mock_export(days):
+    lines = []
+    for day in range(1, days + 1):
+        date = pd.Timestamp('2023-01-01') + pd.Timedelta(days=day - 1)
+        stamp = date.strftime('%d/%m/%y')
+        lines += [
+            f"{stamp}, 10:00 am - Alice: good morning everyone 😀",
+            f"{stamp}, 10:00 am - Bob: morning! lunch plans today? 🍕🍕",
+            f"{stamp}, 10:05 am - Alice: pizza sounds great\nsee you there",
+            f"{stamp}, 10:06 am - Bob: <Media omitted>",
+        ]
+    return "\n".join(lines) + "\n"
+
+def assert_same_aggregates(agg, ref):
+    for user in ref.words:
+        assert list(agg.words[user].items()) == list(ref.words[user].items())
+        assert list(agg.emojis.get(user, {}).items()) == list(ref.emojis.get(user, {}).items())
+
+def test_aggregates_match_analytics():
+    print("Testing word/emoji aggregates against analytics...")
+    df = preprocess_whatsapp_text(mock_export(5))
+    agg = MessageAggregates.from_frame(df)
+    for user in ['Overall', 'Alice', 'Bob']:
+        user_df = df if user == 'Overall' else df[df['user'] == user]
+        assert agg.most_common_words(user).to_dict() == most_common_words(user_df, user).to_dict()
+        assert agg.emoji_analysis(user).to_dict() == emoji_analysis(user_df, user).to_dict()
+
+    # Taking messages out and putting them back gives the same counts
+    agg.subtract(df.iloc[12:])
+    agg.add(df.iloc[12:])
+    assert_same_aggregates(agg, MessageAggregates.from_frame(df))
+
+def test_incremental_parse():
+    print("Testing incremental parse of a grown export...")
+    old, new = mock_export(30), mock_export(45)
+    store = ChatStore(block_chars=512)
+    assert len(block_hashes(old, 512)) > 5
+
+    store.parse(old)
+    df, agg = store.parse(new)
+    assert store.stats["incremental"] == 1 and store.stats["reused_messages"] > 0
+
+    ref = attach_sentiment_to_df(preprocess_whatsapp_text(new))
+    pd.testing.assert_frame_equal(df, ref)
+    assert_same_aggregates(agg, MessageAggregates.from_frame(ref))
+
+    # An identical upload reuses the stored chat instead of storing a second copy
+    stored, used = len(store._chats), store._bytes
+    again, _ = store.parse(new)
+    assert again is df and (len(store._chats), store._bytes) == (stored, used)
+    assert store.stats == {"full": 1, "incremental": 2, "reused_messages": store.stats["reused_messages"]}
+
+    # An unrelated chat is parsed from scratch
+    store.parse(new.replace("Alice", "Carol"))
+    assert store.stats["full"] == 2
+
+    # The store is bounded by the memory its frames use, not by chat count
+    size = store._chats[next(reversed(store._chats))].nbytes
+    small = ChatStore(max_bytes=size, block_chars=512)
+    small.parse(new)
+    small.parse(new.replace("Alice", "Carol"))
+    assert len(small._chats) == 1 and small._bytes == size
+    small.parse(new)
+    assert small.stats["full"] == 3
+    # A chat over the budget is not kept at all
+    tiny = ChatStore(max_bytes=size - 1, block_chars=512)
+    tiny.parse(new)
+    assert not tiny._chats and not tiny._index
+
+if __name__ == "__main__":
+    test_aggregates_match_analytics()
+    test_incremental_parse()
@@ -0,0 +1,36 @@
+import asyncio
+from benchmarks import load
+
+def test_load_harness():
+    print("Testing the load harness against a local server...")
+    assert load.parse_mix('1k:3,10k') == [(1000, 0.75), (10000, 0.25)]
+    mix = [(200, 1.0)]
+    uploads = load.build_uploads([200], users=3)
+
+    async def scenario():
+        # One worker and no wait queue: of three simultaneous uploads, the ones
+        # that find the worker busy are turned away with 429
+        async with load.Server(workers=1, queue=0) as server:
+            status, _, body = await load.http_request(server.host, server.port, 'GET', '/health', timeout=10)
+            assert status == 200 and b'"ok"' in body
+            assert load.process_memory(server.process.pid) > 0
+            samples = []
+            sampler = asyncio.ensure_future(load.sample_memory(server.process.pid, samples, interval=0.05))
+            try:
+                records = await load.run_load(server.host, server.port, uploads, mix, requests=3, concurrency=3, log=lambda line: None)
+            finally:
+                sampler.cancel()
+            return records, samples
+
+    records, samples = asyncio.run(scenario())
+    report = load.summarize(records, samples, {"concurrency": 3, "rate": None, "server": {}})
+    assert report["requests"] == 3
+    statuses = sorted(str(r["status"]) for r in records)
+    assert statuses[0] == "200" and set(statuses) <= {"200", "429"}
+    assert report["errors"].get("429", 0) == statuses.count("429")
+    assert report["latency"]["p50"] > 0 and report["by_size"]["200"]["ok"] == statuses.count("200")
+    assert report["server_memory"]["peak_mb"] > 0
+    assert "closed" in load.format_comparison([report, report], ["a", "b"])
+
+if __name__ == "__main__":
+    test_load_harness()
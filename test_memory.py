@@ -0,0 +1,66 @@
+import json
+import os
+from benchmarks.bench import THRESHOLDS_PATH, Chat
+from benchmarks import memory
+from ml.sentiment_inference import attach_sentiment_to_df
+
+chat = Chat(2000, 4)
+
+def test_memory_probes():
+    print("Testing memory probes...")
+    result = memory.measure(chat, lambda c: attach_sentiment_to_df(c.parsed))
+    assert result["peak_traced_bytes"] > 0
+    assert result["full_frame_copies"] == [] and result["mutated"] == []
+
+    # A stage that writes into its input is caught
+    def mutate(c):
+        c.df['hour'] = c.df['hour'] + 1
+    try:
+        assert memory.measure(chat, mutate)["mutated"] == ["df"]
+    finally:
+        chat._df = None
+
+    report = {"sizes": [10000], "results": {
+        "lean": {10000: {"peak_traced_bytes": 10**6, "peak_rss_bytes": None, "full_frame_copies": [], "mutated": []}},
+        "copier": {10000: {"peak_traced_bytes": 10**6, "peak_rss_bytes": 10**8, "full_frame_copies": ["app/x.py:f"], "mutated": ["df"]}},
+    }}
+    failures = memory.check(report, {"memory": {"max_peak_bytes_per_message": 1000}})
+    assert len(failures) == 3 and all(failure.startswith("copier:") for failure in failures)
+
+def test_copy_tracker():
+    print("Testing full-frame copies made inside pandas...")
+    # Like assign() before pandas 3: copy(deep=None) inside pandas, called for project code
+    namespace = {}
+    exec(compile("def assign_like(df):\n    return df.copy(deep=None)\n",
+                 os.path.join(memory._PANDAS_DIR, "core", "generic.py"), "exec"), namespace)
+    exec(compile("def stage(df):\n    return assign_like(df)\n",
+                 os.path.abspath(os.path.join(os.path.dirname(memory.__file__), "..", "ml", "stage.py")), "exec"), namespace)
+    with memory.CopyTracker([chat.parsed], copy_on_write=False) as copies:
+        namespace["stage"](chat.parsed)
+    assert copies.sites == [os.path.join("ml", "stage.py") + ":stage"]
+    with memory.CopyTracker([chat.parsed], copy_on_write=True) as copies:
+        namespace["stage"](chat.parsed)
+    assert copies.sites == []
+
+    # Sentiment shares the input's columns even without copy-on-write
+    with memory.CopyTracker([chat.parsed], copy_on_write=False) as copies:
+        attach_sentiment_to_df(chat.parsed)
+    assert copies.sites == []
+
+def test_stage_memory_budgets():
+    print("Testing per-stage memory budgets...")
+    # Request-path stages at 10k messages. Per-message Python loops (sentiment,
+    # emoji and word counting) and topic fits are many times slower under
+    # tracemalloc and are left to python -m benchmarks.memory
+    slow = {'attach_sentiment_to_df', 'emoji_analysis', 'MessageAggregates.from_frame'}
+    report = memory.run([10000], users=6, groups={'parse', 'sentiment', 'analytics', 'ml'}, skip=slow, log=lambda line: None)
+    with open(THRESHOLDS_PATH, encoding='utf-8') as f:
+        thresholds = json.load(f)
+    assert memory.check(report, thresholds) == []
+    # The daily timeline no longer copies the frame to add a date column
+    assert report["results"]["daily_timeline"][10000]["full_frame_copies"] == []
+
+if __name__ == "__main__":
+    test_memory_probes()
+    test_copy_tracker()
+    test_stage_memory_budgets()
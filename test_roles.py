@@ -1,9 +1,10 @@
 import pandas as pd
 import numpy as np
-from ml.roles import assign_participant_roles
+from ml.roles import assign_participant_roles, build_role_matrix, top_k, METRICS
+from app.analytics import conversation_initiator
 import json
 
-def test_roles_6():
+def mock_chat():
     # Create mock chat data with some late-night messages for Charlie
     data = {
         'date': pd.to_datetime([
@@ -27,7 +28,10 @@ def test_roles_6():
         'hour': [10, 10, 10, 9, 9, 9, 23, 1, 11, 11, 11],
         'day_name': ['Sunday', 'Sunday', 'Sunday', 'Monday', 'Monday', 'Monday', 'Tuesday', 'Tuesday', 'Wednesday', 'Wednesday', 'Wednesday']
     }
-    df = pd.DataFrame(data)
+    return pd.DataFrame(data)
+
+def test_roles_6():
+    df = mock_chat()
     df['only_date'] = df['date'].dt.date
     
     print("Testing 6-Role Assignment (with Night Owl)...")
@@ -43,5 +47,22 @@ def test_roles_6():
     
     print("\nSUCCESS: 6 roles correctly identified, filling the 2x3 grid.")
 
+def test_role_matrix():
+    df = mock_chat()
+    print("Testing vectorized role matrix...")
+    users, matrix = build_role_matrix(df)
+    assert list(users) == ['Alice', 'Bob', 'Charlie']
+    msg_count = matrix[:, METRICS.index('msg_count')]
+    assert list(msg_count) == [5, 4, 2]
+    assert matrix[users.tolist().index('Charlie'), METRICS.index('night_msgs')] == 2
+
+    # Ties keep first-appearance order, largest first
+    assert list(top_k(np.array([1.0, 3.0, 3.0, 2.0, 3.0]))) == [1, 2, 4]
+    assert list(top_k(np.array([2.0, 5.0]))) == [1, 0]
+
+    # Precomputed initiators give the same roles
+    assert assign_participant_roles(df, initiators=conversation_initiator(df)) == assign_participant_roles(df)
+
 if __name__ == "__main__":
     test_roles_6()
+    test_role_matrix()
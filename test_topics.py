@@ -1,5 +1,7 @@
 import pandas as pd
-from app.topics import get_topics_analytics, get_topic_timeline
+import app.topics as topics_module
+from app.topics import get_topics_analytics, get_topic_timeline, run_topics_analytics, chat_fingerprint
+from ml.topic_modeling import build_doc_term_matrix, extract_topics, TopicModeler, TOPIC_ENGINES
 
 # Mock data
 data = {
@@ -31,5 +33,50 @@ def test_topics():
         for t in item['topics']:
             print(f"  Topic {t['topic_id']}: {', '.join(t['words'])}")
 
+def test_topics_doc_term_matrix():
+    print("\nTesting shared document-term matrix...")
+    dtm = build_doc_term_matrix(df)
+    assert dtm.shape[0] == len(df)
+    assert get_topics_analytics(df, dtm=dtm) == get_topics_analytics(df)
+    assert get_topics_analytics(df, 'Alice', dtm=dtm) == get_topics_analytics(df, 'Alice')
+    assert 'month_year' not in df.columns
+    print("Top terms:", dtm.term_counts(top_n=5).to_dict())
+
+def test_topic_engines():
+    print("\nTesting topic engines...")
+    dtm = build_doc_term_matrix(df)
+    for engine in TOPIC_ENGINES:
+        topics = extract_topics(df, n_topics=3, dtm=dtm, engine=engine, time_budget=5)
+        print(f"{engine}: {[t['words'][:3] for t in topics]}")
+        assert len(topics) == 3, f"Engine {engine} returned {len(topics)} topics"
+
+    # An exhausted budget still returns the best-so-far topics
+    modeler = TopicModeler(n_topics=3, engine='online_lda', time_budget=1e-9)
+    topics = modeler.fit_matrix(dtm.rows(), dtm.feature_names)
+    assert modeler.timed_out and len(topics) == 3
+
+def test_topic_jobs():
+    print("\nTesting deadline-bound, cached topic jobs...")
+    dtm = build_doc_term_matrix(df)
+    fingerprint = chat_fingerprint(df)
+
+    result = run_topics_analytics(df, dtm=dtm, fingerprint=fingerprint)
+    assert result == {"topics": get_topics_analytics(df, dtm=dtm), "timed_out": False}
+    assert (fingerprint, 'Overall', None) in topics_module._cache
+
+    # A job that cannot finish in time comes back empty and flagged
+    timeout = topics_module.TOPIC_JOB_TIMEOUT
+    topics_module.TOPIC_JOB_TIMEOUT = 0
+    try:
+        result = run_topics_analytics(df, 'Alice', dtm=dtm, fingerprint=fingerprint)
+    finally:
+        topics_module.TOPIC_JOB_TIMEOUT = timeout
+    assert result == {"topics": [], "timed_out": True}
+    # Nothing partial is cached
+    assert (fingerprint, 'Alice', None) not in topics_module._cache
+
 if __name__ == "__main__":
     test_topics()
+    test_topics_doc_term_matrix()
+    test_topic_engines()
+    test_topic_jobs()